@@ -0,0 +1,187 @@
+##################################################################################################################
+# Author: Vishal Kumar
+# Email: vishalkmr01123@gmail.com
+#
+# This file contains the AsyncPipeline class, an asyncio facade of the GStreamerPipeline classes.
+# The wrapped pipeline is created without main loop thread: its bus messages and the frames queued by its appsink
+# are handed to the event loop with call_soon_threadsafe from the Gstreamer threads, so awaiting a pipeline never
+# takes a thread and one event loop can drive hundreds of pipelines.
+#
+# Example:
+#     pipeline = AsyncPipeline(FilePipeline, config)
+#     await pipeline.start()
+#     async for frame in pipeline.frames():
+#         ...
+#     await pipeline.update_properties({"x264enc": {"bitrate": 4000}})
+#     ok = await pipeline.wait_eos()
+##################################################################################################################
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+import asyncio, queue
+from pipeline import FilePipeline
+
+
+class AsyncPipeline:
+    """
+    Drives a GStreamerPipeline from an asyncio event loop.
+    """
+    def __init__(self, pipeline_class=FilePipeline, config=None, loop=None):
+        """
+        Args:
+            pipeline_class (type, optional): The GStreamerPipeline subclass building the pipeline, created with (config, main_loop=False). Defaults to FilePipeline.
+            config (PipelineConfig, optional): The configuration of the pipeline. Defaults to the default PipelineConfig.
+            loop (asyncio.AbstractEventLoop, optional): The event loop driving the pipeline. Defaults to the running event loop.
+        """
+        self.loop = loop if loop is not None else asyncio.get_running_loop()
+        self.pipeline = pipeline_class(config, main_loop=False)
+        self.pipeline.message_handler = self.message_handler
+        self.pipeline.elements.frame_callback = self.frame_callback
+        self.finished = self.loop.create_future()
+        self.async_done = None
+        self.frame_event = asyncio.Event()
+
+    def message_handler(self, message):
+        # Called from the thread posting the message
+        self.loop.call_soon_threadsafe(self.handle_message, message)
+
+    def frame_callback(self):
+        # Called from the appsink streaming thread, the event loop is woken up only if the event isn't set already
+        if not self.frame_event.is_set():
+            self.loop.call_soon_threadsafe(self.frame_event.set)
+
+    def handle_message(self, message):
+        pipeline = self.pipeline
+        if message.type == Gst.MessageType.ASYNC_DONE:
+            if message.src == pipeline.pipeline and self.async_done is not None and not self.async_done.done():
+                self.async_done.set_result(True)
+            return
+        if message.type in (Gst.MessageType.EOS, Gst.MessageType.ERROR):
+            # The teardown (state change to NULL, result cache copy...) must not block the other pipelines of the loop
+            self.loop.create_task(self.teardown(message))
+            return
+        pipeline.bus_message(pipeline.bus, message, pipeline.pipeline, pipeline.loop)
+
+    async def teardown(self, message):
+        pipeline = self.pipeline
+        await self.loop.run_in_executor(None, pipeline.bus_message, pipeline.bus, message, pipeline.pipeline, pipeline.loop)
+        if pipeline.finished.is_set() and not self.finished.done():
+            self.finished.set_result(pipeline.eos_occurred)
+            if self.async_done is not None and not self.async_done.done():
+                self.async_done.set_result(False)
+            # The frames() consumers see the end of the stream
+            self.frame_event.set()
+
+    async def state_change(self, change):
+        """
+        Runs a state change (or a flushing seek) of the pipeline and waits until it is complete i.e. the pipeline has prerolled.
+
+        Args:
+            change (callable): Changes the state and returns the Gst.StateChangeReturn, or a bool for a seek.
+
+        Returns:
+            bool: False if the change failed or the pipeline finished meanwhile.
+        """
+        self.async_done = self.loop.create_future()
+        result = change()
+        if result is False or result == Gst.StateChangeReturn.FAILURE:
+            return False
+        if result is True or result == Gst.StateChangeReturn.ASYNC:
+            return await self.async_done
+        return True
+
+    async def start(self):
+        """
+        Starts the pipeline and waits until it is playing, an input with a time range is prerolled and seeked first.
+
+        Returns:
+            bool: False if the pipeline could not be started.
+        """
+        pipeline = self.pipeline
+        config = pipeline.config
+        if (config.start_time is not None or config.end_time is not None) and not pipeline.replaying:
+            # The demuxer accepts the seek only once it has prerolled
+            if not await self.state_change(lambda: pipeline.pipeline.set_state(Gst.State.PAUSED)):
+                return False
+            if pipeline.processor is not None:
+                # The live appsrc of the frame processor doesn't preroll, the input is prerolled once its appsink is
+                await self.loop.run_in_executor(None, pipeline.processor.prerolled.wait, 10)
+            if not await self.state_change(lambda: pipeline.seek(config.start_time, config.end_time)):
+                print(f"Warning: Seek to [{config.start_time}, {config.end_time}] failed, processing the whole input")
+        return await self.state_change(pipeline.play)
+
+    async def pause(self):
+        return self.pipeline.pause()
+
+    async def resume(self):
+        return self.pipeline.resume()
+
+    async def stop(self):
+        """
+        Sends EOS and waits until the pipeline has finished.
+        """
+        self.pipeline.stop()
+        return await self.wait_eos()
+
+    async def wait_eos(self, timeout=None):
+        """
+        Waits until the pipeline has finished i.e. EOS or an error occurred.
+
+        Args:
+            timeout (float, optional): The maximal time to wait in seconds. Defaults to waiting forever.
+
+        Returns:
+            bool: True if the pipeline reached EOS, False on error or timeout.
+        """
+        try:
+            return await asyncio.wait_for(asyncio.shield(self.finished), timeout)
+        except asyncio.TimeoutError:
+            return False
+
+    async def frames(self):
+        """
+        Yields the frames (utils.Frame) of the appsink until the pipeline has finished and all the queued frames are consumed,
+        the batches (utils.FrameBatch) when config.batch_size or config.batch_ms is set.
+        With config.frame_mode "lossless" the pipeline waits for the consumer, with "latest" only the newest frame is kept.
+        """
+        try:
+            async for frame in self.frame_stream():
+                yield frame
+        finally:
+            # Nobody fetches the frames anymore, the lossless appsink must not block the pipeline
+            self.pipeline.elements.flushing = True
+
+    async def frame_stream(self):
+        while True:
+            try:
+                frame = self.pipeline.fetch_frame(block=False)
+            except queue.Empty:
+                frame = None
+            if frame is not None:
+                yield frame
+                continue
+            if self.finished.done():
+                return
+            self.frame_event.clear()
+            # A frame queued between fetch_buffer and clear is not waited for
+            if self.pipeline.elements.buffer_queue.empty():
+                await self.frame_event.wait()
+
+    async def update_properties(self, changes):
+        """
+        Changes properties of the elements of the running pipeline and waits until they are applied (at the next frame).
+
+        Args:
+            changes (dict): The new values of the properties by element name e.g. {"x264enc": {"bitrate": 4000}}.
+
+        Returns:
+            bool: False if an element or a property doesn't exist.
+        """
+        applied = self.loop.create_future()
+        on_applied = lambda: self.loop.call_soon_threadsafe(lambda: applied.done() or applied.set_result(True))
+        if not self.pipeline.update_properties(changes, on_applied):
+            return False
+        # The batch is never applied if the pipeline finishes before its next frame
+        await asyncio.wait({applied, self.finished}, return_when=asyncio.FIRST_COMPLETED)
+        return applied.done()
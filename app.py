@@ -11,6 +11,9 @@
 
 import streamlit as st
 from pipeline import Pipeline , TestPipeline
+from media_server import get_media_server
+from memory import MB, process_rss
+from streamlit_player import st_player
 import random, time, string, os
 from PIL import Image
 import glob
@@ -80,32 +83,48 @@ class Player:
                 txt1 = st.empty()
                 txt2 = st.empty()
                 txt3 = st.empty()
+                memory_txt = st.empty()
                 # Display the saved output when pipeline is stope
                 if st.session_state.output_available:
+                    output_file = st.session_state.pipeline.output_path()
+                    media_server = get_media_server()
                     # Load the image from file
                     if st.session_state.image_input:
-                        image = Image.open(f"output/{st.session_state.username}_output.{st.session_state.out_ext}")
+                        image = Image.open(output_file)
                         window.image(image)
                     
-                    # Load the video from file
+                    # Stream the video from the media server, the browser fetches it with range requests
                     else:
-                        video = open(f"output/{st.session_state.username}_output.{st.session_state.out_ext}", 'rb')
-                        video_bytes = video.read()
+                        self.play_video(window, media_server.url(output_file))
 
-                        window.video(video_bytes)
-
-                    print(f"INFO: Output File output/{st.session_state.username}_output.{st.session_state.input_ext} is Uploaded")
-                    # Download button
+                    print(f"INFO: Output File {output_file} is Uploaded")
+                    # Download link served from the disk by the media server, HLS output is only streamed
                     col1 , col2 , col3= st.columns(3)
-                    with open(f"output/{st.session_state.username}_output.{st.session_state.out_ext}", "rb") as file:
-                        btn = col2.download_button(
-                                label="Download 🔽",
-                                data=file,
-                                file_name=f"output.{st.session_state.out_ext}")
+                    if st.session_state.image_input or st.session_state.output_mode != "hls":
+                        col2.markdown(f"<a href='{media_server.url(output_file, download=f'output.{st.session_state.out_ext}')}' download>Download 🔽</a>", unsafe_allow_html=True)
                         
+                # Keep the last frame while the pipeline is paused, nothing runs until it is resumed
+                elif st.session_state.status == "pause":
+                    txt1.text(f"Paused at OutFrame->{st.session_state.pipeline.out_frame_num}")
+                    if st.session_state.pipeline.last_frame is not None:
+                        window.image(st.session_state.pipeline.last_frame,use_column_width="always")
+
                 # Display the intermediate frames if pipeline is running
                 elif st.session_state.status == "play":
+                  recording_txt = st.empty()
+                  recording = st.empty()
+                  recording_shown = False
                   while True:
+                        # Fragmented MP4/HLS recordings are playable as soon as the first fragment is written
+                        if not recording_shown and st.session_state.pipeline.elements.first_output_time is not None:
+                            recording_txt.text(f"Recording playable after {round(st.session_state.pipeline.elements.first_output_time - st.session_state.pipeline.start_time, 2)}s")
+                            self.play_video(recording, get_media_server().url(st.session_state.pipeline.output_path()))
+                            recording_shown = True
+
+                        # Frames in flight, the new frames are dropped once the memory budget of the session is reached
+                        memory = st.session_state.pipeline.memory.report()
+                        memory_txt.text(f"Memory : {memory['queued_frames']} frames queued ({memory['queued_bytes'] / MB:.1f} MB)   Dropped : {memory['dropped_frames']}   RSS : {process_rss() / MB:.0f} MB")
+
                         # Get the current state of the pipeline and call stop if pipeline is NULL state
                         ret, state, _ = st.session_state.pipeline.pipeline.get_state(0)
                         if ret == Gst.StateChangeReturn.SUCCESS:
@@ -117,9 +136,12 @@ class Player:
                             try:
                                 txt1.text(f"\nInFrame->{st.session_state.pipeline.elements.in_frame_num} OutFrame->{st.session_state.pipeline.out_frame_num}")
                                 txt2.text(f"TotalFrame->{st.session_state.max_frame}")
-                                txt3.text(f"InFPS : {round(st.session_state.pipeline.elements.in_frame_num/(time.time()-st.session_state.pipeline.elements.in_time),2)}   OutFPS : {round(st.session_state.pipeline.out_frame_num/(time.time()-st.session_state.pipeline.out_time),2)}")
-                                image = st.session_state.pipeline.fetch_buffer()
-                                window.image(image,use_column_width="always")
+                                # The time spent paused doesn't count in the frame rates
+                                elapsed = time.time() - st.session_state.pipeline.start_time - st.session_state.pipeline.paused_duration
+                                txt3.text(f"InFPS : {round(st.session_state.pipeline.elements.in_frame_num/elapsed,2)}   OutFPS : {round(st.session_state.pipeline.out_frame_num/elapsed,2)}")
+                                # Only the newest frame is kept for the preview, a slow browser never lags behind the pipeline
+                                frame = st.session_state.pipeline.fetch_frame()
+                                window.image(frame.image,use_column_width="always")
                             except Exception as e:
                                 pass
 
@@ -143,6 +165,14 @@ class Player:
                         #         st.rerun()
 
 
+    def play_video(self, window, url):
+        # Browsers play HLS only through the player of streamlit-player (hls.js)
+        if url.split("?")[0].endswith(".m3u8"):
+            with window.container():
+                st_player(url)
+        else:
+            window.video(url)
+
     def clear_user_data(self):
         # Get a list of all files that start with 'output/{st.session_state.username}_output'
         files = glob.glob(f"output/{st.session_state.username}_output*")
@@ -170,10 +200,14 @@ class Player:
             st.session_state.pipeline.output_controls()
 
             # Define the start and stop buttons
-            col1,col2,col3 = st.columns(3)
+            col1,col2,col3,col4 = st.columns(4)
             col1.button("Start",on_click=self.start)
-            col2.button("Stop",on_click=self.stop)
-            col3.button("Reset",on_click=self.default_params,disabled=(st.session_state.status == "play"))
+            if st.session_state.status == "pause":
+                col2.button("Resume",on_click=self.resume)
+            else:
+                col2.button("Pause",on_click=self.pause,disabled=(st.session_state.status != "play"))
+            col3.button("Stop",on_click=self.stop)
+            col4.button("Reset",on_click=self.default_params,disabled=(st.session_state.status != "stop"))
 
             # Debug session state
             st.write(st.session_state)
@@ -183,8 +217,8 @@ class Player:
             pass
 
     def start(self):
-        # Stop the already running pipeline
-        if st.session_state.status == "play":
+        # Stop the already running (or paused) pipeline
+        if st.session_state.status != "stop":
             self.stop()
         # Start the pipeline
         st.session_state.status = "play"
@@ -197,14 +231,33 @@ class Player:
         
         st.session_state.pipeline.start()
 
+        # The output was restored from the result cache, there is no pipeline to wait for
+        if st.session_state.pipeline.result_hit:
+            st.session_state.status = "stop"
+            st.session_state.output_available = True
+        # The stills are done synchronously, there is no pipeline to wait for
+        elif st.session_state.input_method == "FileSrc" and st.session_state.image_input:
+            st.session_state.status = "stop"
+            result = st.session_state.pipeline.still_result
+            st.session_state.output_available = result is not None and result["output"] is not None
+
+    def pause(self):
+        # Pause the pipeline, the graph is kept so resuming doesn't rebuild it
+        if st.session_state.status == "play" and st.session_state.pipeline.pause():
+            st.session_state.status = "pause"
+
+    def resume(self):
+        if st.session_state.status == "pause" and st.session_state.pipeline.resume():
+            st.session_state.status = "play"
+
     def stop(self):
         # Stop the pipeline when the stop button is clicked
         if st.session_state.status != "stop":
             st.session_state.status = "stop"
             st.session_state.pipeline.stop()
             while True:
-                if  os.path.isfile(f"output/{st.session_state.username}_output.{st.session_state.out_ext}"):
-                    print(f"INFO: Output File output/{st.session_state.username}_output.{st.session_state.out_ext} is Saved")
+                if  os.path.isfile(st.session_state.pipeline.output_path()):
+                    print(f"INFO: Output File {st.session_state.pipeline.output_path()} is Saved")
                     st.session_state.output_available = True
                     # st.session_state.pipeline.eos_occurred = False
                     time.sleep(1)
@@ -0,0 +1,181 @@
+##################################################################################################################
+# Author: Vishal Kumar
+# Email: vishalkmr01123@gmail.com
+#
+# This file contains the headless batch processing command line, it needs neither the streamlit app nor a browser.
+# Every input runs through the same element graph as the app [read_input -> videoconvert -> write_output]
+# using the FilePipeline class, N pipelines run concurrently. The MP4 inputs written to MP4 outputs are remuxed
+# without re-encoding unless --reencode is given.
+# With --sequence every directory/glob pattern of jpg/png frames is processed as one stream by a single pipeline,
+# it is written as a video or, with --ext jpg/png, as a numbered image sequence.
+# The throughput of every file is reported and a machine readable summary (json) is written at the end.
+#
+# Usage:
+#     python batch.py input/*.mp4 input/images -o output/batch -j 4
+#     python batch.py input/clips --ext mp4 --mode fmp4 --summary summary.json
+#     python batch.py --sequence input/frames "input/shots/*.png" --framerate 25 --ext mp4
+##################################################################################################################
+
+import os, sys, glob, json, time, argparse
+from concurrent.futures import ThreadPoolExecutor
+from pipeline import FilePipeline
+from still import get_still_processor
+from config import PipelineConfig
+from sequence import is_sequence
+
+# Extensions of the inputs supported by read_input
+INPUT_EXTENSIONS = ("mp4", "h264", "jpg", "png")
+
+
+def collect_inputs(inputs):
+    """
+    Expands the files, directories and glob patterns given on the command line into the list of input files.
+    """
+    files = []
+    for item in inputs:
+        if os.path.isdir(item):
+            paths = sorted(os.path.join(item, name) for name in os.listdir(item))
+        elif os.path.isfile(item):
+            paths = [item]
+        else:
+            paths = sorted(glob.glob(item))
+        files.extend(path for path in paths if os.path.isfile(path) and path.split(".")[-1].lower() in INPUT_EXTENSIONS)
+    return files
+
+
+def collect_sequences(inputs):
+    """
+    Keeps the directories and glob patterns given on the command line, every one of them is an image sequence input.
+    """
+    return [item for item in inputs if is_sequence(item)]
+
+
+def output_name(input_file):
+    """
+    Returns the output name of an input i.e. the name of the file without extension or of the sequence directory.
+    """
+    if is_sequence(input_file):
+        return os.path.basename(os.path.normpath(input_file if os.path.isdir(input_file) else os.path.dirname(input_file) or "sequence"))
+    return os.path.splitext(os.path.basename(input_file))[0]
+
+
+def output_names(inputs):
+    """
+    Returns the output name of every input, the inputs sharing a name (a/clip.mp4 and b/clip.mp4, clip.mp4 and clip.h264)
+    get a numeric suffix so their concurrent pipelines don't overwrite each other's output.
+    """
+    names = [output_name(input_file) for input_file in inputs]
+    used = set()
+    for i, name in enumerate(names):
+        candidate, suffix = name, 1
+        while candidate in used or (candidate != name and candidate in names):
+            suffix += 1
+            candidate = f"{name}_{suffix}"
+        if candidate != name:
+            print(f"Warning: {inputs[i]} is written as {candidate}, another input has the output name {name}", file=sys.stderr)
+        used.add(candidate)
+        names[i] = candidate
+    return names
+
+
+def process_file(input_file, output_dir, out_ext, output_mode, fragment_duration, timeout, passthrough=True, framerate=30, output_file=None):
+    """
+    Runs one input (a file or an image sequence) through a FilePipeline and returns its summary.
+    """
+    input_ext = input_file.split(".")[-1].lower()
+    if is_sequence(input_file):
+        # The image sequences get the requested output, a video or an image sequence
+        file_ext = out_ext
+    else:
+        # The images keep an image output, the videos get the requested one
+        file_ext = out_ext if input_ext in ("mp4", "h264") else (out_ext if out_ext in ("jpg", "png") else "jpg")
+    output_file = output_file or output_name(input_file)
+    result = {"input": input_file, "output": None}
+
+    begin = time.time()
+    try:
+        config = PipelineConfig(input_method="FileSrc", input_file=input_file, appsink_enabled=False, output_dir=output_dir, output_file=output_file, out_ext=file_ext, output_mode=output_mode, fragment_duration=fragment_duration, passthrough=passthrough, framerate=framerate)
+        result["remux"] = config.remux
+        result["output"] = config.output_path()
+        if config.image_input:
+            # The stills don't need a pipeline, they are decoded and encoded synchronously
+            result["output"] = get_still_processor().process(config)["output"]
+            result["frames"] = 1
+        else:
+            pipeline = FilePipeline(config)
+            pipeline.start()
+            ok = pipeline.wait_eos(timeout)
+            result["frames"] = pipeline.frame_count
+            if not ok:
+                pipeline.stop()
+                result["error"] = str(pipeline.error) if pipeline.error else f"timeout after {timeout}s"
+    except Exception as e:
+        result["frames"] = 0
+        result["error"] = str(e)
+
+    result["seconds"] = round(time.time() - begin, 3)
+    result["fps"] = round(result["frames"] / result["seconds"], 2) if result["seconds"] > 0 else None
+    result["status"] = "error" if "error" in result else "ok"
+    return result
+
+
+def run_batch(inputs, output_dir="output", out_ext="mp4", output_mode="mp4", fragment_duration=1000, jobs=2, timeout=None, passthrough=True, framerate=30):
+    """
+    Processes the inputs with `jobs` concurrent pipelines.
+
+    Returns:
+        dict: The summary of the batch, i.e. the settings, the totals and the result of every file.
+    """
+    begin = time.time()
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(process_file, input_file, output_dir, out_ext, output_mode, fragment_duration, timeout, passthrough, framerate, output_file)
+                   for input_file, output_file in zip(inputs, output_names(inputs))]
+        results = []
+        for future in futures:
+            result = future.result()
+            results.append(result)
+            print(f"INFO: {result['input']} --> {result['output']} [{result['status']}] {result['frames']} frames in {result['seconds']}s ({result['fps']} fps)", file=sys.stderr)
+
+    seconds = time.time() - begin
+    frames = sum(result["frames"] for result in results)
+    return {
+        "settings": {"output_dir": output_dir, "ext": out_ext, "mode": output_mode, "fragment_duration": fragment_duration, "jobs": jobs, "passthrough": passthrough, "framerate": framerate},
+        "files": len(results),
+        "failed": sum(result["status"] != "ok" for result in results),
+        "frames": frames,
+        "seconds": round(seconds, 3),
+        "fps": round(frames / seconds, 2) if seconds > 0 else None,
+        "results": results,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Process a set of image/video files through the Gstreamer pipeline without the streamlit app")
+    parser.add_argument("inputs", nargs="+", help="input files, directories or glob patterns")
+    parser.add_argument("-o", "--output-dir", default="output", help="directory of the outputs (default: output)")
+    parser.add_argument("--ext", default="mp4", choices=["mp4", "jpg", "png"], help="extension of the video outputs (default: mp4)")
+    parser.add_argument("--mode", default="mp4", choices=["mp4", "fmp4", "hls"], help="container of the video outputs (default: mp4)")
+    parser.add_argument("--fragment-duration", type=int, default=1000, help="duration of the fragments/segments in ms (default: 1000)")
+    parser.add_argument("--reencode", action="store_true", help="decode and re-encode the MP4 inputs instead of copying their H.264 stream")
+    parser.add_argument("--sequence", action="store_true", help="process every directory/glob pattern of jpg/png frames as one stream")
+    parser.add_argument("--framerate", type=int, default=30, help="frame rate of the image sequences (default: 30)")
+    parser.add_argument("-j", "--jobs", type=int, default=2, help="number of concurrent pipelines (default: 2)")
+    parser.add_argument("--timeout", type=float, default=None, help="maximal time in seconds given to every file")
+    parser.add_argument("--summary", default="-", help="path of the json summary, - writes it to stdout (default: -)")
+    args = parser.parse_args()
+
+    inputs = collect_sequences(args.inputs) if args.sequence else collect_inputs(args.inputs)
+    if not inputs:
+        parser.error("no supported input found")
+
+    # Keep stdout for the summary, the pipeline logs go to stderr
+    summary_stream = sys.stdout
+    sys.stdout = sys.stderr
+    summary = run_batch(inputs, args.output_dir, args.ext, args.mode, args.fragment_duration, args.jobs, args.timeout, not args.reencode, args.framerate)
+    if args.summary == "-":
+        json.dump(summary, summary_stream, indent=2)
+        summary_stream.write("\n")
+    else:
+        with open(args.summary, "w") as f:
+            json.dump(summary, f, indent=2)
+    sys.exit(1 if summary["failed"] else 0)
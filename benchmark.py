@@ -0,0 +1,304 @@
+##################################################################################################################
+# Author: Vishal Kumar
+# Email: vishalkmr01123@gmail.com
+#
+# This file contains the throughput benchmark of the pipeline, it runs headless (no streamlit, no browser).
+# Every case drives the real element graph of the Pipeline class [src -> videoconvert -> tee -> sinks] with a
+# finite source, i.e. videotestsrc num-buffers=N or a clip generated beforehand at the same resolution:
+#     appsink       : tee -> queue -> capsfilter -> appsink
+#     filesink-mp4  : tee -> queue -> x264enc -> h264parse -> mp4mux -> filesink
+#     filesink-fmp4 : tee -> queue -> x264enc -> h264parse -> mp4mux (fragmented) -> filesink
+#     filesink-hls  : tee -> queue -> x264enc -> h264parse -> hlssink2
+#     tee           : appsink and filesink-mp4 branches together
+#     decode        : the generated mp4 clip decoded into both branches
+#     remux         : the generated mp4 clip copied into an mp4 file without decoding
+#     process       : blur_frame run by the frame processor before the filesink-mp4 branch, once per --workers count
+# Every case runs in its own process, so the peak RSS and the CPU time belong to that case only.
+# The frames/sec, the per-frame latency percentiles (tee -> appsink/encoder), the peak RSS and the CPU time
+# are compared against a stored baseline and the command fails if a metric regressed more than the threshold.
+#
+# Usage:
+#     python benchmark.py --save-baseline
+#     python benchmark.py --cases appsink tee --resolutions 720p 1080p --frames 600 --threshold 0.15
+#     python benchmark.py --cases process --workers 1 2 4 8
+##################################################################################################################
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+import os, sys, json, time, shutil, argparse, resource, tempfile, platform, threading, multiprocessing
+import cv2
+from concurrent.futures import ProcessPoolExecutor
+# The benchmark outputs are throwaway, they must not fill (and evict the user results of) the result cache,
+# set before the pipeline modules are imported so the spawned runs inherit it
+os.environ["RESULT_CACHE_MB"] = "0"
+from pipeline import Pipeline, GStreamerPipeline
+from config import PipelineConfig
+
+RESOLUTIONS = {"480p": (854, 480), "720p": (1280, 720), "1080p": (1920, 1080), "4K": (3840, 2160)}
+
+# Outputs of every case, the "decode" and "remux" cases read the generated clip instead of videotestsrc
+CASES = {
+    "appsink": dict(appsink_enabled=True, filesink_enabled=False),
+    "filesink-mp4": dict(appsink_enabled=False, filesink_enabled=True, output_mode="mp4"),
+    "filesink-fmp4": dict(appsink_enabled=False, filesink_enabled=True, output_mode="fmp4"),
+    "filesink-hls": dict(appsink_enabled=False, filesink_enabled=True, output_mode="hls"),
+    "tee": dict(appsink_enabled=True, filesink_enabled=True, output_mode="mp4"),
+    "decode": dict(input_method="FileSrc", appsink_enabled=True, filesink_enabled=True, output_mode="mp4", passthrough=False),
+    "remux": dict(input_method="FileSrc", appsink_enabled=False, filesink_enabled=True, output_mode="mp4"),
+    "process": dict(appsink_enabled=False, filesink_enabled=True, output_mode="mp4", frame_processor="benchmark:blur_frame"),
+}
+
+# Metrics compared with the baseline, True if a higher value is better
+METRICS = {"fps": True, "latency_p50": False, "latency_p99": False, "peak_rss_mb": False, "cpu_per_frame_ms": False}
+
+# Encoders ending the latency measurement of the filesink branch
+ENCODERS = ("x264enc", "jpegenc", "pngenc")
+
+
+def blur_frame(frame):
+    """
+    The frame processor function of the "process" case, OpenCV releases the GIL so the workers run in parallel.
+    """
+    return cv2.GaussianBlur(frame.image, (9, 9), 0)
+
+
+class BenchmarkPipeline(Pipeline):
+    """
+    The Pipeline of the app built from a PipelineConfig only, with the latency probes of the benchmark:
+    the time a frame enters the tee is compared with the time it reaches the appsink and the encoder.
+    """
+    def __init__(self, config):
+        GStreamerPipeline.__init__(self, config)
+
+    def default_params(self):
+        pass
+
+    def create_pipeline(self, config=None):
+        super().create_pipeline(config)
+        self.frame_count = 0
+        self.entry_times = {}
+        self.latencies = {}
+        for element in self.pipeline.iterate_elements():
+            name = element.get_factory().get_name()
+            if name == "tee":
+                element.get_static_pad("sink").add_probe(Gst.PadProbeType.BUFFER, self.entry_prob)
+            elif name == "appsink":
+                element.get_static_pad("sink").add_probe(Gst.PadProbeType.BUFFER, self.exit_prob, "appsink")
+            elif name in ENCODERS:
+                element.get_static_pad("src").add_probe(Gst.PadProbeType.BUFFER, self.exit_prob, "encoder")
+
+    def start(self):
+        GStreamerPipeline.start(self)
+
+    def entry_prob(self, pad, info):
+        self.frame_count += 1
+        self.entry_times[info.get_buffer().pts] = time.perf_counter()
+        return Gst.PadProbeReturn.OK
+
+    def exit_prob(self, pad, info, branch):
+        entry_time = self.entry_times.get(info.get_buffer().pts)
+        if entry_time is not None:
+            self.latencies.setdefault(branch, []).append(time.perf_counter() - entry_time)
+        return Gst.PadProbeReturn.OK
+
+    def drain(self):
+        # The appsink frames are only consumed, every frame is converted (lossless) and the queue never blocks for long
+        for _ in self.frames():
+            pass
+
+
+def percentile(values, p):
+    """
+    Returns the p-th percentile (nearest rank) of the values, None if there are none.
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, round(p / 100 * len(values)) - 1))]
+
+
+def generate_clip(width, height, frames, output_dir):
+    """
+    Encodes `frames` frames of videotestsrc into output_dir/clip_<width>x<height>.mp4, the input of the "decode" and "remux" cases.
+    """
+    sys.stdout = sys.stderr
+    output_file = f"clip_{width}x{height}"
+    config = PipelineConfig(num_buffers=frames, width=width, height=height, appsink_enabled=False, output_dir=output_dir, output_file=output_file)
+    pipeline = BenchmarkPipeline(config)
+    pipeline.start()
+    if not pipeline.wait_eos():
+        raise RuntimeError(f"Generating the {width}x{height} clip failed: {pipeline.error}")
+    return config.output_path()
+
+
+def run_case(case, resolution, frames, work_dir, timeout, input_file=None, workers=None):
+    """
+    Runs one case at one resolution, it is executed in a fresh worker process.
+    input_file is the generated clip read by the "decode" and "remux" cases, workers the number of frame processor
+    workers of the "process" case (None keeps the PipelineConfig default).
+
+    Returns:
+        dict: The metrics of the run.
+    """
+    # Keep stdout of the worker for nothing but the results, the pipeline logs go to stderr
+    sys.stdout = sys.stderr
+    width, height = RESOLUTIONS[resolution]
+    settings = dict(CASES[case])
+    if settings.get("input_method") == "FileSrc":
+        settings.update(input_file=input_file, input_width=width, input_height=height)
+    if settings.get("frame_processor") and workers is not None:
+        settings.update(processor_workers=workers)
+    config = PipelineConfig(num_buffers=frames, width=width, height=height, output_dir=work_dir, output_file=f"{case}_{resolution}", frame_mode="lossless", **settings)
+
+    usage_before = resource.getrusage(resource.RUSAGE_SELF)
+    pipeline = BenchmarkPipeline(config)
+    drain_thread = threading.Thread(target=pipeline.drain, daemon=True)
+    drain_thread.start()
+    begin = time.perf_counter()
+    pipeline.start()
+    ok = pipeline.wait_eos(timeout)
+    seconds = time.perf_counter() - begin
+    if not ok:
+        pipeline.stop()
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+
+    # The latencies of the appsink and the encoder branches are pooled
+    latencies = [latency * 1000 for branch in pipeline.latencies.values() for latency in branch]
+    cpu_time = (usage.ru_utime - usage_before.ru_utime) + (usage.ru_stime - usage_before.ru_stime)
+    result = {
+        "frames": pipeline.frame_count,
+        "seconds": round(seconds, 3),
+        "fps": round(pipeline.frame_count / seconds, 2) if seconds > 0 else None,
+        "latency_p50": percentile(latencies, 50),
+        "latency_p90": percentile(latencies, 90),
+        "latency_p99": percentile(latencies, 99),
+        # ru_maxrss is in KB on Linux and in bytes on macOS
+        "peak_rss_mb": round(usage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1),
+        "cpu_seconds": round(cpu_time, 3),
+        "cpu_per_frame_ms": round(cpu_time * 1000 / pipeline.frame_count, 3) if pipeline.frame_count else None,
+        "status": "ok" if ok else "error",
+    }
+    for key in ("latency_p50", "latency_p90", "latency_p99"):
+        if result[key] is not None:
+            result[key] = round(result[key], 3)
+    if not ok:
+        result["error"] = str(pipeline.error) if pipeline.error else f"timeout after {timeout}s"
+    return result
+
+
+def run_benchmark(cases, resolutions, frames, timeout=None, workers=None):
+    """
+    Runs every case at every resolution, one process per run.
+    With workers (a list of counts) the frame processor cases run once per count to compare them.
+
+    Returns:
+        dict: The results keyed by "<case>@<resolution>", "<case>-w<workers>@<resolution>" for the worker counts.
+    """
+    work_dir = tempfile.mkdtemp(prefix="benchmark_")
+    results = {}
+    try:
+        # GLib does not survive a fork, the runs are spawned
+        context = multiprocessing.get_context("spawn")
+        # The frame processor cases run once per worker count
+        runs = [(case, case_workers) for case in cases for case_workers in (workers if workers and CASES[case].get("frame_processor") else [None])]
+        for resolution in resolutions:
+            clip = None
+            for case, case_workers in runs:
+                key = f"{case}-w{case_workers}@{resolution}" if case_workers is not None else f"{case}@{resolution}"
+                try:
+                    # The clip is generated in its own process, it doesn't count in the metrics of the decode/remux cases
+                    if CASES[case].get("input_method") == "FileSrc" and clip is None:
+                        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                            clip = executor.submit(generate_clip, *RESOLUTIONS[resolution], frames, work_dir).result()
+                    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                        result = executor.submit(run_case, case, resolution, frames, work_dir, timeout, clip, case_workers).result()
+                except Exception as e:
+                    result = {"status": "error", "error": str(e)}
+                results[key] = result
+                print(f"INFO: {key} [{result['status']}] {result.get('fps')} fps, latency p50/p99 {result.get('latency_p50')}/{result.get('latency_p99')} ms, "
+                      f"peak RSS {result.get('peak_rss_mb')} MB, CPU {result.get('cpu_seconds')}s", file=sys.stderr)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Compares the results with the baseline results.
+
+    Args:
+        results (dict): The results returned by run_benchmark.
+        baseline (dict): The stored results.
+        threshold (float): The allowed relative regression of every metric e.g. 0.1 for 10%.
+
+    Returns:
+        list: The regressions, one dict per regressed metric.
+    """
+    regressions = []
+    for key, result in results.items():
+        reference = baseline.get(key)
+        if reference is None or reference.get("status") != "ok":
+            continue
+        if result.get("status") != "ok":
+            regressions.append({"run": key, "metric": "status", "baseline": "ok", "value": result.get("status")})
+            continue
+        for metric, higher_is_better in METRICS.items():
+            value, expected = result.get(metric), reference.get(metric)
+            if value is None or not expected:
+                continue
+            change = (value - expected) / expected
+            if (higher_is_better and change < -threshold) or (not higher_is_better and change > threshold):
+                regressions.append({"run": key, "metric": metric, "baseline": expected, "value": value, "change": round(change, 3)})
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the throughput of the Gstreamer pipeline and compare it with a stored baseline")
+    parser.add_argument("--cases", nargs="+", default=list(CASES), choices=list(CASES), help="cases to run (default: all)")
+    parser.add_argument("--resolutions", nargs="+", default=list(RESOLUTIONS), choices=list(RESOLUTIONS), help="resolutions to run (default: all)")
+    parser.add_argument("--workers", type=int, nargs="+", help="frame processor worker counts compared by the process case (default: the PipelineConfig default)")
+    parser.add_argument("--frames", type=int, default=300, help="number of frames of every run (default: 300)")
+    parser.add_argument("--timeout", type=float, default=600, help="maximal time in seconds given to every run (default: 600)")
+    parser.add_argument("--baseline", default=os.path.join("benchmarks", "baseline.json"), help="path of the baseline (default: benchmarks/baseline.json)")
+    parser.add_argument("--threshold", type=float, default=0.1, help="allowed relative regression of every metric (default: 0.1)")
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--output", default="-", help="path of the json results, - writes them to stdout (default: -)")
+    args = parser.parse_args()
+
+    # Keep stdout for the results, the pipeline logs go to stderr
+    results_stream = sys.stdout
+    sys.stdout = sys.stderr
+    results = run_benchmark(args.cases, args.resolutions, args.frames, args.timeout, args.workers)
+    report = {
+        "machine": {"platform": platform.platform(), "processor": platform.processor(), "cpus": os.cpu_count(), "gstreamer": Gst.version_string()},
+        "frames": args.frames,
+        "results": results,
+    }
+
+    regressions = []
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline) or ".", exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"INFO: Baseline saved --> {args.baseline}", file=sys.stderr)
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("frames") != args.frames:
+            print(f"Warning: The baseline was recorded with {baseline.get('frames')} frames per run, not {args.frames}", file=sys.stderr)
+        regressions = compare(results, baseline["results"], args.threshold)
+        report["regressions"] = regressions
+        for regression in regressions:
+            print(f"Error: {regression['run']} {regression['metric']} regressed: {regression['value']} (baseline {regression['baseline']})", file=sys.stderr)
+    else:
+        print(f"Warning: No baseline at {args.baseline}, run with --save-baseline to create it", file=sys.stderr)
+
+    if args.output == "-":
+        json.dump(report, results_stream, indent=2)
+        results_stream.write("\n")
+    else:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    failed = any(result.get("status") != "ok" for result in results.values())
+    sys.exit(1 if regressions or failed else 0)
@@ -0,0 +1,122 @@
+##################################################################################################################
+# Author: Vishal Kumar
+# Email: vishalkmr01123@gmail.com
+#
+# This file contains the PipelineConfig class which holds everything needed to build a pipeline.
+# The configuration is immutable and hashable, create_pipeline only reads it, so the pipelines can be built
+# outside of a streamlit script run (worker processes, batch jobs, benchmarks).
+# The streamlit app only translates its widgets into a PipelineConfig (see Pipeline.session_config).
+#
+# Example:
+#     config = PipelineConfig(input_method="FileSrc", input_file="input/video.mp4", appsink_enabled=False)
+#     config = config.replace(out_ext="jpg")
+##################################################################################################################
+
+import os, json, hashlib, dataclasses
+from dataclasses import dataclass, field
+from typing import Any, Optional
+from sequence import is_sequence
+
+
+@dataclass(frozen=True)
+class PipelineConfig:
+    # Input source i.e. "VideoTestSrc" or "FileSrc"
+    input_method: str = "VideoTestSrc"
+
+    # VideoTestSrc
+    pattern: int = 18
+    flip: bool = False
+    motion: int = 0
+    animation_mode: int = 0
+    num_buffers: int = -1
+    # Resolution of the test video, the default resolution of videotestsrc is used when not set
+    width: Optional[int] = None
+    height: Optional[int] = None
+
+    # FileSrc, input_file is the path of the file (or its name when input_data is given)
+    input_file: Optional[str] = None
+    input_hash: Optional[str] = None
+    input_width: Optional[int] = None
+    input_height: Optional[int] = None
+    # Content of an in-memory upload, it is identified by input_hash hence not part of the equality/hash
+    input_data: Any = field(default=None, compare=False, repr=False)
+    # Frame rate of the image sequence inputs (a directory or a glob pattern of jpg/png files as input_file)
+    framerate: int = 30
+    # Replay the decoded frames of an earlier complete run of the same input from the frame cache instead of decoding it
+    frame_cache: bool = False
+    # Time range of the input to process in seconds
+    start_time: Optional[float] = None
+    end_time: Optional[float] = None
+
+    # Outputs
+    appsink_enabled: bool = True
+    filesink_enabled: bool = True
+    autovideosink_enabled: bool = False
+    output_dir: str = "output"
+    output_file: str = "output"
+    out_ext: str = "mp4"
+    output_mode: str = "mp4"
+    fragment_duration: int = 1000
+    # Remux the H.264 stream of an MP4 input into an MP4 output instead of decoding and re-encoding it
+    passthrough: bool = True
+    # Delivery of the appsink frames: "latest" keeps only the newest frame (live previews), "lossless" keeps every
+    # frame and blocks the pipeline while the consumer is behind (offline analysis)
+    frame_mode: str = "latest"
+    # Stack the appsink frames into batches of batch_size frames (utils.FrameBatch) for vectorised consumers, 0 delivers
+    # single frames. A batch is delivered earlier once it spans batch_ms of stream time, 0 for no time limit
+    batch_size: int = 0
+    batch_ms: int = 0
+    # Import path "module:function" of a function run on every frame before it is encoded (see processing.FrameProcessor),
+    # by processor_workers threads with at most processor_inflight frames queued or processed
+    frame_processor: Optional[str] = None
+    processor_workers: int = 4
+    processor_inflight: int = 8
+
+    # Byte budget of the frames in flight (queued for and displayed by the UI) in MB, 0 disables it
+    memory_budget_mb: int = int(os.environ.get("SESSION_MEMORY_BUDGET_MB", 512))
+
+    def replace(self, **changes):
+        """
+        Returns a copy of the configuration with the given fields changed.
+        """
+        return dataclasses.replace(self, **changes)
+
+    @property
+    def sequence_input(self):
+        return self.input_method == "FileSrc" and self.input_data is None and is_sequence(self.input_file)
+
+    @property
+    def image_input(self):
+        return self.input_method == "FileSrc" and not self.sequence_input and (self.input_file or "").split(".")[-1].lower() in ("jpg", "png")
+
+    @property
+    def remux(self):
+        """
+        True if the output can be written from the encoded stream of the input i.e. an MP4 input written to an MP4 output
+        without pixel processing, the appsink/autovideosink previews are then decoded on a side branch.
+        """
+        return (self.passthrough and self.input_method == "FileSrc" and not self.sequence_input and (self.input_file or "").split(".")[-1].lower() == "mp4"
+                and self.filesink_enabled and self.out_ext == "mp4" and self.frame_processor is None)
+
+    def output_path(self):
+        """
+        Returns the path of the playable output file i.e. the playlist for the HLS output.
+        """
+        if self.output_mode == "hls" and self.out_ext == "mp4":
+            return os.path.join(self.output_dir, f"{self.output_file}.m3u8")
+        if self.sequence_input and self.out_ext in ("jpg", "png"):
+            # Pattern of the numbered output frames
+            return os.path.join(self.output_dir, f"{self.output_file}_%06d.{self.out_ext}")
+        return os.path.join(self.output_dir, f"{self.output_file}.{self.out_ext}")
+
+    def to_dict(self):
+        """
+        Returns the configuration as a json serialisable dict, the in-memory input data is left out.
+        """
+        return {f.name: getattr(self, f.name) for f in dataclasses.fields(self) if f.compare}
+
+    def cache_key(self):
+        """
+        Returns a stable digest of the configuration, unlike hash() it is the same across processes.
+        """
+        return hashlib.sha256(json.dumps(self.to_dict(), sort_keys=True).encode()).hexdigest()
@@ -0,0 +1,188 @@
+##################################################################################################################
+# Author: Vishal Kumar
+# Email: vishalkmr01123@gmail.com
+#
+# This file contains the PropertyController class which changes the properties of the elements of a running pipeline.
+# Any property of any element can be changed (videotestsrc pattern, textoverlay text, x264enc bitrate, queue limits,
+# capsfilter caps...) without rebuilding the pipeline. The updates requested between two frames are batched: at the
+# next buffer of the frame pad a custom serialized event is sent downstream, and every element of the batch gets its
+# new values when that event reaches its own sink pad, i.e. in the stream order, right before the next frame reaches it
+# whatever the queues in between. The elements upstream of the frame pad (the source) are updated at the frame pad.
+#
+# Example:
+#     controls = PropertyController(pipeline)
+#     controls.set("videotestsrc", pattern=1, flip=True)
+#     controls.update({"textoverlay": {"text": "Live"}, "capsfilter0": {"caps": "video/x-raw, width=640, height=480"}})
+##################################################################################################################
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+import threading
+
+
+class PropertyController:
+    """
+    Batched, frame aligned updates of the element properties of a pipeline.
+    """
+    def __init__(self, pipeline, frame_pad=None):
+        """
+        Args:
+            pipeline (Gst.Pipeline): The pipeline whose elements are updated.
+            frame_pad (Gst.Pad, optional): The pad at whose next buffer the updates are applied. Defaults to the src pad of the source element.
+        """
+        self.pipeline = pipeline
+        self.frame_pad = frame_pad
+        self.elements = {}
+        # element name --> {property: value}, the latest value of a property wins
+        self.pending = {}
+        self.probe_id = None
+        self.callbacks = []
+        self.lock = threading.Lock()
+
+    def element(self, name):
+        """
+        Returns the element of the given name, it is looked up in the pipeline only once.
+        """
+        element = self.elements.get(name)
+        if element is None:
+            element = self.pipeline.get_by_name(name)
+            if element is not None:
+                self.elements[name] = element
+        return element
+
+    def invalidate(self):
+        """
+        Forgets the elements looked up so far, called when elements are added to or removed from the pipeline.
+        """
+        self.elements = {}
+
+    def set(self, name, **properties):
+        """
+        Changes properties of one element, the underscores of the names are replaced by dashes (animation_mode --> animation-mode).
+        """
+        return self.update({name: {key.replace("_", "-"): value for key, value in properties.items()}})
+
+    def update(self, changes, on_applied=None):
+        """
+        Queues a batch of property changes, it is applied at the next buffer of the frame pad.
+        The changes are applied right away when no buffer is flowing i.e. the pipeline is not playing.
+
+        Args:
+            changes (dict): The new values of the properties by element name e.g. {"x264enc": {"bitrate": 4000}}.
+            on_applied (callable, optional): Called without argument once the batch is applied, from the streaming thread. Defaults to None.
+
+        Returns:
+            bool: False if an element or a property doesn't exist, nothing is queued then.
+        """
+        for name, properties in changes.items():
+            element = self.element(name)
+            if element is None:
+                print(f"Error: No element {name} in the pipeline")
+                return False
+            for key in properties:
+                if element.find_property(key) is None:
+                    print(f"Error: {name} has no property {key}")
+                    return False
+
+        with self.lock:
+            for name, properties in changes.items():
+                self.pending.setdefault(name, {}).update(properties)
+            if on_applied is not None:
+                self.callbacks.append(on_applied)
+            pad = self.frame_pad or self.source_pad()
+            _, state, _ = self.pipeline.get_state(0)
+            if pad is not None and state == Gst.State.PLAYING:
+                if self.probe_id is None:
+                    self.probe_id = pad.add_probe(Gst.PadProbeType.BUFFER | Gst.PadProbeType.BUFFER_LIST, self.update_prob)
+                return True
+            pending, callbacks = self.take()
+        self.apply_batch(pending, callbacks)
+        return True
+
+    def source_pad(self):
+        # The src pad of the (first) element without sink pad
+        iterator = self.pipeline.iterate_sources()
+        result, source = iterator.next()
+        if result != Gst.IteratorResult.OK:
+            return None
+        return source.get_static_pad("src")
+
+    def take(self):
+        # Called with the lock held, returns the queued batch and its callbacks
+        pending, self.pending = {name: (self.element(name), properties) for name, properties in self.pending.items()}, {}
+        callbacks, self.callbacks = self.callbacks, []
+        return pending, callbacks
+
+    def downstream_pads(self, pad):
+        """
+        Returns the elements downstream of pad by name, with the sink pad through which each one is reached.
+        """
+        pads = {}
+        stack = [pad if pad.get_direction() == Gst.PadDirection.SINK else pad.get_peer()]
+        while stack:
+            sink_pad = stack.pop()
+            element = sink_pad.get_parent_element() if sink_pad is not None else None
+            if element is None or element.get_name() in pads:
+                continue
+            pads[element.get_name()] = sink_pad
+            stack.extend(src_pad.get_peer() for src_pad in element.srcpads)
+        return pads
+
+    def update_prob(self, pad, info):
+        with self.lock:
+            pending, callbacks = self.take()
+            self.probe_id = None
+        self.apply_batch(pending, callbacks, self.downstream_pads(pad), pad)
+        return Gst.PadProbeReturn.REMOVE
+
+    def apply_batch(self, pending, callbacks, downstream=None, pad=None):
+        """
+        Applies a batch, the elements in downstream (see downstream_pads) once the event sent on pad reaches them,
+        the other ones right away.
+        """
+        if not pending:
+            for callback in callbacks:
+                callback()
+            return
+        batch = {"remaining": len(pending), "callbacks": callbacks}
+        event = None
+        for name, (element, properties) in pending.items():
+            sink_pad = (downstream or {}).get(name)
+            if sink_pad is None:
+                # Upstream of the frame pad, the next frame is produced with the new values
+                self.apply(batch, name, element, properties)
+                continue
+            if event is None:
+                event = Gst.Event.new_custom(Gst.EventType.CUSTOM_DOWNSTREAM, Gst.Structure.new_empty("property-update"))
+            sink_pad.add_probe(Gst.PadProbeType.EVENT_DOWNSTREAM, self.update_event_prob, event.get_seqnum(), batch, name, element, properties)
+        if event is not None:
+            # Sent from the streaming thread before the buffer goes on, so it precedes the next frame in every branch
+            pad.send_event(event) if pad.get_direction() == Gst.PadDirection.SINK else pad.push_event(event)
+
+    def update_event_prob(self, pad, info, seqnum, batch, name, element, properties):
+        event = info.get_event()
+        if event.type != Gst.EventType.CUSTOM_DOWNSTREAM or event.get_seqnum() != seqnum:
+            return Gst.PadProbeReturn.PASS
+        self.apply(batch, name, element, properties)
+        return Gst.PadProbeReturn.REMOVE
+
+    def apply(self, batch, name, element, properties):
+        # Called from the streaming thread of the element (or the caller when no buffer is flowing)
+        if element is None:
+            print(f"Error: No element {name} in the pipeline anymore")
+            properties = {}
+        for key, value in properties.items():
+            # The caps are given as strings e.g. "video/x-raw, width=640, height=480"
+            if isinstance(value, str) and element.find_property(key).value_type == Gst.Caps.__gtype__:
+                value = Gst.Caps.from_string(value)
+            element.set_property(key, value)
+        if properties:
+            print(f"INFO: Live update --> {name} {properties}")
+        # The callbacks run once every element of the batch is updated
+        with self.lock:
+            batch["remaining"] -= 1
+            done = batch["remaining"] == 0
+        if done:
+            for callback in batch["callbacks"]:
+                callback()
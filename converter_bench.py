@@ -0,0 +1,151 @@
+##################################################################################################################
+# Author: Vishal Kumar
+# Email: vishalkmr01123@gmail.com
+#
+# This file contains the correctness checks and the microbenchmarks of the RGB_Converter class (utils.py).
+# Synthetic frames are generated for every format, with odd widths/heights and with rows padded beyond the
+# Gstreamer default stride, and packed into a raw buffer the way an appsink receives it.
+# Every conversion is compared with a float reference conversion (BT.601 limited range, the chroma of a
+# 2x2 / 2x1 block is shared) and timed, the command fails if a conversion is wrong.
+#
+# Usage:
+#     python converter_bench.py
+#     python converter_bench.py --formats I420 YV12 --sizes 1920x1080 641x479 --repeat 200
+##################################################################################################################
+
+import sys, time, argparse
+import numpy as np
+from utils import RGB_Converter, default_layout, round_up
+
+FORMATS = ("I420", "YV12", "YUY2", "BGR", "RGB")
+SIZES = ("640x480", "1920x1080", "641x479", "3x3")
+
+# Maximal difference with the reference of a channel, OpenCV converts with fixed point arithmetic
+TOLERANCE = 2
+
+
+def reference_rgb(y_plane, u_plane, v_plane, width, height):
+    """
+    Converts full planes of Y and upsampled (nearest) U, V into RGB with the BT.601 limited range coefficients.
+    """
+    u_plane = np.repeat(np.repeat(u_plane, 2, axis=0), 2, axis=1)[:height, :width] if u_plane.shape[0] != height else np.repeat(u_plane, 2, axis=1)[:, :width]
+    v_plane = np.repeat(np.repeat(v_plane, 2, axis=0), 2, axis=1)[:height, :width] if v_plane.shape[0] != height else np.repeat(v_plane, 2, axis=1)[:, :width]
+    y, u, v = 1.164 * (y_plane.astype(np.float32) - 16), u_plane.astype(np.float32) - 128, v_plane.astype(np.float32) - 128
+    rgb = np.dstack((y + 1.596 * v, y - 0.813 * v - 0.391 * u, y + 2.018 * u))
+    return np.clip(np.round(rgb), 0, 255).astype(np.uint8)
+
+
+def pack_planes(planes, strides, offsets, size):
+    """
+    Writes the planes into a raw buffer with the given strides and offsets, the padding is filled with garbage.
+    """
+    buffer = np.full(size, 0xAA, dtype=np.uint8)
+    for array, stride, offset in zip(planes, strides, offsets):
+        rows, row_bytes = array.shape[0], array.shape[1] * (array.shape[2] if array.ndim == 3 else 1)
+        for row in range(rows):
+            buffer[offset + row * stride:offset + row * stride + row_bytes] = array[row].reshape(-1)
+    return buffer.tobytes()
+
+
+def synthetic_frame(format, width, height, extra_stride=0, seed=0):
+    """
+    Generates a random frame of the format.
+
+    Args:
+        format (str): The video format.
+        width (int): Width of the frame.
+        height (int): Height of the frame.
+        extra_stride (int, optional): Padding added to every row beyond the Gstreamer default stride. Defaults to 0.
+        seed (int, optional): Seed of the random values. Defaults to 0.
+
+    Returns:
+        tuple: The raw buffer, the strides, the offsets and the expected RGB image.
+    """
+    rng = np.random.default_rng(seed)
+    strides, offsets = default_layout(format, width, height)
+    if format in ("I420", "YV12"):
+        chroma_width, chroma_height = (width + 1) // 2, (height + 1) // 2
+        y_plane = rng.integers(16, 236, (height, width), dtype=np.uint8)
+        u_plane = rng.integers(16, 241, (chroma_height, chroma_width), dtype=np.uint8)
+        v_plane = rng.integers(16, 241, (chroma_height, chroma_width), dtype=np.uint8)
+        strides = [strides[0] + extra_stride, strides[1] + extra_stride, strides[2] + extra_stride]
+        # Gstreamer starts the chroma planes after an even number of luma rows
+        offsets = [0, strides[0] * round_up(height, 2), strides[0] * round_up(height, 2) + strides[1] * chroma_height]
+        # YV12 stores the V plane before the U plane
+        planes = [y_plane, u_plane, v_plane] if format == "I420" else [y_plane, v_plane, u_plane]
+        size = offsets[2] + strides[2] * chroma_height
+        expected = reference_rgb(y_plane, u_plane, v_plane, width, height)
+    elif format == "YUY2":
+        padded_width = round_up(width, 2)
+        y_plane = rng.integers(16, 236, (height, padded_width), dtype=np.uint8)
+        u_plane = rng.integers(16, 241, (height, padded_width // 2), dtype=np.uint8)
+        v_plane = rng.integers(16, 241, (height, padded_width // 2), dtype=np.uint8)
+        packed = np.empty((height, padded_width * 2), dtype=np.uint8)
+        packed[:, 0::4], packed[:, 1::4], packed[:, 2::4], packed[:, 3::4] = y_plane[:, 0::2], u_plane, y_plane[:, 1::2], v_plane
+        strides = [strides[0] + extra_stride]
+        planes, size = [packed], strides[0] * height
+        expected = reference_rgb(y_plane[:, :width], u_plane, v_plane, width, height)
+    else:
+        expected = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+        strides = [strides[0] + extra_stride]
+        planes, size = [expected[:, :, ::-1] if format == "BGR" else expected], strides[0] * height
+    return pack_planes(planes, strides, offsets, size), strides, offsets, expected
+
+
+def check(format, width, height, extra_stride, repeat):
+    """
+    Converts a synthetic frame, compares it with the reference and times the conversion.
+
+    Returns:
+        dict: The maximal and mean error and the time of a conversion in ms.
+    """
+    data, strides, offsets, expected = synthetic_frame(format, width, height, extra_stride)
+    converter = RGB_Converter()
+    # The default layout is passed implicitly, the padded one explicitly
+    layout = (strides, offsets) if extra_stride else (None, None)
+    rgb_image = converter.buffer_to_rgb(data, width, height, format, *layout)
+    error = np.abs(rgb_image.astype(np.int16) - expected.astype(np.int16)) if rgb_image.shape == expected.shape else None
+
+    begin = time.perf_counter()
+    for _ in range(repeat):
+        converter.buffer_to_rgb(data, width, height, format, *layout)
+    elapsed = (time.perf_counter() - begin) * 1000 / repeat
+
+    return {
+        "shape_ok": error is not None,
+        "max_error": int(error.max()) if error is not None else None,
+        "mean_error": float(error.mean()) if error is not None else None,
+        "ms": elapsed,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the colours of every RGB_Converter format against a reference conversion and time them")
+    parser.add_argument("--formats", nargs="+", default=list(FORMATS), choices=list(FORMATS), help="formats to check (default: all)")
+    parser.add_argument("--sizes", nargs="+", default=list(SIZES), help="frame sizes as WIDTHxHEIGHT (default: %(default)s)")
+    parser.add_argument("--repeat", type=int, default=50, help="number of timed conversions of every frame (default: 50)")
+    args = parser.parse_args()
+
+    failed = 0
+    print(f"{'format':<6} {'size':>10} {'padding':>8} {'max err':>8} {'mean err':>9} {'ms':>8}")
+    for format in args.formats:
+        for size in args.sizes:
+            width, height = (int(value) for value in size.lower().split("x"))
+            for extra_stride in (0, 16):
+                try:
+                    result = check(format, width, height, extra_stride, args.repeat)
+                    ok = result["shape_ok"] and result["max_error"] <= TOLERANCE
+                    print(f"{format:<6} {size:>10} {extra_stride:>8} {result['max_error']!s:>8} {result['mean_error'] or 0:>9.3f} {result['ms']:>8.3f} {'' if ok else 'FAILED'}")
+                except Exception as e:
+                    ok = False
+                    print(f"{format:<6} {size:>10} {extra_stride:>8} FAILED {e}")
+                failed += not ok
+
+    try:
+        RGB_Converter().buffer_to_rgb(b"", 2, 2, "NV21")
+        print("FAILED: an unsupported format is not rejected")
+        failed += 1
+    except ValueError:
+        pass
+
+    sys.exit(1 if failed else 0)
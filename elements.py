@@ -9,27 +9,67 @@
 
 import gi
 gi.require_version('Gst', '1.0')
-from gi.repository import Gst
-import queue , threading
+gi.require_version('GstVideo', '1.0')
+from gi.repository import Gst, GstVideo
+import queue , threading, time, math
 from utils import *
+from memory import MemoryAccount
+from zerocopy import push_array
+
+
+# Frames held by buffer_queue in the lossless mode before the appsink blocks the pipeline
+LOSSLESS_QUEUE_FRAMES = 8
 
 
 class GstreamerElements: 
-    def __init__(self, pipeline):
+    def __init__(self, pipeline, memory=None, frame_mode="latest", batch_size=0, batch_ms=0):
         """
         Initializes the Gstreamer_Elements class with a given pipeline.
 
         Args:
             pipeline (Gst.Pipeline): The Gstreamer pipeline to which elements will be added.
+            memory (MemoryAccount, optional): The account of the frames held by buffer_queue. Defaults to an account without budget.
+            frame_mode (str, optional): "latest" keeps only the newest appsink frame in buffer_queue, "lossless" keeps every frame
+                and blocks the pipeline while buffer_queue is full. Defaults to "latest".
+            batch_size (int, optional): Number of appsink frames stacked into one utils.FrameBatch, 0 queues single frames. Defaults to 0.
+            batch_ms (int, optional): Stream time in ms after which a batch is queued even if it holds less than batch_size frames, 0 for no limit. Defaults to 0.
         """
         self.pipeline = pipeline
-        self.buffer_queue = queue.Queue(maxsize=10000)
+        self.frame_mode = frame_mode
+        self.buffer_queue = queue.Queue(maxsize=LOSSLESS_QUEUE_FRAMES if frame_mode == "lossless" else 1)
+        # Set to stop waiting for the consumer in the lossless mode, the frames are dropped from then on
+        self.flushing = False
+        self.memory = memory if memory is not None else MemoryAccount()
+        self.rgb_converter = RGB_Converter()
         self.in_frame_num = 1
         self.in_time = None
+        # Time at which the first playable fragment/segment of the output is written
+        self.first_output_time = None
+        # Called (from the streaming thread) after every frame queued into buffer_queue e.g. to wake up an event loop
+        self.frame_callback = None
+        self.batch_size = batch_size
+        self.batch_ms = batch_ms
+        # Batch being filled by the appsink and its number of frames, the batch is queued in frame_mode like a single frame
+        self.batch = None
+        self.batch_count = 0
+        # Caps of the batched frames and their (width, height, format, strides, offsets), derived once per caps change
+        self.batch_caps = None
+        self.batch_layout = None
+        # Flow control of the appsrc elements by name, see appsrc and push_frame
+        self.appsrc_ready = {}
+        # Appended to the element names e.g. by add_branch, an output branch added again while the elements of its previous
+        # instance are still in the pipeline doesn't clash with their names
+        self.name_suffix = ""
         
         progress_text = "Frame processed"
+    def make(self, factory, name=None):
+        """
+        Creates an element, name gets self.name_suffix. Without name Gstreamer generates a unique one.
+        """
+        return Gst.ElementFactory.make(factory, f"{name}{self.name_suffix}" if name else None)
+
     @element_info
-    def videotestsrc(self, pattern=18, flip=False, motion=0, animation_mode=0):
+    def videotestsrc(self, pattern=18, flip=False, motion=0, animation_mode=0, num_buffers=-1):
         """
         This function adds a videotestsrc element in the Gstreamer pipeline and sets its properties.
 
@@ -38,12 +78,14 @@ class GstreamerElements:
             flip (bool, optional): If set to True, the video will be flipped. Defaults to False.
             motion (int, optional): The motion of the video. Defaults to 0.
             animation_mode (int, optional): The animation mode of the video. Defaults to 0.
+            num_buffers (int, optional): The number of frames produced before EOS, -1 for an endless stream. Defaults to -1.
 
         Returns:
             Gst.Element: The videotestsrc element that was created and added to the pipeline.
         """
-        videotestsrc = Gst.ElementFactory.make("videotestsrc", "videotestsrc")
+        videotestsrc = self.make("videotestsrc", "videotestsrc")
         videotestsrc.set_property("pattern",pattern)
+        videotestsrc.set_property("num-buffers",num_buffers)
         if pattern == 18:
             videotestsrc.set_property("flip", flip)
             videotestsrc.set_property("motion", motion)
@@ -62,11 +104,138 @@ class GstreamerElements:
         Returns:
             Gst.Element: The filesrc element that was created and added to the pipeline.
         """
-        filesrc = Gst.ElementFactory.make("filesrc", "filesrc")
+        filesrc = self.make("filesrc", "filesrc")
         filesrc.set_property("location", file_path)
         self.pipeline.add(filesrc)
         return filesrc
 
+    @element_info
+    def memsrc(self, data, chunk_size=65536):
+        """
+        This function adds an appsrc element to the Gstreamer pipeline which feeds the in-memory bytes of a file.
+        The appsrc works in random-access mode, so the data is pulled in chunks and the downstream demuxers can seek in it.
+
+        Args:
+            data (bytes-like): The content of the input file.
+            chunk_size (int, optional): The size of the pushed chunks when the downstream doesn't request a specific length. Defaults to 65536.
+
+        Returns:
+            Gst.Element: The appsrc element that was created and added to the pipeline.
+        """
+        memsrc = self.make("appsrc", "memsrc")
+        memsrc.set_property("stream-type", 2) # GST_APP_STREAM_TYPE_RANDOM_ACCESS
+        memsrc.set_property("format", Gst.Format.BYTES)
+        memsrc.set_property("size", len(data))
+        # Read offset of this memsrc, shared by its need-data and seek-data callbacks
+        position = {"offset": 0}
+        memsrc.connect("need-data", self.memsrc_need_data, memoryview(data), chunk_size, position)
+        memsrc.connect("seek-data", self.memsrc_seek_data, position)
+        self.pipeline.add(memsrc)
+        return memsrc
+
+    def memsrc_need_data(self, memsrc, length, data, chunk_size, position):
+        # Push the requested region of the data, only the chunk is copied into the Gst.Buffer
+        offset = position["offset"]
+        if offset >= len(data):
+            memsrc.emit("end-of-stream")
+            return
+        size = length if length > 0 else chunk_size
+        chunk = data[offset:offset + size]
+        buffer = Gst.Buffer.new_wrapped(chunk.tobytes())
+        buffer.offset = offset
+        position["offset"] = offset + len(chunk)
+        memsrc.emit("push-buffer", buffer)
+
+    def memsrc_seek_data(self, memsrc, offset, position):
+        position["offset"] = offset
+        return True
+
+    @element_info
+    def appsrc(self, caps=None, name="appsrc", is_live=False, max_buffers=4):
+        """
+        This function adds an appsrc element to the Gstreamer pipeline, the frames are pushed with push_frame.
+        The appsrc queues at most max_buffers frames, push_frame then waits until the appsrc needs data again.
+
+        Args:
+            caps (str, optional): The caps of the frames e.g. "video/x-raw, format=RGB, width=640, height=480, framerate=30/1". Defaults to the caps set later on the element.
+            name (str, optional): The name of the element. Defaults to "appsrc".
+            is_live (bool, optional): If set to True, the sinks don't wait in PAUSED for the first frame. Defaults to False.
+            max_buffers (int, optional): The number of frames queued by the appsrc before the producer is throttled. Defaults to 4.
+
+        Returns:
+            Gst.Element: The appsrc element that was created and added to the pipeline.
+        """
+        appsrc = self.make("appsrc", name)
+        if caps is not None:
+            appsrc.set_property("caps", Gst.Caps.from_string(caps))
+        appsrc.set_property("format", Gst.Format.TIME)
+        appsrc.set_property("is-live", is_live)
+        if appsrc.find_property("max-buffers") is not None:
+            appsrc.set_property("max-buffers", max_buffers)
+        elif caps is not None:
+            # Gstreamer older than 1.20 only limits the queued bytes
+            appsrc.set_property("max-bytes", max_buffers * GstVideo.VideoInfo.new_from_caps(appsrc.get_property("caps")).size)
+        # Set while the appsrc accepts frames, cleared by enough-data
+        ready = threading.Event()
+        ready.set()
+        self.appsrc_ready[appsrc.get_name()] = ready
+        appsrc.connect("need-data", lambda appsrc, length: ready.set())
+        appsrc.connect("enough-data", lambda appsrc: ready.clear())
+        self.pipeline.add(appsrc)
+        return appsrc
+
+    def push_frame(self, appsrc, array, pts=None, duration=None, timeout=None):
+        """
+        This function pushes a frame into an appsrc created by self.appsrc without copying it (see zerocopy.push_array),
+        the producer waits while the appsrc has enough data.
+
+        Args:
+            appsrc (Gst.Element): The appsrc element.
+            array (np.ndarray or bytes-like): The frame in the format of the appsrc caps, it must not be modified once pushed.
+            pts (int, optional): The presentation timestamp in ns. Defaults to none.
+            duration (int, optional): The duration in ns. Defaults to none.
+            timeout (float, optional): The maximal time in seconds to wait for the appsrc. Defaults to waiting until it needs data.
+
+        Returns:
+            Gst.FlowReturn: The result of the push, FLUSHING if the pipeline is stopping or stopped.
+
+        Raises:
+            queue.Full: If the appsrc still has enough data after timeout seconds.
+        """
+        ready = self.appsrc_ready[appsrc.get_name()]
+        waited = 0
+        while not ready.wait(0.1):
+            if self.flushing or appsrc.get_state(0)[1] == Gst.State.NULL:
+                return Gst.FlowReturn.FLUSHING
+            waited += 0.1
+            if timeout is not None and waited >= timeout:
+                raise queue.Full
+        return push_array(appsrc, array, pts, duration)
+
+    def framesrc(self, caps, frames):
+        """
+        This function adds an appsrc element to the Gstreamer pipeline which replays raw video frames e.g. the decoded frames of the frame cache.
+
+        Args:
+            caps (str): The caps of the frames e.g. "video/x-raw, format=I420, width=640, height=480, framerate=30/1".
+            frames (iterator): The (pts, duration, data) of the frames in ns, data is bytes-like.
+
+        Returns:
+            Gst.Element: The appsrc element that was created and added to the pipeline.
+        """
+        framesrc = self.appsrc(caps=caps, name="framesrc")
+        framesrc.connect("need-data", self.framesrc_need_data, iter(frames))
+        return framesrc
+
+    def framesrc_need_data(self, framesrc, length, frames):
+        # One frame per request, the frames are read from the cache (or its spill files) on demand and pushed without copy
+        frame = next(frames, None)
+        if frame is None:
+            framesrc.emit("end-of-stream")
+            return
+        pts, duration, data = frame
+        push_array(framesrc, data, pts, duration)
+
     @element_info
     def nvjpegdec(self, element):
         """
@@ -78,7 +247,7 @@ class GstreamerElements:
         Returns:
             Gst.Element: The nvjpegdec element that was created and added to the pipeline.
         """
-        nvjpegdec = Gst.ElementFactory.make("nvjpegdec", "nvjpegdec")
+        nvjpegdec = self.make("nvjpegdec", "nvjpegdec")
         self.pipeline.add(nvjpegdec)
         element.link(nvjpegdec)
         return nvjpegdec
@@ -138,9 +307,48 @@ class GstreamerElements:
         # import pydevd_pycharm
         # pydevd_pycharm.settrace()
 
-        if pad.name == 'video_0':
+        # qtdemux names its video pad video_0, splitmuxsrc names it video
+        if pad.name.startswith('video'):
             demuxer.link(avdec_h264)
 
+    @element_info
+    def multifilesrc(self, location, file_ext, framerate=30):
+        """
+        This function adds a multifilesrc element to the Gstreamer pipeline, it reads the numbered files of a pattern as one stream.
+
+        Args:
+            location (str): The printf pattern of the files (e.g., 'frames/%06d.jpg').
+            file_ext (str): The extension of the files, 'jpg' or 'png'.
+            framerate (int, optional): The frame rate of the stream. Defaults to 30.
+
+        Returns:
+            Gst.Element: The multifilesrc element that was created and added to the pipeline.
+        """
+        multifilesrc = self.make("multifilesrc", "multifilesrc")
+        multifilesrc.set_property("location", location)
+        multifilesrc.set_property("index", 0)
+        media_type = "image/jpeg" if file_ext == "jpg" else "image/png"
+        multifilesrc.set_property("caps", Gst.Caps.from_string(f"{media_type},framerate=(fraction){framerate}/1"))
+        self.pipeline.add(multifilesrc)
+        return multifilesrc
+
+    @element_info
+    def splitmuxsrc(self, location):
+        """
+        This function adds a splitmuxsrc element to the Gstreamer pipeline, it plays a set of MP4 fragments as one continuous stream.
+        The video pad of the element is added dynamically, connect demuxer_pad_added to the "pad-added" signal to link it.
+
+        Args:
+            location (str): The glob pattern matching the fragments, they are played in alphabetical order.
+
+        Returns:
+            Gst.Element: The splitmuxsrc element that was created and added to the pipeline.
+        """
+        splitmuxsrc = self.make("splitmuxsrc", "splitmuxsrc")
+        splitmuxsrc.set_property("location", location)
+        self.pipeline.add(splitmuxsrc)
+        return splitmuxsrc
+
     @element_info
     def nvstreammux(self, element, width, height, batch_size=1):
         """
@@ -154,7 +362,7 @@ class GstreamerElements:
         Returns:
             Gst.Element: The nvstreammux element that was created and added to the pipeline.
         """
-        nvstreammux = Gst.ElementFactory.make("nvstreammux", "nvstreammux")
+        nvstreammux = self.make("nvstreammux", "nvstreammux")
         self.pipeline.add(nvstreammux)
         element.link(nvstreammux)
         nvstreammux.set_property("width", width)
@@ -164,19 +372,20 @@ class GstreamerElements:
 
 
     @element_info
-    def h264parse(self, element):
+    def h264parse(self, element=None):
         """
         This function adds an h264parse element to the Gstreamer pipeline and links it to a previous element.
 
         Args:
-            element (Gst.Element): The Gstreamer element to which the h264parse is linked.
+            element (Gst.Element, optional): The Gstreamer element to which the h264parse is linked. Leave it to None when it is linked from a "pad-added" callback.
 
         Returns:
             Gst.Element: The h264parse element that was created and added to the pipeline.
         """
         h264parse = Gst.ElementFactory.make("h264parse")
         self.pipeline.add(h264parse)
-        element.link(h264parse)
+        if element is not None:
+            element.link(h264parse)
         return h264parse
 
     @element_info
@@ -187,7 +396,7 @@ class GstreamerElements:
         Returns:
             Gst.Element: The avdec_h264 element that was created and added to the pipeline.
         """
-        avdec_h264 = Gst.ElementFactory.make("avdec_h264", "avdec_h264")
+        avdec_h264 = self.make("avdec_h264", "avdec_h264")
         self.pipeline.add(avdec_h264)
         
         if element is not None:
@@ -205,7 +414,7 @@ class GstreamerElements:
         Returns:
             Gst.Element: The nvv4l2decoder element that was created and added to the pipeline.
         """
-        nvv4l2decoder = Gst.ElementFactory.make("nvv4l2decoder", "nvv4l2decoder")
+        nvv4l2decoder = self.make("nvv4l2decoder", "nvv4l2decoder")
         self.pipeline.add(nvv4l2decoder)
         element.link(nvv4l2decoder)
         return nvv4l2decoder
@@ -221,7 +430,7 @@ class GstreamerElements:
         Returns:
             Gst.Element: The uridecodebin element that was created and added to the pipeline.
         """
-        uridecodebin = Gst.ElementFactory.make("uridecodebin", "uridecodebin")
+        uridecodebin = self.make("uridecodebin", "uridecodebin")
         uridecodebin.set_property("uri", uri)
         self.pipeline.add(uridecodebin)
         return uridecodebin
@@ -250,7 +459,7 @@ class GstreamerElements:
         This function adds a queue element in the Gstreamer pipeline and sets its properties.
 
         Args:
-            element (Gst.Element): The Gstreamer element to which the queue is linked.
+            element (Gst.Element): The Gstreamer element to which the queue is linked, None to leave the queue unlinked (e.g. a branch linked later).
             leaky (bool, optional): If set to True, the queue becomes leaky and can drop old buffers when the queue is full. Defaults to False.
             max_buffer (int, optional): The maximum number of buffers that can be stored in the queue. If the queue is full, it will not accept any more buffers until a buffer is removed. Defaults to 200.
             max_bytes (int, optional): The maximum amount of data in bytes that can be stored in the queue. If the queue is full, it will not accept any more data until some data is removed. Defaults to 10485760 (10 MB).
@@ -263,7 +472,8 @@ class GstreamerElements:
         queue.set_property("max-size-buffers", max_buffer)
         queue.set_property("max-size-bytes", max_bytes)
         self.pipeline.add(queue)
-        element.link(queue)
+        if element is not None:
+            element.link(queue)
         return queue
 
     @element_info
@@ -316,6 +526,22 @@ class GstreamerElements:
         element.link(videoconvert)
         return videoconvert
 
+    @element_info
+    def videoscale(self, element):
+        """
+        This function adds a videoscale element to the Gstreamer pipeline and links it to a previous element.
+
+        Args:
+            element (Gst.Element): The Gstreamer element to which the videoscale is linked.
+
+        Returns:
+            Gst.Element: The videoscale element that was created and added to the pipeline.
+        """
+        videoscale = Gst.ElementFactory.make("videoscale")
+        self.pipeline.add(videoscale)
+        element.link(videoscale)
+        return videoscale
+
     @element_info
     def nvvideoconvert(self, element, flip_method, interpolation_method, src_crop, dest_crop):
         """
@@ -332,7 +558,7 @@ class GstreamerElements:
         Returns:
             Gst.Element: The nvvideoconvert element that was created and added to the pipeline.
         """
-        nvvideoconvert = Gst.ElementFactory.make("nvvideoconvert", "nvvideoconvert")
+        nvvideoconvert = self.make("nvvideoconvert", "nvvideoconvert")
         nvvideoconvert.set_property("flip-method", flip_method)
         nvvideoconvert.set_property("interpolation-method", interpolation_method)
         nvvideoconvert.set_property("src-crop", src_crop)
@@ -343,7 +569,7 @@ class GstreamerElements:
 
 
     @element_info
-    def capsfilter(self, element, memory_type=None, format=None, width=None, height=None):
+    def capsfilter(self, element, memory_type=None, format=None, width=None, height=None, name=None):
         """
         This function adds a capsfilter element to the Gstreamer pipeline and sets its properties based on width, height, and memory type.
 
@@ -351,13 +577,14 @@ class GstreamerElements:
             element (Gst.Element): The Gstreamer element to which the capsfilter is linked.
             memory_type (str, optional): The memory type (e.g., 'NVMM', 'System'). Defaults to 'System'.
             format (str, optional): The format of the video data. Defaults to "I420".
-            width (int): The desired width of the video stream.
-            height (int): The desired height of the video stream.
+            width (int, optional): The desired width of the video stream.
+            height (int, optional): The desired height of the video stream.
+            name (str, optional): The name of the element, a unique name is generated by default so that a pipeline can hold several capsfilters.
 
         Returns:
             Gst.Element: The capsfilter element that was created and added to the pipeline.
         """
-        caps_filter = Gst.ElementFactory.make('capsfilter', 'caps')
+        caps_filter = self.make('capsfilter', name)
         caps_string = ""
 
         if memory_type:
@@ -367,11 +594,12 @@ class GstreamerElements:
 
         if format:
             caps_string += f', format=(string){format}'
-        else:
-            caps_string += f'"'
 
-        if width and width:
-            caps_string += f', width={width}, height={height}'
+        # A single dimension lets videoscale pick the other one from the aspect ratio
+        if width:
+            caps_string += f', width={width}'
+        if height:
+            caps_string += f', height={height}'
 
         caps = Gst.Caps.from_string(caps_string)
         caps_filter.set_property('caps', caps)
@@ -395,7 +623,7 @@ class GstreamerElements:
         Returns:
             Gst.Element: The textoverlay element that was created and added to the pipeline.
         """
-        textoverlay = Gst.ElementFactory.make("textoverlay", "textoverlay")
+        textoverlay = self.make("textoverlay", "textoverlay")
         if text:
             textoverlay.set_property("text", text)
             textoverlay.set_property("valignment", valignment)
@@ -417,7 +645,7 @@ class GstreamerElements:
         Returns:
             Gst.Element: The pngenc element that was created and added to the pipeline.
         """
-        pngenc = Gst.ElementFactory.make("pngenc", "pngenc")
+        pngenc = self.make("pngenc", "pngenc")
         pngenc.set_property("compression-level", compression_level)
         self.pipeline.add(pngenc)
         element.link(pngenc)
@@ -435,14 +663,14 @@ class GstreamerElements:
         Returns:
             Gst.Element: The jpegenc element that was created and added to the pipeline.
         """
-        jpegenc = Gst.ElementFactory.make("jpegenc", "jpegenc")
+        jpegenc = self.make("jpegenc", "jpegenc")
         jpegenc.set_property("quality", quality)
         self.pipeline.add(jpegenc)
         element.link(jpegenc)
         return jpegenc
 
     @element_info
-    def x264enc(self, element, bitrate=2000, speed_preset="ultrafast", tune="zerolatency"):
+    def x264enc(self, element, bitrate=2000, speed_preset="ultrafast", tune="zerolatency", key_int_max=0):
         """
         This function adds an x264enc element to the Gstreamer pipeline, sets its properties, and links it to a previous element.
 
@@ -451,14 +679,16 @@ class GstreamerElements:
             bitrate (int, optional): The desired bitrate for the encoded video in Kbps. Defaults to 2000.
             speed_preset (str, optional): The encoding speed preset (e.g., 'ultrafast', 'superfast', 'veryfast'). Defaults to 'ultrafast'.
             tune (str, optional): The x264enc tune option (e.g., 'zerolatency', 'film', 'animation'). Defaults to 'zerolatency'.
+            key_int_max (int, optional): The maximal distance between two keyframes in frames, 0 lets the encoder decide. Defaults to 0.
 
         Returns:
             Gst.Element: The x264enc element that was created and added to the pipeline.
         """
-        x264enc = Gst.ElementFactory.make("x264enc", "x264enc")
+        x264enc = self.make("x264enc", "x264enc")
         x264enc.set_property("bitrate", bitrate)
         x264enc.set_property("speed-preset", speed_preset)
         x264enc.set_property("tune", tune)
+        x264enc.set_property("key-int-max", key_int_max)
         self.pipeline.add(x264enc)
         element.link(x264enc)
         return x264enc
@@ -476,7 +706,7 @@ class GstreamerElements:
         Returns:
             Gst.Element: The nvv4l2h264enc element that was created and added to the pipeline.
         """
-        nvv4l2h264enc = Gst.ElementFactory.make("nvv4l2h264enc", "nvv4l2h264enc")
+        nvv4l2h264enc = self.make("nvv4l2h264enc", "nvv4l2h264enc")
         nvv4l2h264enc.set_property("bitrate", bitrate)
         nvv4l2h264enc.set_property("preset", preset)
         nvv4l2h264enc.set_property("control-rate", control_rate)
@@ -495,29 +725,31 @@ class GstreamerElements:
         Returns:
             Gst.Element: The qtmux element that was created and added to the pipeline.
         """
-        qtmux = Gst.ElementFactory.make("qtmux", "qtmux")
+        qtmux = self.make("qtmux", "qtmux")
         self.pipeline.add(qtmux)
         element.link(qtmux)
         return qtmux
 
     @element_info
-    def mp4mux(self, element):
+    def mp4mux(self, element, fragment_duration=0):
         """
         This function adds an mp4mux element to the Gstreamer pipeline and links it to a previous element.
 
         Args:
             element (Gst.Element): The Gstreamer element to which the mp4mux is linked.
+            fragment_duration (int, optional): The duration of the fragments in ms, a non zero value writes a fragmented MP4 which is playable while it is being written. Defaults to 0.
 
         Returns:
             Gst.Element: The mp4mux element that was created and added to the pipeline.
         """
-        mp4mux = Gst.ElementFactory.make("mp4mux", "mp4mux")
+        mp4mux = self.make("mp4mux", "mp4mux")
+        mp4mux.set_property("fragment-duration", fragment_duration)
         self.pipeline.add(mp4mux)
         element.link(mp4mux)
         return mp4mux
 
     @element_info
-    def filesink(self, element, output_file, file_ext):
+    def filesink(self, element, output_file, file_ext, output_dir="output"):
         """
         This function adds a filesink element to the Gstreamer pipeline, sets its properties, and links it to a previous element.
 
@@ -525,17 +757,95 @@ class GstreamerElements:
             element (Gst.Element): The Gstreamer element to which the filesink is linked.
             output_file (str): The name of the output file without the file extension.
             file_ext (str): The file extension (e.g., 'mp4', 'avi', 'mkv').
+            output_dir (str, optional): The directory in which the file is written. Defaults to "output".
 
         Returns:
             Gst.Element: The filesink element that was created and added to the pipeline.
         """
-        filesink = Gst.ElementFactory.make("filesink", "filesink")
-        filesink.set_property("location", f"output/{output_file}.{file_ext}")
+        filesink = self.make("filesink", "filesink")
+        filesink.set_property("location", f"{output_dir}/{output_file}.{file_ext}")
         filesink.set_property("async", True)
         self.pipeline.add(filesink)
         element.link(filesink)
         return filesink
 
+    @element_info
+    def fakesink(self, element, sync=False):
+        """
+        This function adds a fakesink element to the Gstreamer pipeline and links it to a previous element.
+
+        Args:
+            element (Gst.Element): The Gstreamer element to which the fakesink is linked.
+            sync (bool, optional): If set to True, the buffers are synchronised to the clock. Defaults to False.
+
+        Returns:
+            Gst.Element: The fakesink element that was created and added to the pipeline.
+        """
+        fakesink = self.make("fakesink", "fakesink")
+        fakesink.set_property("sync", sync)
+        self.pipeline.add(fakesink)
+        element.link(fakesink)
+        return fakesink
+
+    @element_info
+    def multifilesink(self, element, output_file, file_ext, output_dir="output"):
+        """
+        This function adds a multifilesink element to the Gstreamer pipeline, every frame is written to its own numbered file.
+
+        Args:
+            element (Gst.Element): The Gstreamer element producing the encoded frames.
+            output_file (str): The name of the output files, the frame number is appended to it.
+            file_ext (str): The file extension (e.g., 'jpg', 'png').
+            output_dir (str, optional): The directory in which the files are written. Defaults to "output".
+
+        Returns:
+            Gst.Element: The multifilesink element that was created and added to the pipeline.
+        """
+        multifilesink = self.make("multifilesink", "multifilesink")
+        multifilesink.set_property("location", f"{output_dir}/{output_file}_%06d.{file_ext}")
+        self.pipeline.add(multifilesink)
+        element.link(multifilesink)
+        return multifilesink
+
+    @element_info
+    def hlssink2(self, element, output_file, target_duration=2, output_dir="output"):
+        """
+        This function adds an hlssink2 element to the Gstreamer pipeline, sets its properties, and links it to a previous element.
+        The element writes the playlist output/<output_file>.m3u8 and the segments output/<output_file>_<n>.ts.
+
+        Args:
+            element (Gst.Element): The Gstreamer element (producing h264) to which the hlssink2 is linked.
+            output_file (str): The name of the playlist without the file extension.
+            target_duration (int, optional): The target duration of a segment in seconds. Defaults to 2.
+            output_dir (str, optional): The directory in which the playlist and segments are written. Defaults to "output".
+
+        Returns:
+            Gst.Element: The hlssink2 element that was created and added to the pipeline.
+        """
+        hlssink2 = self.make("hlssink2", "hlssink2")
+        hlssink2.set_property("location", f"{output_dir}/{output_file}_%05d.ts")
+        hlssink2.set_property("playlist-location", f"{output_dir}/{output_file}.m3u8")
+        hlssink2.set_property("target-duration", target_duration)
+        # Keep every segment in the playlist so that the complete recording can be played back
+        hlssink2.set_property("max-files", 0)
+        hlssink2.set_property("playlist-length", 0)
+        self.pipeline.add(hlssink2)
+        element.link(hlssink2)
+        return hlssink2
+
+    def fragment_prob(self, pad, info):
+        # Record the time at which the first fragment of a fragmented MP4 reaches the filesink
+        buffer = info.get_buffer()
+        if buffer.get_size() >= 8 and buffer.extract_dup(4, 4) == b"moof":
+            self.mark_first_output()
+            return Gst.PadProbeReturn.REMOVE
+        return Gst.PadProbeReturn.OK
+
+    def mark_first_output(self):
+        if self.first_output_time is None:
+            self.first_output_time = time.time()
+            print("INFO: First playable output is written")
+
     @element_info
     def autovideosink(self, element, sync=True):
         """
@@ -548,7 +858,7 @@ class GstreamerElements:
         Returns:
             Gst.Element: The autovideosink element that was created and added to the pipeline.
         """
-        autovideosink = Gst.ElementFactory.make("autovideosink","autovideosink")
+        autovideosink = self.make("autovideosink", "autovideosink")
         autovideosink.set_property("sync", sync)
         self.pipeline.add(autovideosink)
         element.link(autovideosink)
@@ -557,23 +867,199 @@ class GstreamerElements:
     # Define a callback function to receive the buffer data on appsink
     def buffer_dump_prob(self, appsink):
         sample = appsink.emit("pull-sample")
+        if sample and (self.batch_size or self.batch_ms):
+            return self.batch_sample(sample)
         if sample:
             self.in_frame_num +=1
             buffer = sample.get_buffer()
             # Parsing caps format
             caps_format = sample.get_caps().get_structure(0)
             w, h,format = caps_format.get_value('width'), caps_format.get_value('height'),caps_format.get_value('format')
+            strides, offsets = self.video_layout(sample.get_caps(), buffer)
+            # Drop the frame before converting it if the memory budget is reached, the lossless queue is bounded instead
+            frame_bytes = w * h * 3
+            if not self.memory.reserve(frame_bytes, force=(self.frame_mode == "lossless")):
+                return Gst.FlowReturn.OK
             # Parsing the buffer into yuv2 image
             buffer_size = buffer.get_size()
             data = buffer.extract_dup(0, buffer_size)
-            rgb_converter = RGB_Converter()
-            rgb_image = rgb_converter.buffer_to_rgb(data,w,h,format)
+            try:
+                rgb_image = self.rgb_converter.buffer_to_rgb(data,w,h,format,strides,offsets)
+            except ValueError as e:
+                self.memory.cancel(frame_bytes)
+                print(f"Error: {e}, add a capsfilter with a supported format before the appsink")
+                return Gst.FlowReturn.NOT_NEGOTIATED
+            self.memory.set_scratch(buffer_size + self.rgb_converter.scratch_bytes)
             #push the buffer into buffer_queue
             # rgb_image = cv2.resize(rgb_image, (320, 240))
-            self.buffer_queue.put(rgb_image,block=False)
+            frame = Frame(
+                image=rgb_image, index=self.in_frame_num - 1,
+                pts=buffer.pts if buffer.pts != Gst.CLOCK_TIME_NONE else None,
+                duration=buffer.duration if buffer.duration != Gst.CLOCK_TIME_NONE else None,
+                width=w, height=h, format=format, time=time.time(),
+            )
+            if self.queue_frame(frame) and self.frame_callback is not None:
+                self.frame_callback()
+
+        return Gst.FlowReturn.OK
+
+    def queue_frame(self, frame):
+        """
+        This function puts a frame into buffer_queue according to the frame mode.
+        In the "latest" mode the frame not fetched yet is replaced, in the "lossless" mode the streaming thread waits
+        (hence the upstream elements) until the consumer has made room or the queue is flushing.
 
+        Returns:
+            bool: False if the frame was dropped.
+        """
+        if self.frame_mode == "lossless":
+            while not self.flushing:
+                try:
+                    self.buffer_queue.put(frame, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            self.memory.cancel(frame.nbytes)
+            return False
+
+        while True:
+            try:
+                self.buffer_queue.put(frame, block=False)
+                return True
+            except queue.Full:
+                pass
+            try:
+                replaced = self.buffer_queue.get(block=False)
+                self.memory.cancel(replaced.nbytes)
+            except queue.Empty:
+                pass
+
+    def batch_sample(self, sample):
+        """
+        This function converts the frames of an appsink sample straight into the preallocated array of the current batch.
+        The batch is queued once it holds batch_size frames or spans batch_ms of stream time, a sample may carry a buffer list.
+        """
+        caps = sample.get_caps()
+        if self.batch_caps is None or not caps.is_equal(self.batch_caps):
+            caps_format = caps.get_structure(0)
+            self.batch_caps = caps
+            self.batch_layout = (caps_format.get_value('width'), caps_format.get_value('height'), caps_format.get_value('format'), *self.video_layout(caps))
+        w, h, format, strides, offsets = self.batch_layout
+        buffer_list = sample.get_buffer_list()
+        buffers = [buffer_list.get(i) for i in range(buffer_list.length())] if buffer_list is not None else [sample.get_buffer()]
+        for buffer in buffers:
+            self.in_frame_num += 1
+            if self.batch is not None and (self.batch.width, self.batch.height, self.batch.format) != (w, h, format):
+                self.flush_batch()
+            # The frames are dropped until the memory budget has room for a whole batch
+            if self.batch is None and not self.start_batch(caps, w, h, format):
+                continue
+            # A video meta (padded rows of a hardware decoder...) overrides the layout of the caps
+            meta = GstVideo.buffer_get_video_meta(buffer)
+            layout = (list(meta.stride[:meta.n_planes]), list(meta.offset[:meta.n_planes])) if meta is not None else (strides, offsets)
+            # Converted straight from the mapped memory of the buffer, without copying it first
+            success, map_info = buffer.map(Gst.MapFlags.READ)
+            if not success:
+                print(f"Warning: Frame {self.in_frame_num - 1} can't be mapped, it is dropped")
+                continue
+            try:
+                self.rgb_converter.buffer_to_rgb(map_info.data, w, h, format, *layout, out=self.batch.images[self.batch_count])
+            except ValueError as e:
+                self.memory.cancel(self.batch.nbytes)
+                self.batch = None
+                print(f"Error: {e}, add a capsfilter with a supported format before the appsink")
+                return Gst.FlowReturn.NOT_NEGOTIATED
+            finally:
+                buffer.unmap(map_info)
+            self.memory.set_scratch(self.rgb_converter.scratch_bytes)
+            pts = buffer.pts if buffer.pts != Gst.CLOCK_TIME_NONE else -1
+            duration = buffer.duration if buffer.duration != Gst.CLOCK_TIME_NONE else 0
+            self.batch.pts[self.batch_count] = pts
+            self.batch_count += 1
+            if self.batch_count == len(self.batch.images) or self.batch_elapsed(pts, duration):
+                self.flush_batch()
         return Gst.FlowReturn.OK
 
+    def start_batch(self, caps, w, h, format):
+        """
+        This function preallocates the array of the next batch, sized for batch_size frames or for the frames of batch_ms at the caps framerate.
+
+        Returns:
+            bool: False if the memory budget has no room for the batch.
+        """
+        if self.batch_size:
+            capacity = self.batch_size
+        else:
+            found, num, den = caps.get_structure(0).get_fraction("framerate")
+            fps = num / den if found and num > 0 and den > 0 else 30
+            capacity = max(1, math.ceil(self.batch_ms * fps / 1000))
+        nbytes = capacity * h * w * 3
+        if not self.memory.reserve(nbytes, force=(self.frame_mode == "lossless")):
+            return False
+        self.batch = FrameBatch(
+            images=np.empty((capacity, h, w, 3), dtype=np.uint8), pts=np.full(capacity, -1, dtype=np.int64),
+            index=self.in_frame_num - 1, width=w, height=h, format=format, time=time.time(), nbytes=nbytes,
+        )
+        self.batch_count = 0
+        return True
+
+    def batch_elapsed(self, pts, duration):
+        # The batch spans batch_ms of stream time, or of wall clock time for the buffers without timestamp
+        if not self.batch_ms:
+            return False
+        first_pts = self.batch.pts[0]
+        if pts >= 0 and first_pts >= 0:
+            return pts + duration - first_pts >= self.batch_ms * Gst.MSECOND
+        return time.time() - self.batch.time >= self.batch_ms / 1000
+
+    def flush_batch(self):
+        """
+        This function queues the frames of the current batch, the images and pts are trimmed to the filled part without copying.
+        """
+        batch, count = self.batch, self.batch_count
+        self.batch = None
+        if batch is None:
+            return
+        if count == 0:
+            self.memory.cancel(batch.nbytes)
+            return
+        batch.images, batch.pts, batch.time = batch.images[:count], batch.pts[:count], time.time()
+        if self.queue_frame(batch) and self.frame_callback is not None:
+            self.frame_callback()
+
+    def batch_eos_prob(self, pad, info):
+        # The last partial batch is queued before the appsink handles EOS
+        if info.get_event().type == Gst.EventType.EOS:
+            self.flush_batch()
+        return Gst.PadProbeReturn.OK
+
+    def video_layout(self, caps, buffer=None):
+        """
+        This function returns the strides and the plane offsets of a raw video buffer.
+        The video meta of the buffer is used if the upstream element attached one, otherwise the layout is derived from the caps.
+
+        Args:
+            caps (Gst.Caps): The caps of the buffer.
+            buffer (Gst.Buffer, optional): The raw video buffer. Defaults to None i.e. the layout of the caps.
+
+        Returns:
+            tuple: The list of the strides and the list of the offsets, (None, None) if the layout is unknown.
+        """
+        meta = GstVideo.buffer_get_video_meta(buffer) if buffer is not None else None
+        if meta is not None:
+            return list(meta.stride[:meta.n_planes]), list(meta.offset[:meta.n_planes])
+        if hasattr(GstVideo.VideoInfo, "new_from_caps"):
+            info = GstVideo.VideoInfo.new_from_caps(caps)
+        else:
+            # Gstreamer older than 1.20
+            info = GstVideo.VideoInfo()
+            if not info.from_caps(caps):
+                info = None
+        if info is None:
+            return None, None
+        n_planes = info.finfo.n_planes
+        return list(info.stride[:n_planes]), list(info.offset[:n_planes])
+
     @element_info
     def appsink(self, element):
         """
@@ -585,22 +1071,41 @@ class GstreamerElements:
         Returns:
             Gst.Element: The appsink element that was created and added to the pipeline.
         """
-        appsink = Gst.ElementFactory.make("appsink", "appsink")
+        appsink = self.make("appsink", "appsink")
         # Set the appsink to emit signals when data is available
         appsink.set_property("buffer-list", True)
         appsink.set_property("emit-signals", True)
-        appsink.set_property("drop", True)
+        # The lossless frames are never dropped, the callback blocks the streaming thread instead
+        appsink.set_property("drop", self.frame_mode != "lossless")
+        appsink.set_property("max-buffers", LOSSLESS_QUEUE_FRAMES if self.frame_mode == "lossless" else 1)
 
         # Connect the callback function to the appsink's "new-sample" signal
         appsink.connect("new-sample", self.buffer_dump_prob)
+        if self.batch_size or self.batch_ms:
+            appsink.get_static_pad("sink").add_probe(Gst.PadProbeType.EVENT_DOWNSTREAM, self.batch_eos_prob)
 
         self.pipeline.add(appsink)
         element.link(appsink)
         return appsink
 
 
-    def read_input(self, input_file, width=None, height=None):
-        filesrc = self.filesrc(file_path=input_file)
+    def read_input(self, input_file, width=None, height=None, input_data=None):
+        """
+        This function adds the source and decoder elements needed to read the input file.
+
+        Args:
+            input_file (str): The path (or name) of the input file, its extension selects the decoder.
+            width (int, optional): The width of the input.
+            height (int, optional): The height of the input.
+            input_data (bytes-like, optional): The content of the input file, when given it is fed from memory instead of reading input_file from disk.
+
+        Returns:
+            Gst.Element: The decoder element producing the raw frames.
+        """
+        if input_data is not None:
+            filesrc = self.memsrc(input_data)
+        else:
+            filesrc = self.filesrc(file_path=input_file)
         file_ext = input_file.split(".")[-1].lower()
 
         if file_ext == "h264":
@@ -627,6 +1132,44 @@ class GstreamerElements:
 
         # decoded_output = self.videoconvert(decoder)
         return decoder
+
+    def read_sequence(self, location, file_ext, framerate=30):
+        """
+        This function adds the source and decoder elements needed to read an image sequence as one stream.
+
+        Args:
+            location (str): The printf pattern of the frames (see sequence.link_sequence).
+            file_ext (str): The extension of the frames, 'jpg' or 'png'.
+            framerate (int, optional): The frame rate of the stream. Defaults to 30.
+
+        Returns:
+            Gst.Element: The decoder element producing the raw frames.
+        """
+        multifilesrc = self.multifilesrc(location, file_ext, framerate=framerate)
+        if file_ext == "jpg":
+            return self.jpegdec(multifilesrc)
+        return self.pngdec(multifilesrc)
+
+    def remux_input(self, input_file, input_data=None):
+        """
+        This function adds the source, demuxer and parser elements needed to read the H.264 stream of an MP4 file without decoding it.
+
+        Args:
+            input_file (str): The path (or name) of the MP4 input file.
+            input_data (bytes-like, optional): The content of the input file, when given it is fed from memory instead of reading input_file from disk.
+
+        Returns:
+            Gst.Element: The h264parse element producing the encoded frames.
+        """
+        if input_data is not None:
+            filesrc = self.memsrc(input_data)
+        else:
+            filesrc = self.filesrc(file_path=input_file)
+        qtdemux = self.qtdemux(filesrc)
+        parser = self.h264parse()
+        # Dynamically link the qtdemux and parser
+        qtdemux.connect("pad-added", self.demuxer_pad_added, parser)
+        return parser
     
     def read_input1(self, input_file, width=None, height=None):
         filesrc = self.filesrc(file_path=input_file)
@@ -662,16 +1205,53 @@ class GstreamerElements:
         # decoded_output = self.videoconvert(decoder)
         return streammux
 
-    def write_output(self, element, output_file, file_ext, async_mode=False):
-        if file_ext == "mp4" or file_ext == "h264":
-            # Create an x264enc element and link it to the videoconvert
+    def write_output(self, element, output_file, file_ext, async_mode=False, output_mode="mp4", fragment_duration=1000, output_dir="output", encoded=False, sequence=False):
+        """
+        This function adds the encoder, muxer and sink elements needed to write the output file.
+
+        Args:
+            element (Gst.Element): The Gstreamer element producing the raw frames (or the parsed H.264 frames when encoded is True).
+            output_file (str): The name of the output file without the file extension.
+            file_ext (str): The file extension (e.g., 'mp4', 'jpg', 'png').
+            output_mode (str, optional): The container of the video outputs, "mp4" (written on EOS), "fmp4" (fragmented MP4) or "hls" (playlist and segments). Defaults to "mp4".
+            fragment_duration (int, optional): The duration of the fragments/segments in ms for the "fmp4" and "hls" modes. Defaults to 1000.
+            output_dir (str, optional): The directory in which the output is written. Defaults to "output".
+            encoded (bool, optional): If set to True, the H.264 frames of element are muxed as they are (mp4/h264 outputs only). Defaults to False.
+            sequence (bool, optional): If set to True, the jpg/png outputs are written as a numbered image sequence instead of a single file. Defaults to False.
+
+        Returns:
+            Gst.Element: The sink element writing the output.
+        """
+        if sequence and file_ext in ("jpg", "png"):
+            # One numbered file per frame
+            encoder = self.jpegenc(element) if file_ext == "jpg" else self.pngenc(element)
+            return self.multifilesink(encoder, output_file=output_file, file_ext=file_ext, output_dir=output_dir)
+
+        if encoded:
+            # Passthrough, the segments/fragments follow the keyframes of the input
+            if output_mode == "hls":
+                return self.hlssink2(element, output_file=output_file, target_duration=max(1, round(fragment_duration / 1000)), output_dir=output_dir)
+            encoded_output = self.mp4mux(element, fragment_duration=fragment_duration if output_mode == "fmp4" else 0)
+            file_ext = "mp4"
+
+        elif file_ext == "mp4" or file_ext == "h264":
+            if output_mode == "hls":
+                # Segments can only be cut at keyframes, hence force a keyframe at least every segment
+                encoder = self.x264enc(element, key_int_max=max(1, fragment_duration * 30 // 1000))
+                self.keyframe_interval(encoder, fragment_duration)
+                parser = self.h264parse(encoder)
+                return self.hlssink2(parser, output_file=output_file, target_duration=max(1, round(fragment_duration / 1000)), output_dir=output_dir)
+
+            # Create an x264enc element and link it to the videoconvert, the fragments are also cut at keyframes
             encoder = self.x264enc(element)
+            if output_mode == "fmp4":
+                self.keyframe_interval(encoder, fragment_duration)
 
             # Create a h264parse element and link it to the encoder
             parser = self.h264parse(encoder)
 
             # Create a mp4mux element and link it to the h264parse
-            encoded_output = self.mp4mux(parser)
+            encoded_output = self.mp4mux(parser, fragment_duration=fragment_duration if output_mode == "fmp4" else 0)
 
             file_ext = "mp4"
 
@@ -687,8 +1267,31 @@ class GstreamerElements:
             encoder = self.pngenc(element)
             encoded_output = self.videoconvert(encoder)
         
-        return self.filesink(encoded_output, output_file=output_file, file_ext=file_ext)
+        filesink = self.filesink(encoded_output, output_file=output_file, file_ext=file_ext, output_dir=output_dir)
+        if output_mode == "fmp4" and file_ext == "mp4":
+            filesink.get_static_pad("sink").add_probe(Gst.PadProbeType.BUFFER, self.fragment_prob)
+        return filesink
+
 
+    def keyframe_interval(self, encoder, fragment_duration):
+        """
+        This function sets the keyframe interval of an x264enc to one fragment/segment at the negotiated framerate,
+        so low framerate inputs (image sequences, cameras) don't get fragments longer than fragment_duration.
+        The interval given to x264enc is kept when the framerate is unknown (0/1).
+        """
+        encoder.get_static_pad("sink").add_probe(Gst.PadProbeType.EVENT_DOWNSTREAM, self.keyframe_interval_prob, fragment_duration)
+
+    def keyframe_interval_prob(self, pad, info, fragment_duration):
+        event = info.get_event()
+        if event.type != Gst.EventType.CAPS:
+            return Gst.PadProbeReturn.OK
+        # Set before the encoder handles the caps i.e. before it is configured
+        found, num, den = event.parse_caps().get_structure(0).get_fraction("framerate")
+        if found and num > 0 and den > 0:
+            key_int_max = max(1, round(fragment_duration * num / den / 1000))
+            pad.get_parent_element().set_property("key-int-max", key_int_max)
+            print(f"INFO: Keyframe interval --> {key_int_max} frames at {round(num / den, 2)}fps")
+        return Gst.PadProbeReturn.REMOVE
 
     def write_output1(self, element, output_file, file_ext):
         if file_ext == "mp4" or file_ext == "h264":
@@ -0,0 +1,264 @@
+##################################################################################################################
+# Author: Vishal Kumar
+# Email: vishalkmr01123@gmail.com
+#
+# This file contains the decoded frame cache of the file inputs.
+# A run of a file input records its decoded frames, converted to the target caps, under the key
+# (content hash of the input, target caps, PTS). Once a run has reached its natural EOS the clip is complete and
+# the next runs of the same input (and time range) are served from the cache by an appsrc instead of decoding:
+#     [appsrc -> videoconvert -> tee -> ...]   instead of   [filesrc -> qtdemux -> avdec_h264 -> videoconvert -> tee -> ...]
+# The frames live in a size bounded LRU, the least recently used frames are spilled to disk and read back
+# memory-mapped. The spill files are removed (oldest first) once the disk budget is reached.
+# The frames in memory and on disk are kept in two LRUs so that an eviction only looks at the oldest frames in memory,
+# and a spilled frame is written outside the lock at an offset reserved under it, it stays readable from memory until
+# it is published on disk.
+#
+# Environment:
+#     FRAME_CACHE_MB      : bytes of the frames kept in memory (default 1024)
+#     FRAME_CACHE_DISK_MB : bytes of the frames spilled to disk (default 4096)
+#     FRAME_CACHE_DIR     : directory of the spill files (default cache/frames)
+##################################################################################################################
+
+import os, glob, time, hashlib, itertools, threading
+from collections import OrderedDict
+import numpy as np
+from shared import shared_instance
+
+MB = 1024 * 1024
+
+
+class ClipRecorder:
+    """
+    Collects the frames of one run, the clip is registered only if the run is complete.
+    """
+    def __init__(self, cache, digest, clip_key):
+        self.cache = cache
+        self.digest = digest
+        self.clip_key = clip_key
+        self.caps = None
+        self.frames = []
+
+    def add(self, caps, pts, duration, data):
+        """
+        Records a decoded frame.
+
+        Args:
+            caps (str): The caps of the frame.
+            pts (int): The presentation timestamp of the frame in ns.
+            duration (int): The duration of the frame in ns.
+            data (bytes): The content of the frame.
+        """
+        if self.caps is None:
+            self.caps = caps
+        elif caps != self.caps:
+            # A caps change in the middle of the clip can't be replayed by a single appsrc
+            self.frames = None
+        if self.frames is None:
+            return
+        self.cache.put((self.digest, caps, pts), data)
+        self.frames.append((pts, duration))
+
+    def reset(self):
+        """
+        Forgets the frames recorded so far e.g. the prerolled frames flushed by the seek to the start of the time range.
+        """
+        self.caps = None
+        self.frames = []
+
+    def close(self, complete):
+        """
+        Registers the clip if the run reached its natural EOS.
+        """
+        if complete and self.frames:
+            self.cache.add_clip(self.clip_key, self.caps, self.frames)
+
+
+class FrameCache:
+    """
+    LRU of the decoded frames with memory-mapped spill to disk.
+    """
+    def __init__(self, memory_bytes=1024 * MB, disk_bytes=4096 * MB, spill_dir=os.path.join("cache", "frames")):
+        """
+        Args:
+            memory_bytes (int, optional): The maximal bytes of the frames kept in memory. Defaults to 1GB.
+            disk_bytes (int, optional): The maximal bytes of the spill files. Defaults to 4GB.
+            spill_dir (str, optional): The directory of the spill files. Defaults to "cache/frames".
+        """
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.spill_dir = spill_dir
+        os.makedirs(spill_dir, exist_ok=True)
+        # The spill files of a previous process are not indexed, appending to them would shift the offsets
+        for path in glob.glob(os.path.join(spill_dir, "*.frames")):
+            os.remove(path)
+        self.lock = threading.Lock()
+        # (digest, caps, pts) --> bytes in memory, least recently used first
+        self.memory = OrderedDict()
+        # (digest, caps, pts) --> bytes being written to a spill file
+        self.spilling = {}
+        # (digest, caps, pts) --> (spill path, offset, size) on disk, least recently used first
+        self.disk = OrderedDict()
+        self.clips = {}
+        self.used_memory = 0
+        self.used_disk = 0
+        # spill path --> [size, last access time, frame keys], the path of a removed spill file is never reused
+        self.spill_files = {}
+        self.spill_paths = {}
+        self.spill_numbers = itertools.count()
+        self.hits = 0
+        self.misses = 0
+
+    def clip_key(self, config, target_format):
+        """
+        Returns the key of the clip of a run i.e. the input content, its time range and the target format.
+        """
+        return (config.input_hash, config.start_time, config.end_time, target_format)
+
+    def recorder(self, config, target_format):
+        """
+        Returns the recorder of the frames of a run of the config.
+        """
+        return ClipRecorder(self, config.input_hash, self.clip_key(config, target_format))
+
+    def lookup(self, config, target_format):
+        """
+        Returns the clip of the config if all its frames are still cached, None otherwise.
+
+        Returns:
+            tuple: The caps of the frames and the list of the (pts, duration) of the frames.
+        """
+        with self.lock:
+            clip = self.clips.get(self.clip_key(config, target_format))
+            if clip is not None and all(self.contains((config.input_hash, clip[0], pts)) for pts, _ in clip[1]):
+                self.hits += 1
+                return clip
+            self.clips.pop(self.clip_key(config, target_format), None)
+            self.misses += 1
+            return None
+
+    def add_clip(self, clip_key, caps, frames):
+        with self.lock:
+            self.clips[clip_key] = (caps, frames)
+
+    def contains(self, key):
+        # Called with the lock held
+        return key in self.memory or key in self.spilling or key in self.disk
+
+    def put(self, key, data):
+        with self.lock:
+            if self.contains(key):
+                if key in self.memory:
+                    self.memory.move_to_end(key)
+                return
+            self.memory[key] = data
+            self.used_memory += len(data)
+            spills = self.evict()
+        # The frames are written without the lock, the readers and the other recorders go on meanwhile
+        for key, data, path, offset in spills:
+            try:
+                fd = os.open(path, os.O_WRONLY)
+                try:
+                    os.pwrite(fd, data, offset)
+                finally:
+                    os.close(fd)
+                written = True
+            except OSError:
+                # The spill file was removed in the meantime
+                written = False
+            with self.lock:
+                self.spilling.pop(key, None)
+                spill = self.spill_files.get(path)
+                if written and spill is not None:
+                    self.disk[key] = (path, offset, len(data))
+                    spill[2].add(key)
+
+    def get(self, key):
+        """
+        Returns the content of a cached frame, a memory-mapped array if it was spilled to disk.
+        """
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                return self.memory[key]
+            if key in self.spilling:
+                return self.spilling[key]
+            path, offset, size = self.disk[key]
+            self.disk.move_to_end(key)
+            self.spill_files[path][1] = time.time()
+            return np.memmap(path, dtype=np.uint8, mode="r", offset=offset, shape=(size,))
+
+    def frame_source(self, digest, caps, frames):
+        """
+        Yields the (pts, duration, data) of the frames of a clip, the timestamps start at 0.
+        """
+        first_pts = frames[0][0]
+        for pts, duration in frames:
+            try:
+                data = self.get((digest, caps, pts))
+            except KeyError:
+                # The spill file was removed by another session during the replay, the stream ends early
+                print(f"Warning: Frame cache --> frame {pts} of {digest} evicted during the replay")
+                return
+            yield pts - first_pts, duration, data
+
+    def evict(self):
+        """
+        Moves the least recently used frames out of the memory budget, called with the lock held.
+
+        Returns:
+            list: The (key, data, spill path, offset) of the frames to write, the offsets are reserved in the spill files.
+        """
+        spills = []
+        while self.used_memory > self.memory_bytes and self.memory:
+            key, data = self.memory.popitem(last=False)
+            self.used_memory -= len(data)
+            # The frames of an input are appended to its own spill file
+            spill_key = f"{key[0]}:{key[1]}"
+            path = self.spill_paths.get(spill_key)
+            if path is None or path not in self.spill_files:
+                path = os.path.join(self.spill_dir, f"{hashlib.sha256(spill_key.encode()).hexdigest()}.{next(self.spill_numbers)}.frames")
+                open(path, "wb").close()
+                self.spill_paths[spill_key] = path
+                self.spill_files[path] = [0, time.time(), set()]
+            spill = self.spill_files[path]
+            spills.append((key, data, path, spill[0]))
+            self.spilling[key] = data
+            spill[0] += len(data)
+            spill[1] = time.time()
+            self.used_disk += len(data)
+
+        # Whole spill files are removed, the least recently read first
+        while self.used_disk > self.disk_bytes and self.spill_files:
+            path = min(self.spill_files, key=lambda p: self.spill_files[p][1])
+            size, _, keys = self.spill_files.pop(path)
+            self.used_disk -= size
+            for key in keys:
+                self.disk.pop(key, None)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        return spills
+
+    def report(self):
+        with self.lock:
+            return {
+                "frames": len(self.memory) + len(self.spilling) + len(self.disk),
+                "clips": len(self.clips),
+                "memory_bytes": self.used_memory,
+                "disk_bytes": self.used_disk,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+@shared_instance
+def get_frame_cache():
+    """
+    Returns the FrameCache shared by all the sessions of the process.
+    """
+    return FrameCache(
+        memory_bytes=int(os.environ.get("FRAME_CACHE_MB", 1024)) * MB,
+        disk_bytes=int(os.environ.get("FRAME_CACHE_DISK_MB", 4096)) * MB,
+        spill_dir=os.environ.get("FRAME_CACHE_DIR", os.path.join("cache", "frames")),
+    )
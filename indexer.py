@@ -0,0 +1,253 @@
+##################################################################################################################
+# Author: Vishal Kumar
+# Email: vishalkmr01123@gmail.com
+#
+# This file contains the functions used to index the uploaded videos without decoding them.
+# The input is only demuxed and parsed [filesrc -> qtdemux -> h264parse -> fakesink], the position of every
+# keyframe is recorded by a pad probe on the parser, which gives the seek targets of the input.
+# The thumbnail strip decodes a few keyframes only, all the other frames are dropped before the decoder:
+#     [filesrc -> qtdemux -> h264parse -(keyframes)-> avdec_h264 -> videoconvert -> videoscale -> appsink]
+# The Indexer indexes the uploads in the background, the index and the strip are stored beside the
+# content addressed input (<sha256>.index.json, <sha256>.thumbs.jpg) and are removed with it.
+##################################################################################################################
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+import os, json, threading
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from elements import GstreamerElements
+from utils import plane, default_layout
+from shared import shared_instance
+
+THUMBNAIL_HEIGHT = 90
+THUMBNAIL_COUNT = 12
+
+
+def keyframe_prob(pad, info, keyframes):
+    # Buffers without the DELTA_UNIT flag are the keyframes
+    buffer = info.get_buffer()
+    if not buffer.has_flags(Gst.BufferFlags.DELTA_UNIT) and buffer.pts != Gst.CLOCK_TIME_NONE:
+        keyframes.append(buffer.pts / Gst.SECOND)
+    return Gst.PadProbeReturn.OK
+
+
+def keyframe_index(input_file):
+    """
+    Builds the keyframe index of an MP4/h264 file by demuxing it, nothing is decoded.
+
+    Args:
+        input_file (str): The path of the input file.
+
+    Returns:
+        dict: The sorted keyframe positions in seconds ("keyframes") and the duration of the input in seconds ("duration").
+    """
+    Gst.init(None)
+    pipeline = Gst.Pipeline()
+    elements = GstreamerElements(pipeline)
+
+    filesrc = elements.filesrc(file_path=input_file)
+    if input_file.split(".")[-1].lower() == "mp4":
+        qtdemux = elements.qtdemux(filesrc)
+        parser = elements.h264parse()
+        qtdemux.connect("pad-added", elements.demuxer_pad_added, parser)
+    else:
+        parser = elements.h264parse(filesrc)
+    elements.fakesink(parser)
+
+    keyframes = []
+    parser.get_static_pad("src").add_probe(Gst.PadProbeType.BUFFER, keyframe_prob, keyframes)
+
+    pipeline.set_state(Gst.State.PLAYING)
+    message = pipeline.get_bus().timed_pop_filtered(Gst.CLOCK_TIME_NONE, Gst.MessageType.EOS | Gst.MessageType.ERROR)
+    ok, duration = pipeline.query_duration(Gst.Format.TIME)
+    pipeline.set_state(Gst.State.NULL)
+
+    if message.type == Gst.MessageType.ERROR:
+        err, debug = message.parse_error()
+        raise RuntimeError(f"Indexing {input_file} failed: {err}")
+
+    return {"keyframes": sorted(keyframes), "duration": duration / Gst.SECOND if ok else None}
+
+
+def gop_chunks(index, n_chunks):
+    """
+    Splits the input into n_chunks time ranges of similar duration, every range starts and ends on a keyframe.
+
+    Args:
+        index (dict): The keyframe index returned by keyframe_index.
+        n_chunks (int): The wanted number of chunks, fewer are returned if the input has fewer keyframes.
+
+    Returns:
+        list: The (start, end) time ranges in seconds, end is None for the last chunk.
+    """
+    if not index["keyframes"]:
+        return [(None, None)]
+    keyframes, duration = index["keyframes"], index["duration"] or index["keyframes"][-1]
+    boundaries = [keyframes[0]]
+    for i in range(1, n_chunks):
+        target = duration * i / n_chunks
+        # Nearest keyframe after the previous boundary
+        candidates = [k for k in keyframes if k > boundaries[-1]]
+        if not candidates:
+            break
+        boundary = min(candidates, key=lambda k: abs(k - target))
+        if boundary not in boundaries:
+            boundaries.append(boundary)
+    boundaries = sorted(boundaries)
+    return [(start, end) for start, end in zip(boundaries, boundaries[1:] + [None])]
+
+
+def thumbnail_prob(pad, info, targets):
+    # Only the selected keyframes reach the decoder, the other frames are never decoded
+    buffer = info.get_buffer()
+    if buffer.has_flags(Gst.BufferFlags.DELTA_UNIT) or buffer.pts == Gst.CLOCK_TIME_NONE or buffer.pts / Gst.SECOND not in targets:
+        return Gst.PadProbeReturn.DROP
+    return Gst.PadProbeReturn.OK
+
+
+def select_keyframes(keyframes, count):
+    """
+    Returns up to count keyframes evenly spread over the input.
+    """
+    if count <= 1:
+        return list(keyframes[:1])
+    if len(keyframes) <= count:
+        return list(keyframes)
+    return sorted({keyframes[round(i * (len(keyframes) - 1) / (count - 1))] for i in range(count)})
+
+
+def thumbnail_strip(input_file, keyframes, output_path, height=THUMBNAIL_HEIGHT):
+    """
+    Decodes the given keyframes of an MP4 file into a downscaled thumbnail strip (a single jpg image).
+
+    Args:
+        input_file (str): The path of the MP4 input.
+        keyframes (list): The positions in seconds of the keyframes to decode, as returned by keyframe_index.
+        output_path (str): The path of the jpg strip.
+        height (int, optional): The height of the thumbnails. Defaults to 90.
+
+    Returns:
+        list: The positions in seconds of the thumbnails of the strip, from left to right.
+    """
+    Gst.init(None)
+    pipeline = Gst.Pipeline()
+    elements = GstreamerElements(pipeline)
+
+    qtdemux = elements.qtdemux(elements.filesrc(file_path=input_file))
+    parser = elements.h264parse()
+    qtdemux.connect("pad-added", elements.demuxer_pad_added, parser)
+    parser.get_static_pad("src").add_probe(Gst.PadProbeType.BUFFER, thumbnail_prob, set(keyframes))
+    decoder = elements.avdec_h264(parser)
+    scaled = elements.capsfilter(elements.videoscale(elements.videoconvert(decoder)), format="BGR", height=height)
+
+    # The frames are pulled synchronously, no main loop is needed
+    appsink = Gst.ElementFactory.make("appsink")
+    appsink.set_property("sync", False)
+    pipeline.add(appsink)
+    scaled.link(appsink)
+
+    pipeline.set_state(Gst.State.PLAYING)
+    thumbnails, times = [], []
+    while True:
+        sample = appsink.emit("try-pull-sample", 10 * Gst.SECOND)
+        if sample is None:
+            break
+        buffer = sample.get_buffer()
+        structure = sample.get_caps().get_structure(0)
+        width, frame_height = structure.get_value("width"), structure.get_value("height")
+        strides, offsets = elements.video_layout(sample.get_caps(), buffer)
+        data = buffer.extract_dup(0, buffer.get_size())
+        stride = strides[0] if strides else default_layout("BGR", width, frame_height)[0][0]
+        thumbnails.append(plane(data, offsets[0] if offsets else 0, stride, frame_height, width * 3).reshape((frame_height, width, 3)))
+        times.append(buffer.pts / Gst.SECOND)
+    message = pipeline.get_bus().pop_filtered(Gst.MessageType.ERROR)
+    pipeline.set_state(Gst.State.NULL)
+
+    if message is not None:
+        err, debug = message.parse_error()
+        raise RuntimeError(f"Thumbnails of {input_file} failed: {err}")
+    if thumbnails:
+        # Written under a temporary name, a reader never sees a partial strip
+        temp_path = f"{output_path}.tmp.jpg"
+        cv2.imwrite(temp_path, np.hstack(thumbnails))
+        os.replace(temp_path, output_path)
+    return times
+
+
+class Indexer:
+    """
+    Indexes the uploaded MP4 files in the background, one at a time so the indexing never competes with the pipelines.
+    """
+    def __init__(self, workers=1, thumbnail_count=THUMBNAIL_COUNT, thumbnail_height=THUMBNAIL_HEIGHT):
+        self.thumbnail_count = thumbnail_count
+        self.thumbnail_height = thumbnail_height
+        self.lock = threading.Lock()
+        self.futures = {}
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="indexer")
+
+    def sidecar_path(self, object_path, suffix):
+        # <sha256>.<ext> --> <sha256>.<suffix>, the sidecars are removed together with the object
+        digest = os.path.basename(object_path).split(".")[0]
+        return os.path.join(os.path.dirname(object_path), f"{digest}.{suffix}")
+
+    def submit(self, object_path):
+        """
+        Queues the indexing of a stored input, it does nothing if the input is already indexed or queued.
+
+        Returns:
+            concurrent.futures.Future: The future of the index.
+        """
+        object_path = os.path.realpath(object_path)
+        with self.lock:
+            future = self.futures.get(object_path)
+            if future is None:
+                future = self.executor.submit(self.index, object_path)
+                self.futures[object_path] = future
+            return future
+
+    def result(self, object_path):
+        """
+        Returns the index of a stored input if it is ready, None otherwise.
+
+        Returns:
+            dict: The keyframe positions ("keyframes"), the duration ("duration"), the thumbnail positions ("thumbnails") and the strip path ("strip").
+        """
+        object_path = os.path.realpath(object_path)
+        index_path = self.sidecar_path(object_path, "index.json")
+        if os.path.exists(index_path):
+            with open(index_path) as f:
+                return json.load(f)
+        with self.lock:
+            future = self.futures.get(object_path)
+        if future is not None and future.done() and future.exception() is not None:
+            print(f"Warning: Indexing {object_path} failed: {future.exception()}")
+        return None
+
+    def index(self, object_path):
+        index_path = self.sidecar_path(object_path, "index.json")
+        if os.path.exists(index_path):
+            with open(index_path) as f:
+                return json.load(f)
+
+        index = keyframe_index(object_path)
+        strip_path = self.sidecar_path(object_path, "thumbs.jpg")
+        index["thumbnails"] = thumbnail_strip(object_path, select_keyframes(index["keyframes"], self.thumbnail_count), strip_path, self.thumbnail_height)
+        index["strip"] = strip_path if index["thumbnails"] else None
+
+        temp_path = f"{index_path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(index, f)
+        os.replace(temp_path, index_path)
+        print(f"INFO: Indexed {object_path} --> {len(index['keyframes'])} keyframes, {len(index['thumbnails'])} thumbnails")
+        return index
+
+
+@shared_instance
+def get_indexer():
+    """
+    Returns the Indexer shared by all the sessions of the process.
+    """
+    return Indexer()
@@ -0,0 +1,202 @@
+##################################################################################################################
+# Author: Vishal Kumar
+# Email: vishalkmr01123@gmail.com
+#
+# This file contains the MediaServer class which is used to deliver the output files to the browser.
+# The files are served with HTTP range support, the bytes are streamed from the disk in small chunks, so the memory
+# used per viewer stays constant regardless of the size of the output. The browser video player seeks with range
+# requests and downloads are served by the same route.
+# A file is only reachable through the unguessable token issued for it by url(), shown to the session owning the
+# output, the names of the output directory are never mapped: /<token>/<file name>. The token of an HLS playlist
+# also serves the segments of the playlist, which the player requests relative to it.
+#
+# The server listens on MEDIA_SERVER_HOST:MEDIA_SERVER_PORT (default 127.0.0.1:8502) and the links shown in the app
+# are built from MEDIA_SERVER_URL (default http://localhost:<port>), set it when the app is served behind a proxy.
+##################################################################################################################
+
+import os, re, threading, mimetypes, time, secrets
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs, unquote, quote
+from shared import shared_instance
+
+# Size of the chunks streamed to the client
+CHUNK_SIZE = 64 * 1024
+
+RANGE_PATTERN = re.compile(r"bytes=(\d*)-(\d*)$")
+
+# Characters kept in the plain filename of the Content-Disposition header
+UNSAFE_FILENAME = re.compile(r"[^A-Za-z0-9._-]")
+
+
+class MediaRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_HEAD(self):
+        self.send_file(head_only=True)
+
+    def do_GET(self):
+        self.send_file()
+
+    def translate_path(self, url_path):
+        """
+        Maps the url path /<token>/<file name> to the file issued for the token, None if the token is unknown.
+        """
+        token, _, name = url_path.lstrip("/").partition("/")
+        path = self.server.media_server.token_path(token)
+        if path is None:
+            return None
+        name = unquote(name)
+        if name != os.path.basename(path):
+            # The segments of a playlist are named <playlist name>_<index>.ts next to it
+            stem = os.path.splitext(os.path.basename(path))[0]
+            if not (path.endswith(".m3u8") and name.startswith(f"{stem}_") and "/" not in name and "\\" not in name):
+                return None
+            path = os.path.join(os.path.dirname(path), name)
+        return path if os.path.isfile(path) else None
+
+    def send_file(self, head_only=False):
+        url = urlsplit(self.path)
+        path = self.translate_path(url.path)
+        if path is None:
+            self.send_error(404, "File not found")
+            return
+
+        with open(path, "rb") as f:
+            # The size is taken when the request arrives, files which are still being written are served up to that point
+            size = os.fstat(f.fileno()).st_size
+            start, end = 0, size - 1
+            status = 200
+
+            range_header = self.headers.get("Range")
+            # An empty file has no satisfiable range, it is sent whole i.e. empty
+            if range_header and size > 0:
+                match = RANGE_PATTERN.match(range_header.strip())
+                if match is None or match.group(1) == match.group(2) == "":
+                    self.send_range_error(size)
+                    return
+                if match.group(1) == "":
+                    # Suffix range i.e. the last N bytes
+                    start = max(0, size - int(match.group(2)))
+                else:
+                    start = int(match.group(1))
+                    if match.group(2) != "":
+                        end = min(int(match.group(2)), size - 1)
+                if start > end:
+                    self.send_range_error(size)
+                    return
+                status = 206
+
+            self.send_response(status)
+            self.send_header("Content-Type", mimetypes.guess_type(path)[0] or "application/octet-stream")
+            self.send_header("Content-Length", str(end - start + 1))
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("Cache-Control", "no-cache")
+            if status == 206:
+                self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+            download = parse_qs(url.query).get("download")
+            if download:
+                self.send_header("Content-Disposition", content_disposition(download[0]))
+            self.end_headers()
+
+            if head_only:
+                return
+
+            f.seek(start)
+            remaining = end - start + 1
+            try:
+                while remaining > 0:
+                    chunk = f.read(min(CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    self.wfile.write(chunk)
+                    remaining -= len(chunk)
+            except (BrokenPipeError, ConnectionResetError):
+                # The player closes the connection as soon as it has buffered enough
+                pass
+
+    def send_range_error(self, size):
+        self.send_response(416)
+        self.send_header("Content-Range", f"bytes */{size}")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def content_disposition(name):
+    """
+    Returns the Content-Disposition header value of a download, the name can't inject a header or break the quotes.
+    """
+    fallback = UNSAFE_FILENAME.sub("_", name) or "download"
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(name, safe='')}"
+
+
+class MediaServer:
+    def __init__(self, directory="output", host="127.0.0.1", port=8502, public_url=None):
+        """
+        Initializes the MediaServer and starts serving the directory in a background thread.
+
+        Args:
+            directory (str, optional): The directory whose files are served. Defaults to "output".
+            host (str, optional): The address the server binds to. Defaults to "127.0.0.1".
+            port (int, optional): The port the server listens on. Defaults to 8502.
+            public_url (str, optional): The base url of the server as seen by the browser. Defaults to http://localhost:<port>.
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.public_url = (public_url or f"http://localhost:{port}").rstrip("/")
+        self.httpd = ThreadingHTTPServer((host, port), MediaRequestHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.media_server = self
+        # token --> path of the issued files, and path --> (modification time, token) to reuse the token of a path
+        self.tokens = {}
+        self.path_tokens = {}
+        self.lock = threading.Lock()
+        self.server_thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.server_thread.start()
+        print(f"INFO: Media server is serving {directory} at {self.public_url}")
+
+    def url(self, file_path, download=None):
+        """
+        Returns the url of a file, the file is reachable only through the token of this url.
+
+        Args:
+            file_path (str): The path of the file, it must be inside the served directory.
+            download (str, optional): If given, the url makes the browser download the file with this name.
+
+        Returns:
+            str: The url of the file.
+        """
+        path = os.path.abspath(file_path)
+        root = os.path.abspath(self.directory)
+        if os.path.commonpath([root, path]) != root:
+            raise ValueError(f"{file_path} is not inside {self.directory}")
+        mtime = os.path.getmtime(path)
+        with self.lock:
+            # A rewritten output gets a new token, the browser doesn't reuse the previous output which had the same name
+            issued = self.path_tokens.get(path)
+            if issued is None or issued[0] != mtime:
+                if issued is not None:
+                    self.tokens.pop(issued[1], None)
+                issued = (mtime, secrets.token_urlsafe(24))
+                self.path_tokens[path] = issued
+                self.tokens[issued[1]] = path
+            token = issued[1]
+        url = f"{self.public_url}/{token}/{quote(os.path.basename(path))}"
+        if download:
+            url += f"?download={quote(download)}"
+        return url
+
+    def token_path(self, token):
+        with self.lock:
+            return self.tokens.get(token)
+
+
+@shared_instance
+def get_media_server():
+    """
+    Returns the MediaServer shared by all the sessions of the process.
+    """
+    port = int(os.environ.get("MEDIA_SERVER_PORT", 8502))
+    return MediaServer(host=os.environ.get("MEDIA_SERVER_HOST", "127.0.0.1"), port=port, public_url=os.environ.get("MEDIA_SERVER_URL"))
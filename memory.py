@@ -0,0 +1,235 @@
+##################################################################################################################
+# Author: Vishal Kumar
+# Email: vishalkmr01123@gmail.com
+#
+# This file contains the memory accounting of the frames in flight.
+# Every pipeline owns a MemoryAccount which tracks the RGB frames held by the buffer_queue, the frame still
+# referenced by the UI and the scratch buffers of the converter. The account enforces the byte budget of the
+# session: once the budget (or the memory limit of the process) is reached the appsink drops the new frames
+# instead of converting and queueing them, so a slow browser can't make the process run out of memory.
+# The MemoryMonitor singleton reports the accounts of all the sessions together with the levels of the Gstreamer
+# queues and the RSS of the process, and optionally diffs tracemalloc snapshots to hunt leaks.
+#
+# Environment:
+#     SESSION_MEMORY_BUDGET_MB : byte budget of the frames in flight of a session (default 512, 0 disables it)
+#     PROCESS_MEMORY_LIMIT_MB  : RSS above which every session drops its frames (default 0, disabled)
+#     MEMORY_TRACE             : 1 enables the tracemalloc snapshot diff between the start and the end of a run
+##################################################################################################################
+
+import os, time, resource, threading, tracemalloc
+from shared import shared_instance
+
+MB = 1024 * 1024
+
+
+def process_rss():
+    """
+    Returns the current resident set size of the process in bytes, the peak RSS where /proc is not available.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # ru_maxrss is in KB on Linux and in bytes on macOS
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if os.uname().sysname == "Darwin" else 1024)
+
+
+def queue_levels(pipeline):
+    """
+    Returns the current levels of the queue elements of a Gstreamer pipeline.
+
+    Args:
+        pipeline (Gst.Pipeline): The pipeline to inspect.
+
+    Returns:
+        dict: The buffers, bytes and time (seconds) held by every queue, keyed by the name of the queue.
+    """
+    levels = {}
+    if pipeline is None:
+        return levels
+    for element in pipeline.iterate_elements():
+        factory = element.get_factory()
+        if factory is not None and factory.get_name() == "queue":
+            levels[element.get_name()] = {
+                "buffers": element.get_property("current-level-buffers"),
+                "bytes": element.get_property("current-level-bytes"),
+                "seconds": element.get_property("current-level-time") / 1e9,
+            }
+    return levels
+
+
+class MemoryAccount:
+    """
+    Bytes of the frames in flight of one pipeline and its byte budget.
+    """
+    def __init__(self, budget=0):
+        """
+        Args:
+            budget (int, optional): The maximal bytes of queued and displayed frames, 0 for no budget. Defaults to 0.
+        """
+        self.budget = budget
+        self.lock = threading.Lock()
+        self.queued_frames = 0
+        self.queued_bytes = 0
+        self.ui_bytes = 0
+        self.scratch_bytes = 0
+        self.dropped_frames = 0
+        self.dropped_bytes = 0
+
+    def reserve(self, nbytes, force=False):
+        """
+        Accounts a frame about to be queued.
+
+        Args:
+            nbytes (int): The bytes of the frame.
+            force (bool, optional): Accounts the frame even over the budget, the queue is bounded otherwise (lossless frames). Defaults to False.
+
+        Returns:
+            bool: False if the frame has to be dropped because the session budget or the process limit is reached.
+        """
+        with self.lock:
+            over_budget = self.budget and self.queued_bytes + self.ui_bytes + self.scratch_bytes + nbytes > self.budget
+            if not force and (over_budget or get_memory_monitor().over_limit()):
+                self.dropped_frames += 1
+                self.dropped_bytes += nbytes
+                return False
+            self.queued_frames += 1
+            self.queued_bytes += nbytes
+            return True
+
+    def cancel(self, nbytes):
+        """
+        Gives back a reservation whose frame could not be queued, it counts as dropped.
+        """
+        with self.lock:
+            self.queued_frames -= 1
+            self.queued_bytes -= nbytes
+            self.dropped_frames += 1
+            self.dropped_bytes += nbytes
+
+    def release(self, nbytes):
+        """
+        Accounts a frame taken out of the queue by the UI, it replaces the frame displayed before.
+        """
+        with self.lock:
+            self.queued_frames -= 1
+            self.queued_bytes -= nbytes
+            self.ui_bytes = nbytes
+
+    def set_scratch(self, nbytes):
+        """
+        Records the bytes of the scratch buffers used to convert the last frame.
+        """
+        self.scratch_bytes = nbytes
+
+    def report(self):
+        with self.lock:
+            return {
+                "budget": self.budget,
+                "queued_frames": self.queued_frames,
+                "queued_bytes": self.queued_bytes,
+                "ui_bytes": self.ui_bytes,
+                "scratch_bytes": self.scratch_bytes,
+                "dropped_frames": self.dropped_frames,
+                "dropped_bytes": self.dropped_bytes,
+            }
+
+
+class MemoryMonitor:
+    """
+    Registry of the memory accounts of all the sessions of the process.
+    """
+    def __init__(self, process_limit=0, trace=False):
+        """
+        Args:
+            process_limit (int, optional): The RSS in bytes above which the frames are dropped, 0 for no limit. Defaults to 0.
+            trace (bool, optional): Enables the tracemalloc snapshot diff. Defaults to False.
+        """
+        self.process_limit = process_limit
+        self.trace = trace
+        self.lock = threading.Lock()
+        self.accounts = {}
+        self.rss = 0
+        self.rss_time = 0
+        self.trace_snapshot = None
+        if trace:
+            tracemalloc.start(10)
+
+    def register(self, key, account, pipeline=None, label=None):
+        """
+        Registers the account (and the Gstreamer pipeline) of a session, it replaces the previous one of the same key.
+
+        Args:
+            key (hashable): The unique key of the owner of the account e.g. id() of the GStreamerPipeline.
+            account (MemoryAccount): The account of the frames in flight.
+            pipeline (Gst.Pipeline, optional): The pipeline whose queue levels are reported. Defaults to None.
+            label (str, optional): The name shown in the report e.g. the output name. Defaults to the key.
+        """
+        with self.lock:
+            self.accounts[key] = (account, pipeline, label if label is not None else str(key))
+
+    def unregister(self, key, account=None):
+        """
+        Removes the account of a session, only if it is still the given account when one is given.
+        """
+        with self.lock:
+            if account is None or self.accounts.get(key, (None,))[0] is account:
+                self.accounts.pop(key, None)
+
+    def over_limit(self):
+        # /proc is read at most every 200ms, this is called for every frame
+        if not self.process_limit:
+            return False
+        now = time.time()
+        if now - self.rss_time > 0.2:
+            self.rss, self.rss_time = process_rss(), now
+        return self.rss > self.process_limit
+
+    def report(self):
+        """
+        Returns the memory held by every session and by the process.
+
+        Returns:
+            dict: The process RSS and, by key, the label of every session, its account and the levels of its Gstreamer queues.
+        """
+        with self.lock:
+            accounts = dict(self.accounts)
+        sessions = {}
+        for key, (account, pipeline, label) in accounts.items():
+            sessions[str(key)] = account.report()
+            sessions[str(key)]["label"] = label
+            sessions[str(key)]["gst_queues"] = queue_levels(pipeline)
+        return {"rss": process_rss(), "process_limit": self.process_limit, "sessions": sessions}
+
+    def trace_start(self):
+        """
+        Takes the reference tracemalloc snapshot, it does nothing unless the tracing is enabled.
+        """
+        if self.trace:
+            self.trace_snapshot = tracemalloc.take_snapshot()
+
+    def trace_diff(self, limit=10):
+        """
+        Compares the current allocations with the reference snapshot.
+
+        Args:
+            limit (int, optional): The number of the biggest differences returned. Defaults to 10.
+
+        Returns:
+            list: The biggest allocation differences grouped by line, empty unless the tracing is enabled.
+        """
+        if not self.trace or self.trace_snapshot is None:
+            return []
+        snapshot = tracemalloc.take_snapshot()
+        return [str(stat) for stat in snapshot.compare_to(self.trace_snapshot, "lineno")[:limit]]
+
+
+@shared_instance
+def get_memory_monitor():
+    """
+    Returns the memory monitor of the process, it is created on the first call from the environment variables.
+    """
+    return MemoryMonitor(
+        process_limit=int(os.environ.get("PROCESS_MEMORY_LIMIT_MB", 0)) * MB,
+        trace=os.environ.get("MEMORY_TRACE", "0") == "1",
+    )
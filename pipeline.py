@@ -10,12 +10,12 @@
 # Users can override the following methods to customize the pipeline:
 # - default_params: This method should be overridden to specify the default parameters of elements.
 # - create_pipeline: This method should be overridden to create a specific pipeline. Use the self.elements 
-#   attribute to add new elements to the pipeline.
+#   attribute to add new elements to the pipeline and self.config (PipelineConfig) to read its parameters.
 #
 # Example of creating a pipeline: [videotestsrc -> videoconvert -> autovideosink]
-# def create_pipeline(self):
-#     super().create_pipeline()
-#     src = self.elements.videotestsrc()
+# def create_pipeline(self, config=None):
+#     super().create_pipeline(config)
+#     src = self.elements.videotestsrc(self.config.pattern)
 #     vidconv = self.elements.videoconvert(src)
 #     autovideosink = self.elements.autovideosink(vidconv)
 ##################################################################################################################
@@ -25,15 +25,40 @@ gi.require_version('Gst', '1.0')
 from gi.repository import Gst, GLib
 import threading, os, glob, time
 from elements import GstreamerElements
-import streamlit as st
+from storage import get_upload_store
+from config import PipelineConfig
+from still import get_still_processor
+from sequence import link_sequence
+from indexer import get_indexer
+from frame_cache import get_frame_cache
+from result_cache import get_result_cache
+from controls import PropertyController
+from processing import FrameProcessor, load_processor
+from memory import MemoryAccount, MB, get_memory_monitor, queue_levels, process_rss
 from utils import *
-import queue, time
-from streamlit.runtime.scriptrunner import add_script_run_ctx
+import queue, time, hashlib, shutil, tempfile
+try:
+    import streamlit as st
+    from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+except ImportError:
+    # The headless pipelines (FilePipeline) don't need streamlit
+    st = None
+
+# Uploads up to this size can be kept in memory and fed to the pipeline through appsrc
+MEMORY_INPUT_LIMIT = 64 * 1024 * 1024
+# Format of the decoded frames kept in the frame cache, the format of the appsink
+FRAME_CACHE_FORMAT = "I420"
+# Bus messages handed to the message_handler of the pipelines without main loop, the others are dropped
+BRIDGED_MESSAGES = Gst.MessageType.EOS | Gst.MessageType.ERROR | Gst.MessageType.WARNING | Gst.MessageType.ELEMENT | Gst.MessageType.ASYNC_DONE
 
 class GStreamerPipeline:
-    def __init__(self):
-        # creating the pipeline
+    def __init__(self, config=None, main_loop=True):
+        # creating the pipeline, without main loop the bus messages are handed to self.message_handler (see aio.AsyncPipeline)
+        self.main_loop = main_loop
+        self.message_handler = None
+        self.config = config if config is not None else PipelineConfig()
         self.default_params()
+        # Called without argument, the create_pipeline(self) overrides of the older apps read self.config
         self.create_pipeline()
 
     def default_params(self):
@@ -43,60 +68,525 @@ class GStreamerPipeline:
         self.default_input_params()
         self.default_output_params()
 
-    def create_pipeline(self):
+    def create_pipeline(self, config=None):
         """
         This method should be overridden by subclasses to create the specific pipeline.
-        Use self.element to add the new element in the pipeline
-        super().create_pipeline() needs to be called in overridden code to initialize the pipeline
+        Use self.element to add the new element in the pipeline and self.config to read the parameters
+        super().create_pipeline(config) needs to be called in overridden code to initialize the pipeline
+
+        Args:
+            config (PipelineConfig, optional): The configuration of the pipeline. Defaults to the current self.config.
         """
+        if config is not None:
+            self.config = config
+        self.remove_sequence_links()
+
         # Initialize GStreamer
         Gst.init(None)
 
         # Define the GStreamer pipeline
         self.pipeline = Gst.Pipeline()
         self.loop = GLib.MainLoop()
-        self.main_loop_thread = threading.Thread(target=self.loop.run)
-        add_script_run_ctx(self.main_loop_thread)
-        self.main_loop_thread.start()
+        if getattr(self, "main_loop", True):
+            self.main_loop_thread = threading.Thread(target=self.loop.run)
+            # The bus callbacks may use the streamlit session only when the pipeline is created from a script run
+            if st is not None and get_script_run_ctx() is not None:
+                add_script_run_ctx(self.main_loop_thread)
+            self.main_loop_thread.start()
+
+        # Account of the frames in flight, registered per pipeline object (two pipelines may share an output name), labelled by the output name
+        self.memory = MemoryAccount(self.config.memory_budget_mb * MB)
+        get_memory_monitor().register(id(self), self.memory, self.pipeline, label=self.config.output_file)
 
         # Class containing elements of gstreamer
-        self.elements = GstreamerElements(self.pipeline)
+        self.elements = GstreamerElements(self.pipeline, memory=self.memory, frame_mode=self.config.frame_mode,
+                                          batch_size=self.config.batch_size, batch_ms=self.config.batch_ms)
+        # Live updates of the element properties, applied at a frame boundary
+        self.controls = PropertyController(self.pipeline)
+        # Output branches by name and the tee each branch is attached to, see add_branch
+        self.branches = {}
+        self.branch_tees = {}
+        # Number of times each branch was added, a branch added again is built with new element names and outputs
+        self.branch_instances = {}
+        self.branch_lock = threading.Lock()
+        # Set when the running pipeline was changed (properties, branches), its output doesn't match self.config then
+        self.live_updated = False
 
         # Frame Counter
         self.out_frame_num = 1
         self.start_time = None
+        # Last frame fetched by the UI, it stays displayed while the pipeline is paused
+        self.last_frame = None
 
-        # EOS flag
+        # Pause state, paused_duration is the total time spent paused
+        self.paused = False
+        self.pause_time = None
+        self.paused_duration = 0.0
+
+        # EOS flag, stopped is set when the EOS is sent by stop() rather than reached at the end of the input
         self.eos_occurred = False
+        self.stopped = False
+        # Recorder of the decoded frames, set when the frame cache is enabled and the input is decoded
+        self.frame_recorder = None
+        # True when the frames are replayed from the frame cache, the time range is already applied
+        self.replaying = False
+        # Stage running config.frame_processor on the frames, see add_frame_processor
+        self.processor = None
+        # Set once the pipeline has finished i.e. on EOS or error
+        self.finished = threading.Event()
+        self.error = None
 
         # Add a signal watch to the bus
         self.bus = self.pipeline.get_bus()
-        self.bus.add_signal_watch()
-        self.bus.connect("message", self.bus_message, self.pipeline, self.loop)
+        if getattr(self, "main_loop", True):
+            self.bus.add_signal_watch()
+            self.bus.connect("message", self.bus_message, self.pipeline, self.loop)
+        else:
+            self.bus.set_sync_handler(self.bus_sync_handler)
 
 
-    def start(self):
+    def start(self, start_time=None, end_time=None):
         """
         This method is used to change the pipeline state to PLAYING
+        If a time range is given the pipeline is prerolled and seeked, so only the requested portion of the input is processed.
+
+        Args:
+            start_time (float, optional): The position in seconds from where the input is processed. Defaults to self.config.start_time.
+            end_time (float, optional): The position in seconds at which the input stops. Defaults to self.config.end_time.
         """
-        # Set the pipeline to playing state
-        self.pipeline.set_state(Gst.State.PLAYING)
+        if start_time is None and end_time is None:
+            start_time, end_time = self.config.start_time, self.config.end_time
+
+        if (start_time is not None or end_time is not None) and not self.replaying:
+            # The demuxer accepts the seek only once it has prerolled
+            self.pipeline.set_state(Gst.State.PAUSED)
+            self.pipeline.get_state(10 * Gst.SECOND)
+            # The live appsrc of the frame processor doesn't preroll, the input is prerolled once its appsink is
+            if self.processor is not None:
+                self.processor.prerolled.wait(10)
+            if not self.seek(start_time, end_time):
+                print(f"Warning: Seek to [{start_time}, {end_time}] failed, processing the whole input")
+
+        self.play()
+
+    def play(self):
+        """
+        This method sets the pipeline to playing state, the seek to the time range (if any) has to be done before
+        Returns the Gst.StateChangeReturn of the state change
+        """
+        get_memory_monitor().trace_start()
+        result = self.pipeline.set_state(Gst.State.PLAYING)
         self.start_time = time.time()
+        return result
+
+    def seek(self, start_time=None, end_time=None):
+        """
+        This method seeks the pipeline to the keyframe before start_time and sets end_time as the stop position,
+        the demuxer sends EOS once end_time is reached.
+
+        Args:
+            start_time (float, optional): The position in seconds, processing starts at the nearest keyframe before it. Defaults to the beginning.
+            end_time (float, optional): The position in seconds at which the stream ends. Defaults to the end of the input.
+
+        Returns:
+            bool: True if the seek was handled.
+        """
+        flags = Gst.SeekFlags.FLUSH | Gst.SeekFlags.KEY_UNIT | Gst.SeekFlags.SNAP_BEFORE
+        start = int((start_time or 0) * Gst.SECOND)
+        if end_time is None:
+            stop_type, stop = Gst.SeekType.NONE, Gst.CLOCK_TIME_NONE
+        else:
+            stop_type, stop = Gst.SeekType.SET, int(end_time * Gst.SECOND)
+        print(f"INFO: Seek --> [{start_time}, {end_time}]")
+        return self.pipeline.seek(1.0, Gst.Format.TIME, flags, Gst.SeekType.SET, start, stop_type, stop)
+
+    def pause(self):
+        """
+        This method pauses the running pipeline, the graph stays prerolled so resume is a single state change.
+        The running time doesn't advance while the pipeline is paused (the base time is recomputed on resume), so the
+        timestamps of a non-live source and the clock timestamps of a live source continue without gap in the output.
+        No buffer flows while paused, the appsink and the preview loop are idle.
+
+        Returns:
+            bool: False if the pipeline is not running.
+        """
+        if self.paused or self.finished.is_set() or self.start_time is None:
+            return False
+        self.pipeline.set_state(Gst.State.PAUSED)
+        self.paused = True
+        self.pause_time = time.time()
+        print("INFO: Pipeline paused")
+        return True
+
+    def resume(self):
+        """
+        This method resumes the paused pipeline.
+
+        Returns:
+            bool: False if the pipeline is not paused.
+        """
+        if not self.paused:
+            return False
+        self.pipeline.set_state(Gst.State.PLAYING)
+        self.paused = False
+        self.paused_duration += time.time() - self.pause_time
+        print(f"INFO: Pipeline resumed after {round(time.time() - self.pause_time, 2)}s")
+        return True
 
     def stop(self):
         """
         This method is used to stop the pipeline e.i. send EOS
         """
+        if self.pipeline is None:
+            return
+        self.stopped = True
+        # The EOS is not held back by a lossless appsink waiting for its consumer
+        self.elements.flushing = True
+        # A paused pipeline doesn't handle the EOS until it plays again
+        self.resume()
         self.pipeline.send_event(Gst.Event.new_eos())
 
-    def fetch_buffer(self):
+    def update_properties(self, changes, on_applied=None):
+        """
+        This method changes properties of the elements of the running pipeline without rebuilding it,
+        the changes are applied together before the next frame e.g. {"textoverlay": {"text": "Live"}, "x264enc": {"bitrate": 4000}}
+
+        Args:
+            changes (dict): The new values of the properties by element name.
+            on_applied (callable, optional): Called without argument once the changes are applied. Defaults to None.
+
+        Returns:
+            bool: False if an element or a property doesn't exist.
+        """
+        if self.pipeline.get_state(0)[1] != Gst.State.NULL:
+            self.live_updated = True
+        return self.controls.update(changes, on_applied)
+
+    def build_branch(self, name, queue):
+        """
+        This method should be overridden by subclasses which register output branches in self.branch_tees,
+        to add the elements of an output branch after its queue. The base class has no output branch.
+
+        Args:
+            name (str): The name of the branch e.g. "appsink", "filesink" or "autovideosink".
+            queue (Gst.Element): The queue at the head of the branch.
+
+        Returns:
+            bool: False if there is no output branch of this name.
+        """
+        return False
+
+    def add_branch(self, name):
+        """
+        This method attaches an output branch [tee -> queue -> build_branch] to the tee registered for it in self.branch_tees.
+        While the pipeline is running the branch is linked at a buffer boundary (IDLE probe) without interrupting the other branches,
+        a branch attached to a tee of encoded frames starts at the next keyframe.
+
+        Args:
+            name (str): The name of the branch.
+
+        Returns:
+            bool: False if the branch is already attached, has no tee or can't be built.
+        """
+        tee = self.branch_tees.get(name)
+        if name in self.branches or tee is None:
+            print(f"Warning: Output branch {name} can't be added")
+            return False
+
+        before = set(self.pipeline.iterate_elements())
+        instance = self.branch_instances.get(name, 0) + 1
+        self.branch_instances[name] = instance
+        # The elements of the previous instance may still be in the pipeline until their EOS went through
+        self.elements.name_suffix = "" if instance == 1 else f"_{name}{instance}"
+        try:
+            queue = self.elements.queue(None)
+            built = self.build_branch(name, queue)
+        finally:
+            self.elements.name_suffix = ""
+        if built is False:
+            print(f"Warning: No output branch {name}")
+            self.pipeline.remove(queue)
+            self.branch_instances[name] = instance - 1
+            return False
+        elements = [element for element in self.pipeline.iterate_elements() if element not in before]
+        sinks = [element for element in self.pipeline.iterate_sinks() if element in elements]
+        branch = {"name": name, "instance": instance, "tee": tee, "queue": queue, "pad": None, "elements": elements, "sinks": sinks}
+        self.branches[name] = branch
+        # The names may now resolve to the elements of this instance
+        self.controls.invalidate()
+
+        if self.pipeline.get_state(0)[1] == Gst.State.NULL:
+            self.link_branch(branch)
+            return True
+
+        # The branch reaches the state of the pipeline before it gets its first buffer
+        for element in elements:
+            element.sync_state_with_parent()
+        caps = tee.get_static_pad("sink").get_current_caps()
+        if caps is not None and not caps.get_structure(0).get_name().startswith("video/x-raw"):
+            queue.get_static_pad("src").add_probe(Gst.PadProbeType.BUFFER, self.keyframe_gate_prob)
+        tee.get_static_pad("sink").add_probe(Gst.PadProbeType.IDLE, self.link_branch_prob, branch)
+        self.live_updated = True
+        print(f"INFO: Output branch {name} added")
+        return True
+
+    def link_branch(self, branch):
+        # Requests a src pad of the tee and links it to the queue of the branch
+        tee = branch["tee"]
+        pad = tee.request_pad_simple("src_%u") if hasattr(tee, "request_pad_simple") else tee.get_request_pad("src_%u")
+        pad.link(branch["queue"].get_static_pad("sink"))
+        branch["pad"] = pad
+
+    def link_branch_prob(self, pad, info, branch):
+        self.link_branch(branch)
+        return Gst.PadProbeReturn.REMOVE
+
+    def keyframe_gate_prob(self, pad, info):
+        # A late recording can't start with frames depending on the frames it didn't get
+        if info.get_buffer().has_flags(Gst.BufferFlags.DELTA_UNIT):
+            return Gst.PadProbeReturn.DROP
+        return Gst.PadProbeReturn.REMOVE
+
+    def remove_branch(self, name):
+        """
+        This method detaches an output branch, while the pipeline is running the branch is unlinked at a buffer boundary (IDLE probe)
+        and gets an EOS so a recording branch finalizes its file, the other branches are not interrupted.
+
+        Args:
+            name (str): The name of the branch.
+
+        Returns:
+            bool: False if the branch is not attached.
+        """
+        branch = self.branches.pop(name, None)
+        if branch is None:
+            return False
+        self.controls.invalidate()
+        if self.pipeline.get_state(0)[1] == Gst.State.NULL or branch["pad"] is None:
+            if branch["pad"] is not None:
+                branch["tee"].release_request_pad(branch["pad"])
+            self.drop_branch(branch)
+            return True
+        branch["pad"].add_probe(Gst.PadProbeType.IDLE, self.unlink_branch_prob, branch)
+        self.live_updated = True
+        print(f"INFO: Output branch {name} removed")
+        return True
+
+    def unlink_branch_prob(self, pad, info, branch):
+        queue_pad = branch["queue"].get_static_pad("sink")
+        pad.unlink(queue_pad)
+        branch["tee"].release_request_pad(pad)
+        # The elements are removed once the EOS has gone through the branch
+        for sink in branch["sinks"]:
+            for sink_pad in sink.sinkpads:
+                sink_pad.add_probe(Gst.PadProbeType.EVENT_DOWNSTREAM, self.branch_eos_prob, branch)
+        if not branch["sinks"]:
+            self.schedule_drop_branch(branch)
+        queue_pad.send_event(Gst.Event.new_eos())
+        return Gst.PadProbeReturn.REMOVE
+
+    def branch_eos_prob(self, pad, info, branch):
+        if info.get_event().type != Gst.EventType.EOS:
+            return Gst.PadProbeReturn.OK
+        self.schedule_drop_branch(branch)
+        return Gst.PadProbeReturn.REMOVE
+
+    def schedule_drop_branch(self, branch):
+        # The state of the branch can't be changed from its own streaming thread, and the pipelines without main loop
+        # (FilePipeline, AsyncPipeline) don't dispatch GLib.idle_add, hence a thread. A branch with several sink pads
+        # schedules its removal more than once
+        with self.branch_lock:
+            if branch.get("dropping"):
+                return
+            branch["dropping"] = True
+        threading.Thread(target=self.drop_branch, args=(branch,), daemon=True).start()
+
+    def drop_branch(self, branch):
+        for element in branch["elements"]:
+            if element.get_parent() is not None:
+                element.set_state(Gst.State.NULL)
+                self.pipeline.remove(element)
+
+    def wait_eos(self, timeout=None):
+        """
+        This method blocks until the pipeline has finished i.e. EOS or an error occurred
+
+        Args:
+            timeout (float, optional): The maximal time to wait in seconds. Defaults to waiting forever.
+
+        Returns:
+            bool: True if the pipeline reached EOS, False on error or timeout.
+        """
+        self.finished.wait(timeout)
+        return self.eos_occurred
+
+    def fetch_buffer(self, block=True, timeout=1):
         """
         This method is used to fetch the intermediate pipeline buffers stored in buffer_queue
         This buffer_queue is updated in appsink prob hence used only when appsink is used
+        It returns the RGB image of the frame and raises queue.Empty if no buffer is available (after timeout seconds when block is True)
+        """
+        return self.fetch_frame(block, timeout).image
+
+    def fetch_frame(self, block=True, timeout=1):
         """
-        item = self.elements.buffer_queue.get(timeout=1)
-        self.out_frame_num  += 1
-        return item
+        This method is used to fetch the next frame (utils.Frame) of the appsink with its metadata,
+        or the next utils.FrameBatch when config.batch_size or config.batch_ms is set
+        It raises queue.Empty if no frame is available (after timeout seconds when block is True)
+        """
+        frame = self.elements.buffer_queue.get(block, timeout)
+        self.memory.release(frame.nbytes)
+        self.last_frame = frame.image
+        self.out_frame_num  += frame.count if isinstance(frame, FrameBatch) else 1
+        return frame
+
+    def frames(self, timeout=None):
+        """
+        This method yields the frames (utils.Frame) of the appsink until the pipeline has finished and the queued frames are consumed,
+        the batches (utils.FrameBatch) when config.batch_size or config.batch_ms is set
+        With config.frame_mode "lossless" every frame is yielded and the pipeline waits for a slow consumer,
+        with "latest" the frames not fetched in time are replaced by the newest one
+
+        Args:
+            timeout (float, optional): The maximal time in seconds to wait for a frame. Defaults to waiting until the end of the stream.
+        """
+        waited = 0
+        try:
+            while True:
+                try:
+                    frame = self.fetch_frame(timeout=0.1)
+                except queue.Empty:
+                    if self.finished.is_set() and self.elements.buffer_queue.empty():
+                        return
+                    waited += 0.1
+                    if timeout is not None and waited >= timeout:
+                        return
+                    continue
+                waited = 0
+                yield frame
+        finally:
+            # Nobody fetches the frames anymore, the lossless appsink must not block the pipeline
+            self.elements.flushing = True
+
+    def memory_report(self):
+        """
+        This method returns the memory held by the frames in flight of the pipeline, the levels of its queues and the RSS of the process
+        """
+        report = self.memory.report()
+        report["gst_queues"] = queue_levels(self.pipeline) if self.pipeline is not None else {}
+        report["rss"] = process_rss()
+        return report
+
+    def finish(self):
+        """
+        This method is called once the pipeline has finished i.e. on EOS or error
+        """
+        monitor = get_memory_monitor()
+        for line in monitor.trace_diff():
+            print(f"INFO: Memory --> {line}")
+        monitor.unregister(id(self), self.memory)
+        self.remove_sequence_links()
+        # Only the frames of a run that reached the end of the input (or of the time range) can be replayed
+        if self.frame_recorder is not None:
+            self.frame_recorder.close(self.eos_occurred and not self.stopped)
+            self.frame_recorder = None
+        if self.processor is not None:
+            self.processor.close()
+        self.finished.set()
+        # The output of a complete run is stored for the next runs of the same input and settings, the waiters don't wait for the copy
+        if self.eos_occurred and not self.stopped and self.error is None and not self.live_updated:
+            get_result_cache().store(self.config)
+
+    def finish_without_pipeline(self, config):
+        """
+        This method resets the state of the last run for a config processed without Gstreamer pipeline (result cache hit, still),
+        wait_eos returns at once and nothing of the previous run (pipeline, queued frames, branches) stays visible
+        """
+        self.config = config
+        self.pipeline = None
+        self.elements = GstreamerElements(None, memory=self.memory, frame_mode=config.frame_mode)
+        self.branches, self.branch_tees, self.branch_instances = {}, {}, {}
+        self.out_frame_num = 1
+        self.start_time = None
+        self.last_frame = None
+        self.paused = False
+        self.stopped = False
+        self.live_updated = False
+        self.frame_recorder = None
+        self.processor = None
+        self.error = None
+        self.eos_occurred = True
+        self.finished = threading.Event()
+        self.finished.set()
+
+    def read_file_input(self, config):
+        """
+        This method adds the elements reading the file input of the config, an image sequence is read as one stream
+        Returns the element producing the raw frames
+        """
+        if config.sequence_input:
+            self.sequence_dir = tempfile.mkdtemp(prefix="sequence_")
+            location, file_ext, frames = link_sequence(config.input_file, self.sequence_dir)
+            print(f"INFO: Image sequence {config.input_file} --> {frames} frames at {config.framerate}fps")
+            return self.elements.read_sequence(location, file_ext, framerate=config.framerate)
+        return self.elements.read_input(input_file=config.input_file, input_data=config.input_data, width=config.input_width, height=config.input_height)
+
+    def cached_file_input(self, config):
+        """
+        This method adds the elements producing the decoded frames of the file input of the config.
+        With the frame cache enabled the frames of an earlier complete run of the same input are replayed through appsrc,
+        otherwise the input is decoded and its frames are recorded for the next runs:
+        [read_file_input -> videoconvert -> capsfilter (I420)]  or  [framesrc (I420)]
+        """
+        if not config.frame_cache or config.input_hash is None or config.sequence_input:
+            return self.read_file_input(config)
+
+        cache = get_frame_cache()
+        clip = cache.lookup(config, FRAME_CACHE_FORMAT)
+        if clip is not None:
+            caps, frames = clip
+            print(f"INFO: Frame cache --> replaying {len(frames)} frames of {config.input_file}")
+            self.replaying = True
+            return self.elements.framesrc(caps, cache.frame_source(config.input_hash, caps, frames))
+
+        src = self.elements.capsfilter(self.elements.videoconvert(self.read_file_input(config)), format=FRAME_CACHE_FORMAT)
+        self.frame_recorder = cache.recorder(config, FRAME_CACHE_FORMAT)
+        src.get_static_pad("src").add_probe(Gst.PadProbeType.BUFFER | Gst.PadProbeType.EVENT_FLUSH, self.frame_cache_prob)
+        return src
+
+    def add_frame_processor(self, element):
+        """
+        This method adds the stage running config.frame_processor on the frames of element:
+        [element -> capsfilter (RGB) -> appsink] -> workers -> [appsrc -> videoconvert]
+        Returns the videoconvert producing the processed frames
+        """
+        config = self.config
+        self.processor = FrameProcessor(self.elements, load_processor(config.frame_processor), workers=config.processor_workers, max_inflight=config.processor_inflight)
+        return self.elements.videoconvert(self.processor.link(element))
+
+    def frame_cache_prob(self, pad, info):
+        # The frames prerolled before the seek to the time range are flushed, they are not part of the clip
+        if info.type & Gst.PadProbeType.EVENT_FLUSH:
+            if info.get_event().type == Gst.EventType.FLUSH_STOP:
+                self.frame_recorder.reset()
+            return Gst.PadProbeReturn.OK
+        buffer = info.get_buffer()
+        caps = pad.get_current_caps()
+        if caps is not None and buffer.pts != Gst.CLOCK_TIME_NONE:
+            self.frame_recorder.add(caps.to_string(), buffer.pts, buffer.duration, buffer.extract_dup(0, buffer.get_size()))
+        return Gst.PadProbeReturn.OK
+
+    def remove_sequence_links(self):
+        # The links of the image sequence are needed until the pipeline has finished
+        if getattr(self, "sequence_dir", None):
+            shutil.rmtree(self.sequence_dir, ignore_errors=True)
+            self.sequence_dir = None
+
+    def bus_sync_handler(self, bus, message):
+        # Called from the thread posting the message when there is no main loop, the handler dispatches it to bus_message
+        if self.message_handler is not None and message.type & BRIDGED_MESSAGES:
+            self.message_handler(message)
+        return Gst.BusSyncReply.DROP
 
     def bus_message(self, bus, message, pipeline, loop):
         """
@@ -104,16 +594,22 @@ class GStreamerPipeline:
         """
         bus_msg_enable= False
         if message.type == Gst.MessageType.EOS:
+            # A lossless appsink waiting for its consumer would block the state change
+            self.elements.flushing = True
             pipeline.set_state(Gst.State.NULL)
             loop.quit()
             self.eos_occurred =True 
+            self.finish()
             if bus_msg_enable:
                 print("Info: End of Stream!")
 
         elif message.type == Gst.MessageType.ERROR:
             err, debug = message.parse_error()
+            self.elements.flushing = True
             pipeline.set_state(Gst.State.NULL)
             loop.quit()
+            self.error = err
+            self.finish()
             if bus_msg_enable:
                 print("Error: %s" % err, debug)
 
@@ -127,6 +623,12 @@ class GStreamerPipeline:
             # if bus_msg_enable:
             #     print("Tag: %s" % tag_list.to_string())
 
+        elif message.type == Gst.MessageType.ELEMENT:
+            # hlssink2 announces every segment it has completed
+            structure = message.get_structure()
+            if structure is not None and structure.get_name() in ("hls-segment-added", "splitmuxsink-fragment-closed"):
+                self.elements.mark_first_output()
+
         elif message.type == Gst.MessageType.WARNING:
             err, debug = message.parse_warning()
             if bus_msg_enable:
@@ -139,39 +641,66 @@ class GStreamerPipeline:
         st.session_state.file_uploaded = False
         st.session_state.update_params_from_input_file = True
         st.session_state.input_name = None
+        st.session_state.input_hash = None
+        st.session_state.input_path = None
+        st.session_state.input_data = None
+        st.session_state.in_memory_input = False
+        st.session_state.frame_cache = False
         st.session_state.input_type = None
         st.session_state.input_ext = "mp4"
         st.session_state.out_ext = "mp4"
         st.session_state.image_input = False
         st.session_state.input_height, st.session_state.input_width = 1920 ,1080
         st.session_state.max_frame = 10000
+        st.session_state.input_duration = None
+        st.session_state.trim_enabled = False
+        st.session_state.trim_range = (0.0, 0.0)
 
     def input_file_control(self):
-        # Check the input directory exists if not create one
-        if not os.path.exists("input"):
-            os.makedirs("input")
-
         # Upload the input and save it
-        input_file = st.file_uploader("Input Image/Video📷", type=["mp4","h264","jpg","png"],key="file_uploader",label_visibility="visible",on_change=self.update_input_file,accept_multiple_files=False,disabled=(st.session_state.status == "play"))
+        input_file = st.file_uploader("Input Image/Video📷", type=["mp4","h264","jpg","png"],key="file_uploader",label_visibility="visible",on_change=self.update_input_file,accept_multiple_files=False,disabled=(st.session_state.status != "stop"))
+        st.checkbox("Keep upload in memory",key="in_memory_input_val",value=st.session_state.in_memory_input,help=f"feed uploads up to {MEMORY_INPUT_LIMIT // (1024 * 1024)}MB to the pipeline without writing them to disk",on_change=self.update_in_memory_input,disabled=(st.session_state.status != "stop"))
+        st.checkbox("Cache decoded frames",key="frame_cache_val",value=st.session_state.frame_cache,help="the next runs of the same video (and time range) replay the decoded frames instead of decoding the input again",on_change=self.update_frame_cache,disabled=(st.session_state.status != "stop"))
         if input_file is not None and st.session_state.update_params_from_input_file:
-            # Save the input file
-            with open("input/"+input_file.name, "wb") as f:
-                f.write(input_file.getbuffer())
-                print(f"INFO: File {input_file.name} is Uploaded and Saved.")
-
             #add the input details to session
             st.session_state.input_name = input_file.name
             st.session_state.input_type = input_file.type
-            st.session_state.input_ext = input_file.name.split(".")[1].lower()
+            st.session_state.input_ext = input_file.name.split(".")[-1].lower()
+            st.session_state.input_duration = None
+            st.session_state.trim_enabled = False
             if st.session_state.input_ext == "jpg" or st.session_state.input_ext == "png":
                 st.session_state.image_input = True
                 st.session_state.out_ext = "jpg"
             else:
                 st.session_state.image_input = False
                 st.session_state.out_ext = "mp4"
-    
-            file_path = "input/"+st.session_state.input_name 
-            vid = cv2.VideoCapture(file_path)
+
+            # The new upload replaces the previous input of the session, its alias no longer holds the stored object
+            get_upload_store().release_session(st.session_state.username)
+
+            if st.session_state.in_memory_input and input_file.size <= MEMORY_INPUT_LIMIT:
+                # Keep the uploaded buffer, the pipeline reads it through appsrc and nothing is written to disk
+                st.session_state.input_data = input_file.getbuffer()
+                st.session_state.input_hash = hashlib.sha256(st.session_state.input_data).hexdigest()
+                st.session_state.input_path = None
+                print(f"INFO: File {input_file.name} is Uploaded and kept in memory.")
+                self.probe_input_data()
+                return
+
+            # Stream the input into the content addressed store, the session gets its own alias of the stored file
+            st.session_state.input_data = None
+            st.session_state.input_hash, st.session_state.input_path = get_upload_store().store(input_file, input_file.name, st.session_state.username)
+            print(f"INFO: File {input_file.name} is Uploaded and Saved.")
+
+            if st.session_state.image_input:
+                # Decoding the still gives its size and warms the cache of the still path
+                image = get_still_processor().decode(st.session_state.input_path, st.session_state.input_hash)
+                st.session_state.input_height, st.session_state.input_width = image.shape[:2]
+                st.session_state.max_frame = 1
+                st.session_state.update_params_from_input_file = False
+                return
+
+            vid = cv2.VideoCapture(st.session_state.input_path)
 
             # print(vid.get(cv2.CAP_PROP_FOURCC))
             # print(vid.get(cv2.CV_FOURCC('H', '2', '6', '4')))
@@ -185,6 +714,12 @@ class GStreamerPipeline:
             else:
                 st.session_state.max_frame = int(vid.get(cv2.CAP_PROP_FRAME_COUNT))
                 # st.session_state.max_frame = 50
+                fps = vid.get(cv2.CAP_PROP_FPS)
+                if fps > 0 and st.session_state.max_frame > 0:
+                    st.session_state.input_duration = st.session_state.max_frame / fps
+                    st.session_state.trim_range = (0.0, st.session_state.input_duration)
+                # Keyframes and thumbnails are indexed in the background
+                get_indexer().submit(st.session_state.input_path)
 
             st.session_state.input_width , st.session_state.input_height = int(vid.get(cv2.CAP_PROP_FRAME_WIDTH)),int(vid.get(cv2.CAP_PROP_FRAME_HEIGHT))
             st.session_state.update_params_from_input_file = False
@@ -194,6 +729,58 @@ class GStreamerPipeline:
             # st.session_state.dst_crop = "0:0:" + str(st.session_state.input_width) + ":" + str(st.session_state.input_height)
             # st.session_state.caps_width , st.session_state.caps_height = st.session_state.input_width , st.session_state.input_height
 
+    def time_range_controls(self):
+        # Seeking is supported for the MP4 inputs, the elementary h264 stream has no index
+        if st.session_state.input_ext != "mp4" or st.session_state.image_input or st.session_state.input_duration is None:
+            return
+        col1, col2 = st.columns([1, 3])
+        col1.checkbox("Time range",key="trim_enabled_val",value=st.session_state.trim_enabled,help="process only a portion of the input, it starts at the keyframe before the start time",on_change=self.update_trim_enabled,disabled=(st.session_state.status != "stop"))
+        st.session_state.trim_range_val = st.session_state.trim_range
+        col2.slider("Start/End (s)",min_value=0.0,max_value=round(st.session_state.input_duration, 2),step=0.1,key="trim_range_val",on_change=self.update_trim_range,disabled=(st.session_state.status != "stop" or not st.session_state.trim_enabled))
+        self.thumbnail_strip()
+
+    def thumbnail_strip(self):
+        # The strip and the seek targets show up once the background indexer is done, the uploads kept in memory are not indexed
+        if st.session_state.input_path is None:
+            return
+        index = get_indexer().result(st.session_state.input_path)
+        if index is None:
+            st.caption("Indexing keyframes...")
+            return
+        if index["strip"] and os.path.exists(index["strip"]):
+            st.image(index["strip"], use_column_width="always", caption=" | ".join(f"{t:.1f}s" for t in index["thumbnails"]))
+        if st.session_state.trim_enabled and index["keyframes"]:
+            start = max([k for k in index["keyframes"] if k <= st.session_state.trim_range[0]] or index["keyframes"][:1])
+            st.caption(f"{len(index['keyframes'])} keyframes, processing starts at the keyframe at {start:.2f}s")
+
+    def update_trim_enabled(self):
+        st.session_state.trim_enabled = st.session_state.trim_enabled_val
+        print(f"INFO: Time Range Enabled -->{st.session_state.trim_enabled_val} ({st.session_state.trim_enabled})")
+
+    def update_trim_range(self):
+        st.session_state.trim_range = tuple(st.session_state.trim_range_val)
+        print(f"INFO: Time Range -->{st.session_state.trim_range_val} ({st.session_state.trim_range})")
+
+    def probe_input_data(self):
+        # OpenCV can decode the images from memory, the video details are known only once the pipeline runs
+        if st.session_state.image_input:
+            image = get_still_processor().decode(st.session_state.input_name, st.session_state.input_hash, st.session_state.input_data)
+            st.session_state.input_height, st.session_state.input_width = image.shape[:2]
+            st.session_state.max_frame = 1
+        else:
+            st.session_state.max_frame = None
+        st.session_state.update_params_from_input_file = False
+
+    def update_in_memory_input(self):
+        st.session_state.in_memory_input = st.session_state.in_memory_input_val
+        # Reprocess the uploaded file with the new mode
+        st.session_state.update_params_from_input_file = st.session_state.file_uploaded
+        print(f"INFO: In Memory Input -->{st.session_state.in_memory_input_val} ({st.session_state.in_memory_input})")
+
+    def update_frame_cache(self):
+        st.session_state.frame_cache = st.session_state.frame_cache_val
+        print(f"INFO: Frame Cache -->{st.session_state.frame_cache_val} ({st.session_state.frame_cache})")
+
     def update_input_file(self):
         if st.session_state.file_uploader is not None:
             st.session_state.file_uploaded = True
@@ -228,30 +815,30 @@ class GStreamerPipeline:
 
     def update_pattern(self):
         st.session_state.pattern = self.pattern_option.index(st.session_state.pattern_val)
-        element = self.pipeline.get_by_name("videotestsrc")
-        element.set_property("pattern", st.session_state.pattern)
+        self.config = self.config.replace(pattern=st.session_state.pattern)
+        properties = {"pattern": st.session_state.pattern}
         if st.session_state.pattern == 18:
-            element.set_property("flip", st.session_state.flip)
-            element.set_property("motion", st.session_state.motion)
-            element.set_property("animation-mode", st.session_state.animation_mode)
+            properties.update({"flip": st.session_state.flip, "motion": st.session_state.motion, "animation-mode": st.session_state.animation_mode})
+        # The pattern and the ball settings switch together on the next frame
+        self.update_properties({"videotestsrc": properties})
         print(f"INFO: Pattern -->{st.session_state.pattern_val} ({st.session_state.pattern})")
 
     def update_flip(self):
         st.session_state.flip = st.session_state.flip_val
-        element = self.pipeline.get_by_name("videotestsrc")
-        element.set_property("flip", st.session_state.flip)
+        self.config = self.config.replace(flip=st.session_state.flip)
+        self.update_properties({"videotestsrc": {"flip": st.session_state.flip}})
         print(f"INFO: Flip -->{st.session_state.flip_val} ({st.session_state.flip})")
 
     def update_motion(self):
         st.session_state.motion = self.motion_options.index(st.session_state.motion_val)
-        element = self.pipeline.get_by_name("videotestsrc")
-        element.set_property("motion", st.session_state.motion)
+        self.config = self.config.replace(motion=st.session_state.motion)
+        self.update_properties({"videotestsrc": {"motion": st.session_state.motion}})
         print(f"INFO: Motion --> {st.session_state.motion_val} ({st.session_state.motion})")
 
     def update_animation(self):
         st.session_state.animation_mode = self.animation_mode_options.index(st.session_state.animation_mode_val)
-        element = self.pipeline.get_by_name("videotestsrc")
-        element.set_property("animation-mode", st.session_state.animation_mode)
+        self.config = self.config.replace(animation_mode=st.session_state.animation_mode)
+        self.update_properties({"videotestsrc": {"animation-mode": st.session_state.animation_mode}})
         print(f"INFO: Animation Mode -->{st.session_state.animation_mode_val} ({st.session_state.animation_mode})")
     ##################################################################################################################
 
@@ -262,43 +849,145 @@ class Pipeline(GStreamerPipeline):
 
     ##################################################################################################################
     ########## Creating Specific Pipeline ############################################################################
-    def create_pipeline(self):
+    def create_pipeline(self, config=None):
         # Overriding base class create_pipeline to initialize the pipeline 
-        super().create_pipeline()
+        super().create_pipeline(config)
+        config = self.config
+
+        # No pixel processing between an MP4 input and an MP4 output, the encoded stream is copied
+        if config.remux:
+            return self.create_remux_pipeline(config)
 
         # VideotestSrc is used as input source
-        if st.session_state.input_method == "VideoTestSrc":
-            src = self.elements.videotestsrc(st.session_state.pattern,st.session_state.flip,st.session_state.motion,st.session_state.animation_mode)
+        if config.input_method == "VideoTestSrc":
+            src = self.elements.videotestsrc(config.pattern,config.flip,config.motion,config.animation_mode,config.num_buffers)
+            if config.width and config.height:
+                src = self.elements.capsfilter(src, width=config.width, height=config.height)
 
         # FileSrc is used as input source
-        if st.session_state.input_method == "FileSrc":
-            src = self.elements.read_input(input_file="input/"+st.session_state.input_name, width=st.session_state.input_width, height=st.session_state.input_height)
+        if config.input_method == "FileSrc":
+            src = self.cached_file_input(config)
 
         vidconv = self.elements.videoconvert(src)
         vidconv = self.elements.videoconvert(vidconv)
         tee = self.elements.tee(vidconv)
-
-        if st.session_state.appsink_enabled:
-            queue = self.elements.queue(tee)
+        # The live updates are applied between two frames entering the branches
+        self.controls.frame_pad = tee.get_static_pad("sink")
+
+        # The output branches can also be added and removed while the pipeline is playing
+        self.branch_tees = {"appsink": tee, "filesink": tee, "autovideosink": tee}
+        for name in ("appsink", "filesink", "autovideosink"):
+            if getattr(config, f"{name}_enabled"):
+                self.add_branch(name)
+
+    def build_branch(self, name, queue):
+        # Overriding base class build_branch to add the elements of the output branches
+        config = self.config
+        if name == "appsink":
             queue = self.elements.capsfilter(queue, format="I420")
             self.elements.appsink(queue)
 
-        if st.session_state.filesink_enabled:
+        elif name == "filesink":
+            # A recording added again doesn't overwrite the one finalized by its previous instance
+            config = self.recording_config()
             # Check if output directory exists if not create one
-            if not os.path.exists("output"):
-                os.makedirs("output")
+            if not os.path.exists(config.output_dir):
+                os.makedirs(config.output_dir)
+            self.elements.write_output(queue, output_file=config.output_file, file_ext=config.out_ext, output_mode=config.output_mode, fragment_duration=config.fragment_duration, output_dir=config.output_dir, encoded=config.remux, sequence=config.sequence_input)
 
-            queue = self.elements.queue(tee)
-            self.elements.write_output(queue, output_file=f"{st.session_state.username}_output", file_ext=st.session_state.out_ext)
+        elif name == "autovideosink":
+            self.elements.autovideosink(queue,)
 
-        if st.session_state.autovideosink_enabled:
+        else:
+            return False
+        return True
+
+    def create_remux_pipeline(self, config):
+        """
+        Creates the passthrough pipeline, the H.264 frames are muxed without being decoded and re-encoded:
+        [filesrc -> qtdemux -> h264parse -> tee -> queue -> mp4mux -> filesink]
+        The previews are decoded on a side branch only when they are enabled:
+        [tee -> queue -> avdec_h264 -> queue (leaky) -> videoconvert -> tee -> appsink/autovideosink]
+        """
+        parser = self.elements.remux_input(input_file=config.input_file, input_data=config.input_data)
+        tee = self.elements.tee(parser)
+        self.controls.frame_pad = tee.get_static_pad("sink")
+        self.branch_tees = {"filesink": tee}
+
+        if config.appsink_enabled or config.autovideosink_enabled:
             queue = self.elements.queue(tee)
-            self.elements.autovideosink(queue,)
+            decoder = self.elements.avdec_h264(queue)
+            # The copy runs faster than real time, the decoded preview frames are dropped rather than slowing it down
+            queue = self.elements.queue(decoder, leaky=True, max_buffer=5)
+            preview_tee = self.elements.tee(self.elements.videoconvert(queue))
+            # The previews can be added and removed while playing only if the decoding branch exists
+            self.branch_tees.update({"appsink": preview_tee, "autovideosink": preview_tee})
+
+        for name in ("filesink", "appsink", "autovideosink"):
+            if getattr(config, f"{name}_enabled"):
+                self.add_branch(name)
     ##################################################################################################################
     def start(self):
-        self.create_pipeline()
+        config = self.session_config()
+        if config.input_method == "FileSrc" and st.session_state.input_path is not None:
+            get_upload_store().touch(st.session_state.input_path)
+        # The same input with the same settings was already processed, its output is copied without running a pipeline
+        self.result_hit = get_result_cache().restore(config)
+        if self.result_hit:
+            self.finish_without_pipeline(config)
+            return
+        if config.image_input:
+            return self.start_still(config)
+        self.create_pipeline(config)
         super().start()
 
+    def start_still(self, config):
+        """
+        Processes a jpg/png input synchronously on the still workers, no Gstreamer pipeline is created.
+        The result is kept in self.still_result, None if the still failed.
+        """
+        self.finish_without_pipeline(config)
+        self.still_result = None
+        try:
+            self.still_result = get_still_processor().submit(config).result()
+            print(f"INFO: Still {config.input_file} --> {self.still_result['output']} in {round(self.still_result['seconds'] * 1000, 1)}ms")
+            get_result_cache().store(config)
+        except Exception as e:
+            self.error = e
+            print(f"Error: Still {config.input_file} failed: {e}")
+        self.eos_occurred = True
+
+    def session_config(self):
+        """
+        Translates the widgets values stored in the streamlit session into a PipelineConfig.
+        """
+        state = st.session_state
+        file_input = state.input_method == "FileSrc"
+        return PipelineConfig(
+            input_method=state.input_method,
+            pattern=state.pattern,
+            flip=state.flip,
+            motion=state.motion,
+            animation_mode=state.animation_mode,
+            input_file=(state.input_path or state.input_name) if file_input else None,
+            input_hash=state.input_hash if file_input else None,
+            input_width=state.input_width if file_input else None,
+            input_height=state.input_height if file_input else None,
+            input_data=state.input_data if file_input else None,
+            frame_cache=file_input and state.frame_cache,
+            # Only the selected time range of the file input is decoded and encoded
+            start_time=state.trim_range[0] if file_input and state.trim_enabled else None,
+            end_time=state.trim_range[1] if file_input and state.trim_enabled else None,
+            appsink_enabled=state.appsink_enabled,
+            filesink_enabled=state.filesink_enabled,
+            autovideosink_enabled=state.autovideosink_enabled,
+            output_file=f"{state.username}_output",
+            out_ext=state.out_ext,
+            output_mode=state.output_mode,
+            fragment_duration=state.fragment_duration,
+            passthrough=state.passthrough,
+        )
+
     ##################################################################################################################
     ##########  Pipeline Input Sinks  ################################################################################
     def default_input_params(self):
@@ -311,11 +1000,12 @@ class Pipeline(GStreamerPipeline):
         with input:
             st.markdown("<hr style='margin-top: 5px; margin-bottom: 5px; border: 1px solid grey;'>", unsafe_allow_html=True)
             self.input_method_list =["VideoTestSrc", "FileSrc"]
-            selected_option = st.radio(" ", self.input_method_list, key="input_method_val", index=self.input_method_list.index(st.session_state.input_method), label_visibility="collapsed", horizontal=True, on_change=self.update_input_method,disabled=(st.session_state.status == "play"))
+            selected_option = st.radio(" ", self.input_method_list, key="input_method_val", index=self.input_method_list.index(st.session_state.input_method), label_visibility="collapsed", horizontal=True, on_change=self.update_input_method,disabled=(st.session_state.status != "stop"))
             if selected_option == "VideoTestSrc":
                 self.videotestsrc_controls()
             elif selected_option == "FileSrc":
                 self.input_file_control()
+                self.time_range_controls()
 
     def update_input_method(self):
         st.session_state.input_method = st.session_state.input_method_val
@@ -328,37 +1018,135 @@ class Pipeline(GStreamerPipeline):
         st.session_state.appsink_enabled = True
         st.session_state.filesink_enabled = True
         st.session_state.autovideosink_enabled = False
+        st.session_state.output_mode = "mp4"
+        st.session_state.fragment_duration = 1000
+        st.session_state.passthrough = True
 
     def output_controls(self):
         output = st.expander("Output Methods",expanded=True)
         with output:
             st.markdown("<hr style='margin-top: 5px; margin-bottom: 5px; border: 1px solid grey;'>", unsafe_allow_html=True)
             col1,col2,col3 = st.columns(3)
-            col1.checkbox("Appsink",key="appsink_val",value=st.session_state.appsink_enabled,help="display the live frames on browser",on_change=self.update_appsink,disabled=(st.session_state.status == "play"))
-            col2.checkbox("Filesink",key="filesink_val",value=st.session_state.filesink_enabled,help="save the created video",on_change=self.update_filesink,disabled=(st.session_state.status == "play"))
-            col3.checkbox("AutoVideoSink",key="autovideosink_val",value=st.session_state.autovideosink_enabled,help="display the live frames on system",on_change=self.update_autovideosink,disabled=(st.session_state.status == "play"))
+            col1.checkbox("Appsink",key="appsink_val",value=st.session_state.appsink_enabled,help="display the live frames on browser",on_change=self.update_appsink,disabled=(st.session_state.status != "stop" and st.session_state.image_input))
+            col2.checkbox("Filesink",key="filesink_val",value=st.session_state.filesink_enabled,help="save the created video",on_change=self.update_filesink,disabled=(st.session_state.status != "stop" and st.session_state.image_input))
+            col3.checkbox("AutoVideoSink",key="autovideosink_val",value=st.session_state.autovideosink_enabled,help="display the live frames on system",on_change=self.update_autovideosink,disabled=(st.session_state.status != "stop" and st.session_state.image_input))
+
+            self.output_mode_options = ["mp4", "fmp4", "hls"]
+            self.output_mode_labels = {"mp4": "MP4", "fmp4": "Fragmented MP4", "hls": "HLS"}
+            col1,col2 = st.columns(2)
+            st.session_state.output_mode_val = st.session_state.output_mode
+            col1.selectbox("Video container", self.output_mode_options,key="output_mode_val",index=self.output_mode_options.index(st.session_state.output_mode),format_func=self.output_mode_labels.get,help="fragmented MP4 and HLS recordings are playable while they are being written",on_change=self.update_output_mode,disabled=(st.session_state.status != "stop" or not st.session_state.filesink_enabled or st.session_state.image_input))
+            st.session_state.fragment_duration_val = st.session_state.fragment_duration / 1000
+            col2.slider("Fragment duration (s)",min_value=0.5,max_value=10.0,step=0.5,key="fragment_duration_val",on_change=self.update_fragment_duration,disabled=(st.session_state.status != "stop" or st.session_state.output_mode == "mp4"))
+            st.checkbox("Copy H.264 stream",key="passthrough_val",value=st.session_state.passthrough,help="an MP4 input is remuxed into the MP4 output without re-encoding, only the live preview is decoded",on_change=self.update_passthrough,disabled=(st.session_state.status != "stop" or not st.session_state.filesink_enabled or st.session_state.image_input))
+
+    def update_passthrough(self):
+        st.session_state.passthrough = st.session_state.passthrough_val
+        print(f"INFO: Passthrough -->{st.session_state.passthrough_val} ({st.session_state.passthrough})")
+
+    def update_output_mode(self):
+        st.session_state.output_mode = st.session_state.output_mode_val
+        print(f"INFO: Output Mode -->{st.session_state.output_mode_val} ({st.session_state.output_mode})")
+
+    def update_fragment_duration(self):
+        st.session_state.fragment_duration = int(st.session_state.fragment_duration_val * 1000)
+        print(f"INFO: Fragment Duration -->{st.session_state.fragment_duration_val} ({st.session_state.fragment_duration})")
+
+    def update_branch(self, name, enabled):
+        # The branches of the running pipeline follow the checkboxes, the next Start builds them from the config
+        if st.session_state.status == "stop":
+            return
+        if enabled and not self.add_branch(name):
+            # The checkbox shows the branch which is actually running
+            st.session_state[f"{name}_enabled"] = False
+            st.session_state[f"{name}_val"] = False
+        elif not enabled:
+            self.remove_branch(name)
+
+    def recording_config(self):
+        """
+        Returns the config of the latest filesink branch, its instances after the first write <output_file>_<instance>.
+        """
+        instance = self.branch_instances.get("filesink", 1)
+        return self.config if instance <= 1 else self.config.replace(output_file=f"{self.config.output_file}_{instance}")
+
+    def output_path(self):
+        """
+        Returns the path of the playable output file of the last started pipeline i.e. of its latest recording.
+        """
+        return self.recording_config().output_path()
 
     def update_appsink(self):
         st.session_state.appsink_enabled = st.session_state.appsink_val
+        self.update_branch("appsink", st.session_state.appsink_enabled)
         print(f"INFO: Appsink Enabled -->{st.session_state.appsink_val} ({st.session_state.appsink_enabled})")
 
     def update_filesink(self):
         st.session_state.filesink_enabled = st.session_state.filesink_val
+        self.update_branch("filesink", st.session_state.filesink_enabled)
         print(f"INFO: Filesink Enabled -->{st.session_state.filesink_val} ({st.session_state.filesink_enabled})")
 
     def update_autovideosink(self):
         st.session_state.autovideosink_enabled = st.session_state.autovideosink_val
+        self.update_branch("autovideosink", st.session_state.autovideosink_enabled)
         print(f"INFO: AutoVideoSink Enabled -->{st.session_state.autovideosink_val} ({st.session_state.autovideosink_enabled})")
     ##################################################################################################################
 
 
+class FilePipeline(GStreamerPipeline):
+    """
+    Headless pipeline processing the input file of the config into its output file, it doesn't use streamlit:
+    [read_input -> videoconvert -> write_output]
+    With the appsink enabled the frames are also delivered to frames(): [videoconvert -> tee -> queue -> appsink / queue -> write_output]
+    With config.frame_processor the frames are processed before the tee: [videoconvert -> add_frame_processor -> tee ...]
+    An image sequence input is read as one stream and written as a video or as a numbered image sequence.
+    An MP4 input written to an MP4 output is remuxed without decoding: [remux_input -> write_output], with the appsink
+    enabled the frames are decoded on a side branch: [remux_input -> tee -> queue -> avdec_h264 -> videoconvert -> appsink / queue -> write_output]
+    """
+    def default_params(self):
+        pass
+
+    def create_pipeline(self, config=None):
+        # Overriding base class create_pipeline to initialize the pipeline
+        super().create_pipeline(config)
+        config = self.config
+
+        if config.remux:
+            src = self.elements.remux_input(input_file=config.input_file, input_data=config.input_data)
+        else:
+            src = self.elements.videoconvert(self.cached_file_input(config))
+            if config.frame_processor is not None:
+                src = self.add_frame_processor(src)
+        # Count the frames reaching the encoder (or the muxer)
+        self.frame_count = 0
+        src.get_static_pad("src").add_probe(Gst.PadProbeType.BUFFER, self.frame_count_prob)
+
+        # Programmatic consumers get the decoded frames through frames()
+        if config.appsink_enabled:
+            tee = self.elements.tee(src)
+            queue = self.elements.queue(tee)
+            if config.remux:
+                # Unlike the previews of the app, every frame is decoded (no leaky queue), frame_mode decides what is kept
+                queue = self.elements.videoconvert(self.elements.avdec_h264(queue))
+            self.elements.appsink(self.elements.capsfilter(queue, format="I420"))
+            src = self.elements.queue(tee)
+
+        if config.filesink_enabled:
+            os.makedirs(config.output_dir, exist_ok=True)
+            self.elements.write_output(src, output_file=config.output_file, file_ext=config.out_ext, output_mode=config.output_mode, fragment_duration=config.fragment_duration, output_dir=config.output_dir, encoded=config.remux, sequence=config.sequence_input)
+
+    def frame_count_prob(self, pad, info):
+        self.frame_count += 1
+        return Gst.PadProbeReturn.OK
+
+
 class TestPipeline(GStreamerPipeline):
     def __init__(self):
         super().__init__()
 
-    def create_pipeline(self):
+    def create_pipeline(self, config=None):
         # Overriding base class create_pipeline to initialize the pipeline 
-        super().create_pipeline()
+        super().create_pipeline(config)
 
         # Using videotestsrc
         # src = self.elements.videotestsrc()
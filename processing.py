@@ -0,0 +1,196 @@
+##################################################################################################################
+# Author: Vishal Kumar
+# Email: vishalkmr01123@gmail.com
+#
+# This file contains the FrameProcessor class which runs a user defined Python function on every frame of the
+# recording path: [videoconvert -> capsfilter (RGB) -> appsink] -> thread pool -> [appsrc -> ...write_output]
+# The frames are processed by several worker threads at once (OpenCV and most NumPy operations release the GIL),
+# the results are pushed to the appsrc in the order the frames entered, hence in PTS order, whatever the order in
+# which the workers complete, by a single pusher thread so that a worker never waits for the encoder branch while
+# holding the lock of the other workers. At most max_inflight frames are queued or processed, the appsink then blocks the
+# upstream elements until a worker is done.
+#
+# The function takes a utils.Frame (RGB image and metadata) and returns the RGB image of the same size to encode,
+# the image is pushed to the appsrc without copy and must not be modified afterwards e.g.
+#     def blur(frame):
+#         return cv2.GaussianBlur(frame.image, (9, 9), 0)
+# and is given to PipelineConfig.frame_processor by its import path e.g. "filters:blur".
+##################################################################################################################
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst, GLib
+import importlib, heapq, queue, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from utils import *
+
+
+def load_processor(path):
+    """
+    Returns the function of an import path "module:function" e.g. "filters:blur".
+    """
+    module_name, _, function_name = path.partition(":")
+    if not function_name:
+        raise ValueError(f"Frame processor {path} is not of the form module:function")
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+class FrameProcessor:
+    """
+    Runs a function on the frames of a pipeline with a thread pool and pushes the results back in order.
+    """
+    def __init__(self, elements, function, workers=4, max_inflight=8):
+        """
+        Args:
+            elements (GstreamerElements): The elements of the pipeline in which the stage is added.
+            function (callable): Takes a utils.Frame and returns the processed RGB image of the same shape.
+            workers (int, optional): The number of worker threads. Defaults to 4.
+            max_inflight (int, optional): The maximal number of frames queued for or processed by the workers. Defaults to 8.
+        """
+        self.elements = elements
+        self.function = function
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="frame_processor")
+        self.inflight = threading.Semaphore(max_inflight)
+        self.rgb_converter = RGB_Converter()
+        # Sequence number of the next submitted frame and of the next frame to push, the completed frames wait in a heap
+        self.submitted = 0
+        self.next_push = 0
+        self.completed = []
+        self.lock = threading.Lock()
+        # The frames in push order, handed by the workers to the pusher thread (None ends the thread, EOS the stream)
+        self.push_queue = queue.Queue()
+        self.pusher = threading.Thread(target=self.push_loop, name="frame_pusher", daemon=True)
+        self.eos = False
+        self.failed = False
+        self.caps = None
+        self.processed = 0
+        self.process_time = 0.0
+        # Set once the appsink has a preroll frame i.e. the input can be seeked
+        self.prerolled = threading.Event()
+
+    def link(self, element):
+        """
+        Adds the processing stage after element.
+
+        Returns:
+            Gst.Element: The appsrc producing the processed frames.
+        """
+        capsfilter = self.elements.capsfilter(element, format="RGB")
+        print("pipeline <-- frame_processor", {"workers": self.workers, "function": getattr(self.function, "__name__", str(self.function))})
+        self.appsink = Gst.ElementFactory.make("appsink", "process_sink")
+        self.appsink.set_property("emit-signals", True)
+        # The recording runs as fast as the workers, the appsink blocks instead of dropping
+        self.appsink.set_property("sync", False)
+        self.appsink.set_property("drop", False)
+        self.appsink.set_property("max-buffers", 1)
+        self.appsink.connect("new-sample", self.new_sample)
+        self.appsink.connect("new-preroll", self.new_preroll)
+        self.appsink.get_static_pad("sink").add_probe(Gst.PadProbeType.EVENT_DOWNSTREAM, self.eos_prob)
+        self.elements.pipeline.add(self.appsink)
+        capsfilter.link(self.appsink)
+
+        # Live, the encoder branch doesn't wait in PAUSED for a frame which only comes once the pipeline plays
+        self.appsrc = self.elements.appsrc(name="process_src", is_live=True)
+        self.pusher.start()
+        return self.appsrc
+
+    def new_preroll(self, appsink):
+        self.prerolled.set()
+        return Gst.FlowReturn.OK
+
+    def new_sample(self, appsink):
+        sample = appsink.emit("pull-sample")
+        if sample is None or self.failed:
+            return Gst.FlowReturn.ERROR if self.failed else Gst.FlowReturn.OK
+        caps = sample.get_caps()
+        buffer = sample.get_buffer()
+        if self.caps is None or not caps.is_equal(self.caps):
+            # The processed frames have the caps of the input frames
+            self.caps = caps
+            self.appsrc.set_property("caps", caps)
+        caps_format = caps.get_structure(0)
+        w, h, format = caps_format.get_value('width'), caps_format.get_value('height'), caps_format.get_value('format')
+        strides, offsets = self.elements.video_layout(caps, buffer)
+        image = self.rgb_converter.buffer_to_rgb(buffer.extract_dup(0, buffer.get_size()), w, h, format, strides, offsets)
+        frame = Frame(
+            image=image, index=self.submitted + 1,
+            pts=buffer.pts if buffer.pts != Gst.CLOCK_TIME_NONE else None,
+            duration=buffer.duration if buffer.duration != Gst.CLOCK_TIME_NONE else None,
+            width=w, height=h, format=format, time=time.time(),
+        )
+        # The appsrc starts a new segment at 0, the frames are pushed at their running time e.g. from 0 after a seek
+        running_time = sample.get_segment().to_running_time(Gst.Format.TIME, buffer.pts) if frame.pts is not None else None
+        # Bounded in flight, the streaming thread (hence the upstream elements) waits for a worker
+        while not self.inflight.acquire(timeout=0.1):
+            if self.failed:
+                return Gst.FlowReturn.ERROR
+        self.executor.submit(self.process, self.submitted, frame, running_time)
+        self.submitted += 1
+        return Gst.FlowReturn.OK
+
+    def process(self, sequence, frame, running_time):
+        # Called from a worker thread
+        start = time.time()
+        try:
+            image = self.function(frame)
+            if image is None or image.shape != frame.image.shape or image.dtype != np.uint8:
+                raise ValueError(f"the result must be an uint8 array of shape {frame.image.shape}")
+        except Exception as e:
+            self.fail(f"Frame processor failed on frame {frame.index}: {e}")
+            image = None
+        with self.lock:
+            self.process_time += time.time() - start
+            heapq.heappush(self.completed, (sequence, frame, running_time, image))
+            self.push_ready()
+
+    def push_ready(self):
+        # Called with the lock held, queues the completed frames which follow the last queued one
+        while self.completed and self.completed[0][0] == self.next_push:
+            _, frame, running_time, image = heapq.heappop(self.completed)
+            self.next_push += 1
+            self.push_queue.put((frame, running_time, image))
+        if self.eos and self.next_push == self.submitted:
+            self.push_queue.put(Gst.EventType.EOS)
+            self.eos = False
+
+    def push_loop(self):
+        # Pusher thread, pushes the frames in order without holding the lock
+        while True:
+            item = self.push_queue.get()
+            if item is None:
+                return
+            if item == Gst.EventType.EOS:
+                self.appsrc.emit("end-of-stream")
+                continue
+            frame, running_time, image = item
+            if image is not None and not self.failed:
+                # Without copy, the pusher waits while the encoder branch is behind
+                self.elements.push_frame(self.appsrc, image, running_time, frame.duration)
+                self.processed += 1
+            # The frame stays in flight until pushed, the queue holds at most max_inflight frames
+            self.inflight.release()
+
+    def eos_prob(self, pad, info):
+        # The appsrc ends once the frames still processed are pushed
+        if info.get_event().type == Gst.EventType.EOS:
+            with self.lock:
+                self.eos = True
+                self.push_ready()
+        return Gst.PadProbeReturn.OK
+
+    def fail(self, text):
+        print(f"Error: {text}")
+        self.failed = True
+        error = GLib.Error.new_literal(Gst.stream_error_quark(), text, Gst.StreamError.FAILED)
+        self.appsrc.post_message(Gst.Message.new_error(self.appsrc, error, text))
+
+    def close(self):
+        """
+        Stops the workers, called once the pipeline has finished.
+        """
+        self.failed = True
+        self.executor.shutdown(wait=False)
+        self.push_queue.put(None)
+        if self.processed:
+            print(f"INFO: Frame processor --> {self.processed} frames, {round(self.process_time / self.processed * 1000, 2)}ms per frame on {self.workers} workers")
@@ -0,0 +1,209 @@
+##################################################################################################################
+# Author: Vishal Kumar
+# Email: vishalkmr01123@gmail.com
+#
+# This file contains the cache of the completed outputs.
+# The outputs of a run are stored under a digest of the input content and of every setting of the PipelineConfig
+# which changes the output (input method, videotestsrc parameters, time range, output extension and container...),
+# the settings which only change where the output is written or how it is previewed are left out. Running the same
+# input with the same settings again (from any session) copies the stored output instead of running the pipeline.
+# Only the runs which reached their natural EOS are stored, a run stopped by the user is partial.
+#
+# Layout of the cache directory:
+#     cache/results/<digest>/result.mp4                      (or result.jpg, result.m3u8 + result_00000.ts, ...)
+# The entries are evicted least recently used first once the disk quota is reached.
+#
+# Environment:
+#     RESULT_CACHE_MB  : disk quota of the stored outputs (default 2048, 0 disables the cache)
+#     RESULT_CACHE_DIR : directory of the stored outputs (default cache/results)
+##################################################################################################################
+
+import os, re, glob, json, shutil, hashlib, tempfile, threading
+from shared import shared_instance
+
+MB = 1024 * 1024
+
+# Settings which don't change the content of the output
+OUTPUT_INDEPENDENT_FIELDS = ("input_file", "output_dir", "output_file", "appsink_enabled", "autovideosink_enabled", "memory_budget_mb", "frame_cache", "frame_mode", "batch_size", "batch_ms",
+                             "processor_workers", "processor_inflight")
+
+# Name of the stored outputs, the output name of the session replaces it when the output is restored
+RESULT_NAME = "result"
+
+
+def result_key(config):
+    """
+    Returns the digest of the input content and of the settings changing the output of the config.
+
+    Returns:
+        str: The digest, None if the output of the config can't be cached i.e. no output file, an input without content hash
+        or a frame processor (its code is not part of the config).
+    """
+    if not config.filesink_enabled or (config.input_method == "FileSrc" and config.input_hash is None) or config.frame_processor is not None:
+        return None
+    settings = {name: value for name, value in config.to_dict().items() if name not in OUTPUT_INDEPENDENT_FIELDS}
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()
+
+
+def output_files(path):
+    """
+    Returns the files of an output from its path (PipelineConfig.output_path): the output file, the playlist and the
+    segments it lists for the HLS output, or the numbered frames of a pattern e.g. output_%06d.jpg.
+    """
+    directory, name = os.path.split(path)
+    pattern = re.fullmatch(r"(.*)%0(\d+)d(.*)", name)
+    if pattern is not None:
+        prefix, digits, suffix = pattern.groups()
+        frame_name = re.compile(re.escape(prefix) + r"\d{%d,}" % int(digits) + re.escape(suffix))
+        return sorted(os.path.join(directory, entry) for entry in os.listdir(directory or ".") if frame_name.fullmatch(entry)) if os.path.isdir(directory or ".") else []
+    if not os.path.isfile(path):
+        return []
+    files = [path]
+    if path.endswith(".m3u8"):
+        with open(path) as f:
+            files += [os.path.join(directory, os.path.basename(line.strip())) for line in f if line.strip() and not line.startswith("#")]
+    return files
+
+
+def copy_output(source_path, source_name, target_dir, target_name):
+    """
+    Copies the files of the output at source_path (named after source_name) to target_dir, named after target_name.
+
+    Returns:
+        list: The (size, modification time) of the copied files, to check they didn't change meanwhile.
+    """
+    stats = []
+    for path in output_files(source_path):
+        stat = os.stat(path)
+        stats.append((stat.st_size, stat.st_mtime_ns))
+        target = os.path.join(target_dir, target_name + os.path.basename(path)[len(source_name):])
+        if path.endswith(".m3u8"):
+            # The playlist refers to its segments by name, they are renamed together
+            with open(path) as f:
+                lines = f.readlines()
+            with open(target, "w") as f:
+                f.writelines(line if line.startswith("#") or not line.strip() else target_name + os.path.basename(line.strip())[len(source_name):] + "\n" for line in lines)
+        else:
+            # Copied rather than hard linked, the pipeline truncates an existing output file in place
+            shutil.copyfile(path, target)
+    return stats
+
+
+class ResultCache:
+    """
+    Disk cache of the completed outputs keyed by result_key, evicted least recently used first.
+    """
+    def __init__(self, quota_bytes=2048 * MB, cache_dir=os.path.join("cache", "results")):
+        """
+        Args:
+            quota_bytes (int, optional): The maximal bytes of the stored outputs, 0 disables the cache. Defaults to 2GB.
+            cache_dir (str, optional): The directory of the stored outputs. Defaults to "cache/results".
+        """
+        self.quota_bytes = quota_bytes
+        self.cache_dir = cache_dir
+        self.lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+
+    def entry_path(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def entry_output_path(self, config, entry):
+        # The output path of the config with the stored name e.g. <entry>/result.m3u8
+        return config.replace(output_dir=entry, output_file=RESULT_NAME).output_path()
+
+    def restore(self, config):
+        """
+        Writes the stored output of the config to its output path.
+
+        Returns:
+            bool: True on a cache hit, the output of the config is then complete.
+        """
+        key = result_key(config) if self.quota_bytes else None
+        if key is None:
+            return False
+        entry = self.entry_path(key)
+        with self.lock:
+            if not os.path.isdir(entry):
+                self.misses += 1
+                return False
+            # The modification time of the entry is its last use, it is the last one evicted while it is copied
+            os.utime(entry)
+        # Copied without the lock, the other sessions restore and store meanwhile
+        try:
+            os.makedirs(config.output_dir, exist_ok=True)
+            copy_output(self.entry_output_path(config, entry), RESULT_NAME, config.output_dir, config.output_file)
+        except OSError as e:
+            print(f"Warning: Result cache --> {key[:12]} not restored: {e}")
+            with self.lock:
+                self.misses += 1
+            return False
+        with self.lock:
+            self.hits += 1
+        print(f"INFO: Result cache --> {config.output_path()} restored from {key[:12]}")
+        return True
+
+    def store(self, config):
+        """
+        Stores the output written by a complete run of the config, it does nothing if the output is already stored.
+        """
+        key = result_key(config) if self.quota_bytes else None
+        if key is None or not output_files(config.output_path()):
+            return
+        entry = self.entry_path(key)
+        if os.path.isdir(entry):
+            return
+        # The entry shows up complete, a concurrent restore never sees a partial output
+        temp_dir = tempfile.mkdtemp(prefix=f"{key}.", dir=self.cache_dir)
+        try:
+            stats = copy_output(config.output_path(), config.output_file, temp_dir, RESULT_NAME)
+            # Stored after the run is signalled finished, a new run of the session may have rewritten the output meanwhile
+            if stats != [(stat.st_size, stat.st_mtime_ns) for stat in map(os.stat, output_files(config.output_path()))]:
+                raise OSError("the output changed while it was copied")
+            os.rename(temp_dir, entry)
+        except OSError as e:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            if not os.path.isdir(entry):
+                print(f"Error: Result cache --> {config.output_path()} not stored: {e}")
+            return
+        print(f"INFO: Result cache --> {config.output_path()} stored as {key[:12]}")
+        with self.lock:
+            self.evict()
+
+    def entries(self):
+        """
+        Returns the stored entries with their size in bytes and last use, the least recently used first.
+        """
+        entries = []
+        for entry in glob.glob(os.path.join(self.cache_dir, "*")):
+            if not os.path.isdir(entry) or "." in os.path.basename(entry):
+                continue
+            size = sum(os.path.getsize(path) for path in glob.glob(os.path.join(entry, "*")))
+            entries.append((os.path.getmtime(entry), size, entry))
+        return sorted(entries)
+
+    def evict(self):
+        entries = self.entries()
+        used = sum(size for _, size, _ in entries)
+        for _, size, entry in entries:
+            # The last stored output is kept even if it is bigger than the quota
+            if used <= self.quota_bytes or entry == entries[-1][2]:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            used -= size
+
+    def report(self):
+        entries = self.entries()
+        return {"entries": len(entries), "bytes": sum(size for _, size, _ in entries), "quota_bytes": self.quota_bytes, "hits": self.hits, "misses": self.misses}
+
+
+@shared_instance
+def get_result_cache():
+    """
+    Returns the ResultCache shared by all the sessions of the process.
+    """
+    return ResultCache(
+        quota_bytes=int(os.environ.get("RESULT_CACHE_MB", 2048)) * MB,
+        cache_dir=os.environ.get("RESULT_CACHE_DIR", os.path.join("cache", "results")),
+    )
@@ -0,0 +1,67 @@
+##################################################################################################################
+# Author: Vishal Kumar
+# Email: vishalkmr01123@gmail.com
+#
+# This file contains the helpers of the image sequence inputs i.e. a directory or a glob pattern of jpg/png frames
+# processed as one stream: [multifilesrc -> jpegdec/pngdec -> videoconvert -> ...]
+# multifilesrc reads the files of a printf pattern (e.g. 000000.jpg, 000001.jpg, ...), so the frames are linked
+# in their natural order into a temporary directory under such names; nothing is copied and any file names work.
+# The frames are expected to have the same size and format.
+##################################################################################################################
+
+import os, re, glob
+
+# Extensions of the frames supported by the image sequence inputs
+SEQUENCE_EXTENSIONS = ("jpg", "png")
+
+
+def is_sequence(input_path):
+    """
+    Returns True if the input is an image sequence i.e. a directory or a glob pattern.
+    """
+    return bool(input_path) and not os.path.isfile(input_path) and (os.path.isdir(input_path) or any(c in input_path for c in "*?["))
+
+
+def natural_key(path):
+    # frame2.jpg comes before frame10.jpg
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", os.path.basename(path))]
+
+
+def collect_frames(input_path):
+    """
+    Returns the frames of an image sequence in their natural order.
+
+    Args:
+        input_path (str): A directory or a glob pattern of jpg/png files.
+
+    Returns:
+        tuple: The list of the frame paths and their extension.
+
+    Raises:
+        ValueError: If there is no frame or the frames have different extensions.
+    """
+    paths = glob.glob(os.path.join(input_path, "*")) if os.path.isdir(input_path) else glob.glob(input_path)
+    frames = sorted((path for path in paths if os.path.isfile(path) and path.split(".")[-1].lower() in SEQUENCE_EXTENSIONS), key=natural_key)
+    if not frames:
+        raise ValueError(f"No jpg/png frame found in {input_path}")
+    extensions = {path.split(".")[-1].lower() for path in frames}
+    if len(extensions) > 1:
+        raise ValueError(f"The frames of {input_path} mix the extensions {sorted(extensions)}")
+    return frames, extensions.pop()
+
+
+def link_sequence(input_path, directory):
+    """
+    Links the frames of an image sequence into directory as 000000.<ext>, 000001.<ext>, ... for multifilesrc.
+
+    Args:
+        input_path (str): A directory or a glob pattern of jpg/png files.
+        directory (str): The empty directory receiving the links.
+
+    Returns:
+        tuple: The printf pattern of the linked frames, their extension and their number.
+    """
+    frames, file_ext = collect_frames(input_path)
+    for index, frame in enumerate(frames):
+        os.symlink(os.path.abspath(frame), os.path.join(directory, f"{index:06d}.{file_ext}"))
+    return os.path.join(directory, f"%06d.{file_ext}"), file_ext, len(frames)
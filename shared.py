@@ -0,0 +1,38 @@
+##################################################################################################################
+# Author: Vishal Kumar
+# Email: vishalkmr01123@gmail.com
+#
+# This file contains the shared_instance decorator of the getters of the objects shared by all the sessions of the
+# process (upload store, caches, media server, indexer...). Streamlit runs every session in its own thread, the object
+# is created once by the first call and the next calls, from any thread, return it.
+#
+# Example:
+#     @shared_instance
+#     def get_upload_store():
+#         return UploadStore()
+##################################################################################################################
+
+import functools, threading
+
+
+def shared_instance(factory):
+    """
+    Turns a function creating an object into the getter of the single instance of the process.
+
+    Args:
+        factory (callable): Called without argument on the first call of the getter, it creates the object.
+
+    Returns:
+        callable: The getter, it returns the object created by the first call.
+    """
+    lock = threading.Lock()
+    instance = []
+
+    @functools.wraps(factory)
+    def getter():
+        # The lock makes sure two sessions starting together don't both create the object
+        with lock:
+            if not instance:
+                instance.append(factory())
+            return instance[0]
+    return getter
@@ -0,0 +1,139 @@
+##################################################################################################################
+# Author: Vishal Kumar
+# Email: vishalkmr01123@gmail.com
+#
+# This file contains the single-frame execution path of the jpg/png inputs.
+# A still doesn't need a Gstreamer pipeline (main loop thread, tee, queues, appsink, EOS and polling of the
+# output file), it is decoded, converted and encoded synchronously by a small pool of worker threads with the
+# same settings as the pipeline [jpegdec/pngdec -> videoconvert -> jpegenc/pngenc].
+# The decoded images are kept in an LRU keyed by the content hash of the input, so running the same upload
+# again (or with other output settings) skips the decoding.
+#
+# Example:
+#     result = get_still_processor().submit(config).result()
+#     result["output"], result["image"]
+##################################################################################################################
+
+import os, time, hashlib, threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from shared import shared_instance
+
+# Same quality as the jpegenc/pngenc elements of the pipeline
+JPEG_QUALITY = 85
+PNG_COMPRESSION = 9
+
+
+class StillProcessor:
+    """
+    Processes the still inputs synchronously and caches their decoded images.
+    """
+    def __init__(self, cache_bytes=256 * 1024 * 1024, workers=2):
+        """
+        Args:
+            cache_bytes (int, optional): The maximal bytes of the cached decoded images. Defaults to 256MB.
+            workers (int, optional): The number of worker threads. Defaults to 2.
+        """
+        self.cache_bytes = cache_bytes
+        self.cache = OrderedDict()
+        self.cached_bytes = 0
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="still")
+
+    def cache_key(self, input_file, input_hash=None, input_data=None):
+        # Inputs without content hash (e.g. batch files) are identified by their path, size and modification time
+        if input_hash is not None:
+            return input_hash
+        if input_data is not None:
+            return hashlib.sha256(input_data).hexdigest()
+        stat = os.stat(input_file)
+        return hashlib.sha256(f"{os.path.abspath(input_file)}:{stat.st_size}:{stat.st_mtime_ns}".encode()).hexdigest()
+
+    def decode(self, input_file, input_hash=None, input_data=None):
+        """
+        Returns the decoded BGR image of a still input, from the cache if it was decoded before.
+
+        Args:
+            input_file (str): The path (or name) of the input file.
+            input_hash (str, optional): The content hash of the input, the cache key.
+            input_data (bytes-like, optional): The content of the input file, when given input_file is not read.
+
+        Returns:
+            np.ndarray: The decoded image, it is shared with the cache and must not be modified.
+        """
+        key = self.cache_key(input_file, input_hash, input_data)
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+
+        if input_data is None:
+            with open(input_file, "rb") as f:
+                input_data = f.read()
+        # jpegdec doesn't apply the EXIF orientation either
+        image = cv2.imdecode(np.frombuffer(input_data, dtype=np.uint8), cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION)
+        if image is None:
+            raise ValueError(f"Could not decode the image {input_file}")
+        image.setflags(write=False)
+
+        with self.lock:
+            if key not in self.cache:
+                self.cache[key] = image
+                self.cached_bytes += image.nbytes
+                while self.cached_bytes > self.cache_bytes and len(self.cache) > 1:
+                    _, evicted = self.cache.popitem(last=False)
+                    self.cached_bytes -= evicted.nbytes
+        return image
+
+    def process(self, config):
+        """
+        Decodes the still input of the config and writes its output file.
+
+        Args:
+            config (PipelineConfig): The configuration of the job, its input must be a jpg/png file.
+
+        Returns:
+            dict: The path of the output ("output"), the RGB image for the preview ("image") and the time taken in seconds ("seconds").
+        """
+        begin = time.time()
+        image = self.decode(config.input_file, config.input_hash, config.input_data)
+
+        output_path = None
+        if config.filesink_enabled:
+            out_ext = config.out_ext if config.out_ext in ("jpg", "png") else "jpg"
+            params = [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY] if out_ext == "jpg" else [cv2.IMWRITE_PNG_COMPRESSION, PNG_COMPRESSION]
+            ok, encoded = cv2.imencode(f".{out_ext}", image, params)
+            if not ok:
+                raise RuntimeError(f"Could not encode the output of {config.input_file}")
+            os.makedirs(config.output_dir, exist_ok=True)
+            output_path = os.path.join(config.output_dir, f"{config.output_file}.{out_ext}")
+            # The file shows up complete, readers polling for it never see a partial image
+            temp_path = f"{output_path}.{threading.get_ident()}.tmp"
+            with open(temp_path, "wb") as f:
+                f.write(encoded.tobytes())
+            os.replace(temp_path, output_path)
+
+        return {
+            "output": output_path,
+            "image": cv2.cvtColor(image, cv2.COLOR_BGR2RGB) if config.appsink_enabled else None,
+            "seconds": time.time() - begin,
+        }
+
+    def submit(self, config):
+        """
+        Queues the still of the config on the worker threads.
+
+        Returns:
+            concurrent.futures.Future: The future of the result of process.
+        """
+        return self.executor.submit(self.process, config)
+
+
+@shared_instance
+def get_still_processor():
+    """
+    Returns the StillProcessor shared by all the sessions of the process.
+    """
+    return StillProcessor()
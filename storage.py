@@ -0,0 +1,231 @@
+##################################################################################################################
+# Author: Vishal Kumar
+# Email: vishalkmr01123@gmail.com
+#
+# This file contains the UploadStore class which is used to keep the uploaded input files on disk.
+# Uploads are streamed to disk in chunks and stored under their content hash (input/objects/<sha256>.<ext>),
+# so the same clip uploaded many times is stored only once. Every session gets its own alias
+# (input/sessions/<username>/<file name>) which is a symlink to the stored object, hence two users uploading
+# files with the same name never overwrite each other.
+# The aliases act as references of the objects, a background thread expires the stale aliases and removes
+# the objects which are no longer referenced by any session.
+##################################################################################################################
+
+import os, hashlib, tempfile, threading, time
+from shared import shared_instance
+
+# Size of the chunks in which the uploads are hashed and written
+CHUNK_SIZE = 1024 * 1024
+
+
+class UploadStore:
+    def __init__(self, root="input", alias_ttl=24 * 60 * 60, grace_period=10 * 60, sweep_interval=60):
+        """
+        Initializes the UploadStore and starts the background cleanup thread.
+
+        Args:
+            root (str, optional): The directory under which the objects and session aliases are stored. Defaults to "input".
+            alias_ttl (int, optional): Seconds after which an unused session alias is expired. Defaults to 24 hours.
+            grace_period (int, optional): Seconds an unreferenced object is kept before it is removed. Defaults to 10 minutes.
+            sweep_interval (int, optional): Seconds between two runs of the cleanup thread. Defaults to 60.
+        """
+        self.root = root
+        self.objects_dir = os.path.join(root, "objects")
+        self.sessions_dir = os.path.join(root, "sessions")
+        self.tmp_dir = os.path.join(root, "tmp")
+        for directory in (self.objects_dir, self.sessions_dir, self.tmp_dir):
+            os.makedirs(directory, exist_ok=True)
+
+        self.alias_ttl = alias_ttl
+        self.grace_period = grace_period
+        self.sweep_interval = sweep_interval
+
+        # Reference count of every object i.e. digest -> set of alias paths
+        self.refs = {}
+        # Time at which the reference count of an object dropped to zero i.e. digest -> time
+        self.released = {}
+        self.lock = threading.Lock()
+        self.load_refs()
+
+        self.cleanup_thread = threading.Thread(target=self.cleanup_loop, daemon=True)
+        self.cleanup_thread.start()
+
+    def object_path(self, digest, ext):
+        """
+        Returns the path of the object stored for the given digest and file extension.
+        """
+        return os.path.join(self.objects_dir, f"{digest}.{ext}")
+
+    def store(self, input_file, name, session):
+        """
+        Streams an uploaded file into the store and creates the session alias for it.
+
+        Args:
+            input_file (file-like): The uploaded file, it must be readable and seekable (e.g. streamlit UploadedFile).
+            name (str): The original name of the uploaded file.
+            session (str): The name of the session (username) owning the alias.
+
+        Returns:
+            tuple: The content hash of the file and the path of the session alias.
+        """
+        ext = name.split(".")[-1].lower()
+        # Hashed while it is written, the upload is read once and the other sessions are not blocked meanwhile
+        digest, tmp_path = self.write_temp(input_file)
+        object_path = self.object_path(digest, ext)
+
+        with self.lock:
+            if os.path.isfile(object_path):
+                # Deduplicated upload, the temporary copy is dropped
+                os.remove(tmp_path)
+                print(f"INFO: File {name} is already stored as {object_path}")
+            else:
+                os.replace(tmp_path, object_path)
+                print(f"INFO: File {name} is stored as {object_path}")
+            alias = self.add_alias(session, name, object_path, digest)
+        return digest, alias
+
+    def write_temp(self, input_file):
+        """
+        Streams the file into a temporary file in chunks and computes its sha256 on the way.
+
+        Returns:
+            tuple: The content hash of the file and the path of the temporary file.
+        """
+        sha = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                input_file.seek(0)
+                for chunk in iter(lambda: input_file.read(CHUNK_SIZE), b""):
+                    sha.update(chunk)
+                    f.write(chunk)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        finally:
+            input_file.seek(0)
+        return sha.hexdigest(), tmp_path
+
+    def add_alias(self, session, name, object_path, digest):
+        """
+        Creates (or replaces) the symlink input/sessions/<session>/<name> pointing to the object.
+        Needs to be called with self.lock held.
+        """
+        session_dir = os.path.join(self.sessions_dir, session)
+        os.makedirs(session_dir, exist_ok=True)
+        alias = os.path.join(session_dir, os.path.basename(name))
+
+        # Drop the reference held by the alias which is being replaced
+        if os.path.islink(alias):
+            self.remove_ref(alias)
+
+        tmp_alias = f"{alias}.{os.getpid()}.tmp"
+        if os.path.lexists(tmp_alias):
+            os.remove(tmp_alias)
+        os.symlink(os.path.relpath(object_path, session_dir), tmp_alias)
+        os.replace(tmp_alias, alias)
+
+        self.refs.setdefault(digest, set()).add(alias)
+        self.released.pop(digest, None)
+        return alias
+
+    def remove_ref(self, alias, digest=None):
+        """
+        Removes the alias and decrements the reference count of its object.
+        Needs to be called with self.lock held.
+        """
+        if digest is None:
+            digest = self.alias_digest(alias)
+        if os.path.lexists(alias):
+            os.remove(alias)
+        aliases = self.refs.get(digest)
+        if aliases is not None:
+            aliases.discard(alias)
+            if not aliases:
+                del self.refs[digest]
+                self.released[digest] = time.time()
+
+    def alias_digest(self, alias):
+        """
+        Returns the digest of the object the alias points to.
+        """
+        target = os.path.basename(os.readlink(alias))
+        return target.split(".")[0]
+
+    def touch(self, alias):
+        """
+        Marks the alias as used so that it is not expired by the cleanup thread.
+        """
+        if os.path.islink(alias):
+            os.utime(alias, follow_symlinks=False)
+
+    def release_session(self, session):
+        """
+        Removes all the aliases of a session, called when the session uploads a new input.
+        """
+        session_dir = os.path.join(self.sessions_dir, session)
+        if not os.path.isdir(session_dir):
+            return
+        with self.lock:
+            for name in os.listdir(session_dir):
+                alias = os.path.join(session_dir, name)
+                if os.path.islink(alias):
+                    self.remove_ref(alias)
+
+    def load_refs(self):
+        """
+        Rebuilds the reference counts from the aliases present on the disk.
+        """
+        with self.lock:
+            for session in os.listdir(self.sessions_dir):
+                session_dir = os.path.join(self.sessions_dir, session)
+                if not os.path.isdir(session_dir):
+                    continue
+                for name in os.listdir(session_dir):
+                    alias = os.path.join(session_dir, name)
+                    if os.path.islink(alias):
+                        self.refs.setdefault(self.alias_digest(alias), set()).add(alias)
+
+            # Objects without any alias are removed after the grace period
+            now = time.time()
+            for name in os.listdir(self.objects_dir):
+                digest = name.split(".")[0]
+                if digest not in self.refs:
+                    self.released.setdefault(digest, now)
+
+    def cleanup_loop(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                self.cleanup()
+            except OSError as e:
+                print(f"Error: Upload cleanup failed : {e}")
+
+    def cleanup(self):
+        """
+        Expires the stale session aliases and removes the objects having no reference since the grace period.
+        """
+        now = time.time()
+        with self.lock:
+            for digest, aliases in list(self.refs.items()):
+                for alias in list(aliases):
+                    if not os.path.lexists(alias) or now - os.lstat(alias).st_mtime > self.alias_ttl:
+                        self.remove_ref(alias, digest)
+
+            for digest, released_time in list(self.released.items()):
+                if now - released_time < self.grace_period:
+                    continue
+                for name in os.listdir(self.objects_dir):
+                    if name.split(".")[0] == digest:
+                        os.remove(os.path.join(self.objects_dir, name))
+                        print(f"INFO: Unreferenced input {name} is removed")
+                del self.released[digest]
+
+
+@shared_instance
+def get_upload_store():
+    """
+    Returns the UploadStore shared by all the sessions of the process.
+    """
+    return UploadStore()
@@ -0,0 +1,136 @@
+##################################################################################################################
+# Author: Vishal Kumar
+# Email: vishalkmr01123@gmail.com
+#
+# This file contains the parallel transcoding of the MP4 inputs.
+# The keyframe index of the input is built without decoding (see indexer.py) and the input is split into
+# GOP aligned chunks. Every chunk runs through its own FilePipeline in a process pool:
+#     [filesrc -> qtdemux -> avdec_h264 -> videoconvert -> x264enc -> h264parse -> mp4mux -> filesink]
+# seeked to the keyframe starting the chunk and stopped at the keyframe starting the next one.
+# The encoded chunks are then concatenated without re-encoding:
+#     [splitmuxsrc -> h264parse -> mp4mux -> filesink]
+#
+# Usage:
+#     python transcode.py input/video.mp4 -o output/video.mp4 -j 8
+#     python transcode.py input/video.mp4 -j 8 --benchmark
+##################################################################################################################
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+import os, time, argparse, tempfile, shutil, multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pipeline import FilePipeline
+from config import PipelineConfig
+from elements import GstreamerElements
+from indexer import keyframe_index, gop_chunks
+
+
+def transcode_chunk(input_file, start_time, end_time, output_file, output_dir):
+    """
+    Transcodes the [start_time, end_time) range of the input into output_dir/output_file.mp4, it runs in the worker processes.
+
+    Returns:
+        float: The time taken by the chunk in seconds.
+    """
+    begin = time.time()
+    config = PipelineConfig(input_method="FileSrc", input_file=input_file, start_time=start_time, end_time=end_time, appsink_enabled=False, output_dir=output_dir, output_file=output_file, passthrough=False)
+    pipeline = FilePipeline(config)
+    pipeline.start()
+    if not pipeline.wait_eos():
+        raise RuntimeError(f"Transcoding [{start_time}, {end_time}] of {input_file} failed: {pipeline.error}")
+    return time.time() - begin
+
+
+def concat_chunks(chunk_pattern, output_path):
+    """
+    Concatenates the encoded MP4 chunks matching chunk_pattern into output_path without re-encoding them.
+    """
+    Gst.init(None)
+    pipeline = Gst.Pipeline()
+    elements = GstreamerElements(pipeline)
+
+    splitmuxsrc = elements.splitmuxsrc(chunk_pattern)
+    parser = elements.h264parse()
+    splitmuxsrc.connect("pad-added", elements.demuxer_pad_added, parser)
+    output_dir, output_name = os.path.split(output_path)
+    elements.filesink(elements.mp4mux(parser), output_file=os.path.splitext(output_name)[0], file_ext="mp4", output_dir=output_dir or ".")
+
+    pipeline.set_state(Gst.State.PLAYING)
+    message = pipeline.get_bus().timed_pop_filtered(Gst.CLOCK_TIME_NONE, Gst.MessageType.EOS | Gst.MessageType.ERROR)
+    pipeline.set_state(Gst.State.NULL)
+    if message.type == Gst.MessageType.ERROR:
+        err, debug = message.parse_error()
+        raise RuntimeError(f"Concatenating {chunk_pattern} failed: {err}")
+
+
+def parallel_transcode(input_file, output_path, workers=None, chunks_per_worker=2):
+    """
+    Transcodes an MP4 input by splitting it into GOP aligned chunks which are encoded in parallel.
+
+    Args:
+        input_file (str): The path of the MP4 input.
+        output_path (str): The path of the MP4 output.
+        workers (int, optional): The number of worker processes. Defaults to the number of CPUs.
+        chunks_per_worker (int, optional): The number of chunks per worker, more chunks balance the load better. Defaults to 2.
+
+    Returns:
+        dict: The number of chunks and the time taken by the indexing, the encoding and the concatenation.
+    """
+    workers = workers or os.cpu_count()
+    stats = {"workers": workers}
+
+    begin = time.time()
+    chunks = gop_chunks(keyframe_index(input_file), workers * chunks_per_worker)
+    stats["chunks"] = len(chunks)
+    stats["index_time"] = time.time() - begin
+
+    chunk_dir = tempfile.mkdtemp(prefix="chunks_", dir=os.path.dirname(os.path.abspath(output_path)))
+    try:
+        begin = time.time()
+        # GLib does not survive a fork, the workers are spawned
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            futures = [executor.submit(transcode_chunk, input_file, start, end, f"chunk_{i:05d}", chunk_dir) for i, (start, end) in enumerate(chunks)]
+            stats["chunk_times"] = [future.result() for future in futures]
+        stats["encode_time"] = time.time() - begin
+
+        begin = time.time()
+        concat_chunks(os.path.join(chunk_dir, "chunk_*.mp4"), output_path)
+        stats["concat_time"] = time.time() - begin
+    finally:
+        shutil.rmtree(chunk_dir, ignore_errors=True)
+
+    stats["total_time"] = stats["index_time"] + stats["encode_time"] + stats["concat_time"]
+    return stats
+
+
+def benchmark(input_file, workers):
+    """
+    Compares the serial transcoding (one pipeline on the whole input) with the parallel transcoding.
+    """
+    output_dir = tempfile.mkdtemp(prefix="transcode_benchmark_")
+    try:
+        serial_time = transcode_chunk(input_file, None, None, "serial", output_dir)
+        print(f"Serial   : {serial_time:.2f}s")
+        stats = parallel_transcode(input_file, os.path.join(output_dir, "parallel.mp4"), workers)
+        print(f"Parallel : {stats['total_time']:.2f}s with {stats['workers']} workers and {stats['chunks']} chunks "
+              f"(index {stats['index_time']:.2f}s, encode {stats['encode_time']:.2f}s, concat {stats['concat_time']:.2f}s)")
+        print(f"Speedup  : {serial_time / stats['total_time']:.2f}x")
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Transcode an MP4 file with GOP aligned chunks encoded in parallel")
+    parser.add_argument("input", help="path of the MP4 input")
+    parser.add_argument("-o", "--output", help="path of the MP4 output")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument("--benchmark", action="store_true", help="compare the serial and the parallel transcoding")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.input, args.workers)
+    else:
+        output = args.output or os.path.join("output", os.path.basename(args.input))
+        stats = parallel_transcode(args.input, output, args.workers)
+        print(f"INFO: {output} is written in {stats['total_time']:.2f}s ({stats['chunks']} chunks, {stats['workers']} workers)")
@@ -8,6 +8,61 @@
 
 import cv2
 import numpy as np
+from dataclasses import dataclass
+from typing import Optional
+
+@dataclass(eq=False)
+class Frame:
+    """
+    A frame of the appsink converted to RGB with its metadata.
+    """
+    # RGB image of shape (height, width, 3)
+    image: np.ndarray
+    # Number of the frame at the appsink, starting at 1
+    index: int
+    # Presentation timestamp and duration in ns, None if the buffer has none
+    pts: Optional[int]
+    duration: Optional[int]
+    width: int
+    height: int
+    # Format of the frame at the appsink e.g. "I420"
+    format: str
+    # Wall clock time (time.time()) at which the frame was queued
+    time: float
+
+    @property
+    def nbytes(self):
+        # Bytes accounted in the memory budget
+        return self.image.nbytes
+
+@dataclass(eq=False)
+class FrameBatch:
+    """
+    Frames of the appsink stacked into one array with their timestamps, see PipelineConfig.batch_size and batch_ms.
+    """
+    # RGB images of shape (count, height, width, 3), a view of the array preallocated for the batch
+    images: np.ndarray
+    # Presentation timestamps in ns of the images, -1 for a buffer without timestamp
+    pts: np.ndarray
+    # Number of the first frame of the batch at the appsink, starting at 1
+    index: int
+    width: int
+    height: int
+    # Format of the frames at the appsink e.g. "I420"
+    format: str
+    # Wall clock time (time.time()) at which the batch was queued
+    time: float
+    # Bytes of the preallocated array, accounted in the memory budget
+    nbytes: int
+
+    @property
+    def image(self):
+        # The newest frame of the batch e.g. for a preview
+        return self.images[-1]
+
+    @property
+    def count(self):
+        return len(self.images)
 
 def element_info(function):
     def wraper(*args, **kwargs):
@@ -23,67 +78,145 @@ def fromat_info(function):
         return result
     return wraper
 
+def round_up(value, multiple):
+    return (value + multiple - 1) // multiple * multiple
+
+def default_layout(format, width, height):
+    """
+    Returns the default strides and plane offsets used by Gstreamer for a raw video frame,
+    the rows are padded to a multiple of 4 bytes and the chroma planes of odd sizes are rounded up.
+
+    Args:
+        format (str): The video format (e.g., 'I420', 'YV12', 'YUY2', 'BGR', 'RGB').
+        width (int): Width of the frame.
+        height (int): Height of the frame.
+
+    Returns:
+        tuple: The list of the strides and the list of the offsets of the planes.
+    """
+    if format in ("I420", "YV12"):
+        y_stride, uv_stride = round_up(width, 4), round_up((width + 1) // 2, 4)
+        u_offset = y_stride * round_up(height, 2)
+        v_offset = u_offset + uv_stride * ((height + 1) // 2)
+        return [y_stride, uv_stride, uv_stride], [0, u_offset, v_offset]
+    elif format == "YUY2":
+        return [round_up(round_up(width, 2) * 2, 4)], [0]
+    elif format in ("BGR", "RGB"):
+        return [round_up(width * 3, 4)], [0]
+    raise ValueError(f"Unsupported format {format}")
+
+def plane(data, offset, stride, rows, row_bytes):
+    """
+    Returns a (rows, row_bytes) view of a plane of the frame, the row padding is left out without copying.
+    """
+    array = np.frombuffer(data, dtype=np.uint8, count=stride * (rows - 1) + row_bytes, offset=offset)
+    return np.lib.stride_tricks.as_strided(array, shape=(rows, row_bytes), strides=(stride, 1))
+
+def crop_into(image, height, width, out=None):
+    """
+    Returns the top left (height, width) region of an image, copied into out when given.
+    """
+    if out is None:
+        return image[:height, :width]
+    out[:] = image[:height, :width]
+    return out
+
 class RGB_Converter:
     """
     This class provides utility functions to convert YUV images to RGB format.
+    The YUV formats use the BT.601 limited range coefficients, as produced by videoconvert for the SD/HD test streams.
+    The strides and offsets of the planes default to the Gstreamer layout, so odd sizes and padded rows are handled.
     """
     def __init__(self) -> None:
-        pass
-
-    def buffer_to_rgb(self, data, w, h, format):
-        if format =="YUY2":
-            return self.yuy2_to_rgb(data, w, h)
-        elif format =="YV12":
-            return self.yv12_to_rgb(data, w, h)
-        elif format =="I420":
-            return self.i420_to_rgb(data, w, h)
-        elif format =="BGR":
-            return self.bgr_to_rgb(data, w, h)
-        else:
-            print("Wrong format",format)
+        # Bytes of the intermediate buffers allocated by the last conversion
+        self.scratch_bytes = 0
 
-    def bgr_to_rgb(self, data, width, height):
+    def buffer_to_rgb(self, data, w, h, format, strides=None, offsets=None, out=None):
+        """
+        Convert a raw video frame to RGB format.
+
+        Parameters:
+        data : Input image data.
+        w (int): Width of the input image.
+        h (int): Height of the input image.
+        format (str): Video format of the input image i.e. 'YUY2', 'YV12', 'I420', 'BGR' or 'RGB'.
+        strides (list, optional): Stride of every plane in bytes. Defaults to the Gstreamer layout.
+        offsets (list, optional): Offset of every plane in bytes. Defaults to the Gstreamer layout.
+        out (np.ndarray, optional): Contiguous (h, w, 3) array receiving the image e.g. a slot of a preallocated batch. Defaults to a new array.
+
+        Returns:
+        np.ndarray: Output image in RGB format, out when given.
+
+        Raises:
+        ValueError: If the format is not supported.
+        """
+        converters = {"YUY2": self.yuy2_to_rgb, "YV12": self.yv12_to_rgb, "I420": self.i420_to_rgb, "BGR": self.bgr_to_rgb, "RGB": self.rgb_to_rgb}
+        if format not in converters:
+            raise ValueError(f"Unsupported format {format}")
+        return converters[format](data, w, h, strides, offsets, out)
+
+    def bgr_to_rgb(self, data, width, height, strides=None, offsets=None, out=None):
         """
         Convert BGR image to RGB format.
 
         Parameters:
-        data : Input image data in YV12 format.
+        data : Input image data in BGR format.
         width (int): Width of the input image.
         height (int): Height of the input image.
+        strides (list, optional): Stride of the plane in bytes. Defaults to the Gstreamer layout.
+        offsets (list, optional): Offset of the plane in bytes. Defaults to the Gstreamer layout.
 
         Returns:
         np.ndarray: Output image in RGB format.
         """
-        numpy_array = np.ndarray((height, width, 3),buffer=data,dtype=np.uint8)
-        rgb_image = cv2.cvtColor(numpy_array, cv2.COLOR_BGR2RGB)
+        default_strides, default_offsets = default_layout("BGR", width, height)
+        strides, offsets = strides or default_strides, offsets or default_offsets
+        bgr_image = plane(data, offsets[0], strides[0], height, width * 3).reshape((height, width, 3))
+        rgb_image = cv2.cvtColor(bgr_image, cv2.COLOR_BGR2RGB, dst=out)
         return rgb_image
 
-    def yv12_to_rgb(self, data, width, height):
+    def rgb_to_rgb(self, data, width, height, strides=None, offsets=None, out=None):
+        """
+        Copy RGB image into a contiguous array.
+
+        Parameters:
+        data : Input image data in RGB format.
+        width (int): Width of the input image.
+        height (int): Height of the input image.
+        strides (list, optional): Stride of the plane in bytes. Defaults to the Gstreamer layout.
+        offsets (list, optional): Offset of the plane in bytes. Defaults to the Gstreamer layout.
+
+        Returns:
+        np.ndarray: Output image in RGB format.
+        """
+        default_strides, default_offsets = default_layout("RGB", width, height)
+        strides, offsets = strides or default_strides, offsets or default_offsets
+        rgb_image = plane(data, offsets[0], strides[0], height, width * 3).reshape((height, width, 3))
+        if out is not None:
+            out[:] = rgb_image
+            return out
+        return np.ascontiguousarray(rgb_image)
+
+    def yv12_to_rgb(self, data, width, height, strides=None, offsets=None, out=None):
         """
         Convert YV12 image to RGB format.
 
         Parameters:
-        data : Input image data in YV12 format.
+        data : Input image data in YV12 format i.e. I420 with the V plane before the U plane.
         width (int): Width of the input image.
         height (int): Height of the input image.
+        strides (list, optional): Stride of the Y, V and U planes in bytes. Defaults to the Gstreamer layout.
+        offsets (list, optional): Offset of the Y, V and U planes in bytes. Defaults to the Gstreamer layout.
 
         Returns:
         np.ndarray: Output image in RGB format.
         """
-        y_size = width * height
-        uv_size = int(y_size / 4)
-        y_plane = np.frombuffer(data[:y_size], dtype=np.uint8).reshape((height, width))
-        v_plane = np.frombuffer(data[(y_size + uv_size):], dtype=np.uint8).reshape((int(height / 2), int(width / 2)))
-        u_plane = np.frombuffer(data[(y_size):(y_size + uv_size)], dtype=np.uint8).reshape((int(height / 2), int(width / 2)))
-        u_plane = cv2.resize(u_plane, (width, height // 2), interpolation=cv2.INTER_LINEAR)
-        v_plane = cv2.resize(v_plane, (width, height // 2), interpolation=cv2.INTER_LINEAR)
-        u_plane = np.repeat(u_plane, 2, axis=0)  # Upsample U plane
-        v_plane = np.repeat(v_plane, 2, axis=0)  # Upsample V plane
-        yuv_image = np.dstack((y_plane, u_plane, v_plane))
-        rgb_image = cv2.cvtColor(yuv_image, cv2.COLOR_YUV2BGR)
-        return rgb_image
+        default_strides, default_offsets = default_layout("YV12", width, height)
+        strides, offsets = strides or default_strides, offsets or default_offsets
+        # Same layout as I420 with the chroma planes swapped
+        return self.i420_to_rgb(data, width, height, [strides[0], strides[2], strides[1]], [offsets[0], offsets[2], offsets[1]], out)
 
-    def yuy2_to_rgb(self, data, width, height):
+    def yuy2_to_rgb(self, data, width, height, strides=None, offsets=None, out=None):
         """
         Convert YUY2 image to RGB format.
 
@@ -91,20 +224,25 @@ class RGB_Converter:
         data : Input image data in YUY2 format.
         width (int): Width of the input image.
         height (int): Height of the input image.
+        strides (list, optional): Stride of the plane in bytes. Defaults to the Gstreamer layout.
+        offsets (list, optional): Offset of the plane in bytes. Defaults to the Gstreamer layout.
 
         Returns:
         np.ndarray: Output image in RGB format.
         """
-        # Convert the byte data to a numpy array with dtype uint8 and reshape it to the image dimensions
-        yuv2_array = np.frombuffer(data, dtype=np.uint8).reshape((height, width, 2))
+        default_strides, default_offsets = default_layout("YUY2", width, height)
+        strides, offsets = strides or default_strides, offsets or default_offsets
+        # An odd width still stores a whole Y0 U Y1 V macropixel at the end of every row
+        padded_width = round_up(width, 2)
+        yuv2_array = plane(data, offsets[0], strides[0], height, padded_width * 2).reshape((height, padded_width, 2))
 
         # Convert the YUV image to RGB format using OpenCV
-        rgb_image = cv2.cvtColor(yuv2_array, cv2.COLOR_YUV2RGB_YUYV)
+        if padded_width == width:
+            return cv2.cvtColor(yuv2_array, cv2.COLOR_YUV2RGB_YUYV, dst=out)
+        return crop_into(cv2.cvtColor(yuv2_array, cv2.COLOR_YUV2RGB_YUYV), height, width, out)
 
-        return rgb_image
 
-
-    def i420_to_rgb(self, data, width, height):
+    def i420_to_rgb(self, data, width, height, strides=None, offsets=None, out=None):
         """
         Convert I420 image to RGB format.
 
@@ -112,22 +250,33 @@ class RGB_Converter:
         data : Input image data in I420 format.
         width (int): Width of the input image.
         height (int): Height of the input image.
+        strides (list, optional): Stride of the Y, U and V planes in bytes. Defaults to the Gstreamer layout.
+        offsets (list, optional): Offset of the Y, U and V planes in bytes. Defaults to the Gstreamer layout.
 
         Returns:
         np.ndarray: Output image in RGB format.
         """
-        y_size = width * height
-        u_size = int(y_size / 4)
-        v_size = u_size
-        y_plane = np.frombuffer(data[:y_size], dtype=np.uint8).reshape((height, width))
-        u_plane = np.frombuffer(data[y_size:(y_size+u_size)], dtype=np.uint8).reshape((int(height / 2), int(width / 2)))
-        v_plane = np.frombuffer(data[(y_size+u_size):(y_size+u_size+v_size)], dtype=np.uint8).reshape((int(height / 2), int(width / 2)))
-        u_plane = cv2.resize(u_plane, (width, height // 2), interpolation=cv2.INTER_LINEAR)
-        v_plane = cv2.resize(v_plane, (width, height // 2), interpolation=cv2.INTER_LINEAR)
-        u_plane = np.repeat(u_plane, 2, axis=0)  # Upsample U plane
-        v_plane = np.repeat(v_plane, 2, axis=0)  # Upsample V plane
-        yuv_image = np.dstack((y_plane, u_plane, v_plane))
-        rgb_image = cv2.cvtColor(yuv_image, cv2.COLOR_YUV2RGB)
-        return rgb_image
-
-
+        default_strides, default_offsets = default_layout("I420", width, height)
+        strides, offsets = strides or default_strides, offsets or default_offsets
+        # OpenCV converts tightly packed planes of even size, the chroma planes already cover the odd row/column
+        chroma_width, chroma_height = (width + 1) // 2, (height + 1) // 2
+        even_width, even_height = chroma_width * 2, chroma_height * 2
+        if strides[0] == width and strides[1] == strides[2] == chroma_width and width == even_width and height == even_height \
+                and offsets[1] == width * height and offsets[2] == offsets[1] + chroma_width * chroma_height:
+            yuv_image = np.frombuffer(data, dtype=np.uint8, count=width * height * 3 // 2).reshape((height * 3 // 2, width))
+            self.scratch_bytes = 0
+        else:
+            yuv_image = np.empty((even_height * 3 // 2, even_width), dtype=np.uint8)
+            y_plane = yuv_image[:even_height]
+            y_plane[:height, :width] = plane(data, offsets[0], strides[0], height, width)
+            # Replicate the last column/row of an odd size
+            y_plane[:height, width:] = y_plane[:height, width - 1:width]
+            y_plane[height:] = y_plane[height - 1:height]
+            chroma = yuv_image[even_height:].reshape(-1)
+            chroma_size = chroma_width * chroma_height
+            chroma[:chroma_size].reshape((chroma_height, chroma_width))[:] = plane(data, offsets[1], strides[1], chroma_height, chroma_width)
+            chroma[chroma_size:].reshape((chroma_height, chroma_width))[:] = plane(data, offsets[2], strides[2], chroma_height, chroma_width)
+            self.scratch_bytes = yuv_image.nbytes
+        if (even_width, even_height) == (width, height):
+            return cv2.cvtColor(yuv_image, cv2.COLOR_YUV2RGB_I420, dst=out)
+        return crop_into(cv2.cvtColor(yuv_image, cv2.COLOR_YUV2RGB_I420), height, width, out)
@@ -0,0 +1,110 @@
+##################################################################################################################
+# Author: Vishal Kumar
+# Email: vishalkmr01123@gmail.com
+#
+# This file contains push_array which pushes a NumPy array into an appsrc without copying it.
+# PyGObject only builds a Gst.Buffer from a copy of the data (bytes), so the buffer is created with
+# gst_buffer_new_wrapped_full on the memory of the array through ctypes: the array is kept alive until Gstreamer
+# frees the memory (the destroy notify drops the reference), and the memory is read-only so an element writing in
+# place (textoverlay...) works on a copy. The array must not be modified by the producer once pushed.
+# When the Gstreamer libraries can't be loaded with ctypes the data is copied into a Gst.Buffer as before.
+##################################################################################################################
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+import ctypes, ctypes.util, itertools, threading
+import numpy as np
+from shared import shared_instance
+
+
+class GstMiniObject(ctypes.Structure):
+    _fields_ = [("type", ctypes.c_size_t), ("refcount", ctypes.c_int), ("lockstate", ctypes.c_int), ("flags", ctypes.c_uint),
+                ("copy", ctypes.c_void_p), ("dispose", ctypes.c_void_p), ("free", ctypes.c_void_p),
+                ("priv_uint", ctypes.c_uint), ("priv_pointer", ctypes.c_void_p)]
+
+
+class GstBuffer(ctypes.Structure):
+    # Public part of the GstBuffer struct, stable across Gstreamer 1.x
+    _fields_ = [("mini_object", GstMiniObject), ("pool", ctypes.c_void_p), ("pts", ctypes.c_uint64), ("dts", ctypes.c_uint64),
+                ("duration", ctypes.c_uint64), ("offset", ctypes.c_uint64), ("offset_end", ctypes.c_uint64)]
+
+
+DESTROY_NOTIFY = ctypes.CFUNCTYPE(None, ctypes.c_void_p)
+
+# Arrays wrapped by the buffers not freed yet, by key (the user data of the destroy notify)
+wrapped_arrays = {}
+wrapped_arrays_lock = threading.Lock()
+wrapped_keys = itertools.count(1)
+
+
+@DESTROY_NOTIFY
+def release_array(key):
+    # Called from the thread freeing the buffer memory
+    with wrapped_arrays_lock:
+        wrapped_arrays.pop(key, None)
+
+
+def load_libraries():
+    """
+    Returns the gstreamer and gstapp libraries loaded with ctypes, None if they are not found.
+    """
+    paths = [ctypes.util.find_library(name) for name in ("gstreamer-1.0", "gstapp-1.0")]
+    if None in paths:
+        print("Warning: Gstreamer libraries not found by ctypes, the arrays pushed into appsrc are copied")
+        return None
+    libgst, libgstapp = ctypes.CDLL(paths[0]), ctypes.CDLL(paths[1])
+    libgst.gst_buffer_new_wrapped_full.restype = ctypes.c_void_p
+    libgst.gst_buffer_new_wrapped_full.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_size_t, ctypes.c_size_t, ctypes.c_size_t, ctypes.c_void_p, DESTROY_NOTIFY]
+    libgstapp.gst_app_src_push_buffer.restype = ctypes.c_int
+    libgstapp.gst_app_src_push_buffer.argtypes = [ctypes.c_void_p, ctypes.c_void_p]
+    ctypes.pythonapi.PyCapsule_GetPointer.restype = ctypes.c_void_p
+    ctypes.pythonapi.PyCapsule_GetPointer.argtypes = [ctypes.py_object, ctypes.c_char_p]
+    return libgst, libgstapp
+
+
+@shared_instance
+def get_libraries():
+    return load_libraries() or ()
+
+
+def push_array(appsrc, array, pts=None, duration=None):
+    """
+    Pushes the memory of an array into an appsrc as one buffer, without copying it if the array is contiguous.
+
+    Args:
+        appsrc (Gst.Element): The appsrc element.
+        array (np.ndarray or bytes-like): The data of the buffer e.g. an RGB frame, it must not be modified once pushed.
+        pts (int, optional): The presentation timestamp in ns. Defaults to none.
+        duration (int, optional): The duration in ns. Defaults to none.
+
+    Returns:
+        Gst.FlowReturn: The result of the push e.g. FLUSHING or EOS once the appsrc doesn't accept buffers anymore.
+    """
+    array = np.ascontiguousarray(np.frombuffer(array, dtype=np.uint8) if not isinstance(array, np.ndarray) else array)
+    pts = pts if pts is not None else Gst.CLOCK_TIME_NONE
+    duration = duration if duration is not None else Gst.CLOCK_TIME_NONE
+    libs = get_libraries()
+    if not libs:
+        buffer = Gst.Buffer.new_wrapped(array.tobytes())
+        buffer.pts, buffer.duration = pts, duration
+        return appsrc.emit("push-buffer", buffer)
+
+    libgst, libgstapp = libs
+    key = next(wrapped_keys)
+    with wrapped_arrays_lock:
+        wrapped_arrays[key] = array
+    pointer = libgst.gst_buffer_new_wrapped_full(int(Gst.MemoryFlags.READONLY), array.ctypes.data, array.nbytes, 0, array.nbytes, key, release_array)
+    if not pointer:
+        release_array(key)
+        return Gst.FlowReturn.ERROR
+    buffer = GstBuffer.from_address(pointer)
+    buffer.pts, buffer.duration = pts, duration
+    # The appsrc takes the ownership of the buffer
+    element = ctypes.pythonapi.PyCapsule_GetPointer(appsrc.__gpointer__, None)
+    return Gst.FlowReturn(libgstapp.gst_app_src_push_buffer(element, pointer))
+
+
+def wrapped_report():
+    with wrapped_arrays_lock:
+        return {"arrays": len(wrapped_arrays), "bytes": sum(array.nbytes for array in wrapped_arrays.values())}